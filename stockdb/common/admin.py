@@ -23,3 +23,26 @@ class IndustryAdmin(admin.ModelAdmin):
 @admin.register(Period)
 class PeriodAdmin(admin.ModelAdmin):
     list_display = [f.name for f in Period._meta.local_fields]
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'progress', 'dates', 'rows', 'rows_per_sec', 'api_calls', 'eta',
+                    'worker', 'dt_started', 'dt_finished']
+    list_filter = ('status', 'name')
+    readonly_fields = [f.name for f in Job._meta.local_fields]
+    # refreshed while any job is pending or running, see the template
+    change_list_template = 'admin/common/job/change_list.html'
+
+    def progress(self, obj):
+        if obj.percent is not None:
+            return '%s%% (%s/%s)' % (obj.percent, obj.done, obj.total or '?')
+        return '%s/?' % obj.done if obj.done else '-'
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = dict(extra_context or {},
+                             refresh=Job.objects.filter(status__in=[Job.PENDING, Job.RUNNING]).exists())
+        return super(JobAdmin, self).changelist_view(request, extra_context)
+
+    def has_add_permission(self, request):
+        return False
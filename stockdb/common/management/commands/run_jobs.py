@@ -0,0 +1,69 @@
+import os
+import time
+import socket
+import threading
+from datetime import datetime
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from common.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run the worker pool of the background jobs enqueued by the admin actions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='The jobs run concurrently.')
+        parser.add_argument('--poll', type=float, default=2, help='Seconds to wait when no job is pending.')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is pending.')
+
+    @staticmethod
+    def is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # a process of another user
+            return True
+        return True
+
+    def handle(self, *args, **options):
+        host = socket.gethostname()
+        # the jobs left running by the exited pools on this host, the other pools alive keep theirs
+        running = Job.objects.filter(status=Job.RUNNING, worker__startswith=host + ':').values_list('pk', 'worker')
+        # this pool has not claimed any job yet, its PID in a worker is reused from an exited pool
+        stale = [pk for pk, worker in running
+                 if int(worker.split(':')[1]) == os.getpid() or not self.is_alive(int(worker.split(':')[1]))]
+        Job.objects.filter(pk__in=stale, status=Job.RUNNING).update(
+            status=Job.FAILED, error='The worker exited before the job finished.', dt_finished=timezone.now())
+
+        stopped = threading.Event()
+
+        def work(i):
+            name = '%s:%s:%s' % (host, os.getpid(), i)
+            try:
+                while not stopped.is_set():
+                    job = Job.claim(name)
+                    if job is None:
+                        if options['once']:
+                            break
+                        stopped.wait(options['poll'])
+                        continue
+                    print('%s: job %s started: %s on %s' % (datetime.now(), job.pk, job.name, name))
+                    job.run()
+                    print('%s: job %s %s' % (datetime.now(), job.pk, job.status))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(i, ), daemon=True) for i in range(options['workers'])]
+        for t in threads: t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stopped.set()
+            self.stdout.write('Stopping, waiting for the running jobs.')
+            for t in threads: t.join()
@@ -1,4 +1,11 @@
+import json
+import inspect
+import traceback
+from datetime import timedelta
+from importlib import import_module
+
 from django.db import models
+from django.utils import timezone
 
 
 # Create your models here.
@@ -56,3 +63,107 @@ class Period(models.Model):
 
     def __str__(self):
         return '%s (%s)' % (self.name, self.code)
+
+
+class Job(models.Model):
+    """
+    The background job, enqueued in this table and run by the worker pool of `manage.py run_jobs`.
+    The target is a callable by its path, example: 'stock.models:StockPeriod.sync_daily_from_tushare',
+    called with the kwargs, and `progress=job.report` if it accepts a `progress` argument.
+    """
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [(x, x) for x in (PENDING, RUNNING, DONE, FAILED)]
+
+    # The min seconds between the progress writes.
+    REPORT_INTERVAL = 2
+
+    name = models.CharField(max_length=64)
+    target = models.CharField(max_length=128)
+    kwargs = models.TextField(default='{}', help_text='JSON of the keyword arguments.')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    done = models.IntegerField(default=0, help_text='The steps done, example: the API calls of the dates.')
+    total = models.IntegerField(null=True, blank=True, help_text='The total steps, if known.')
+    dates = models.IntegerField(default=0, help_text='The dates synced.')
+    rows = models.IntegerField(default=0)
+    api_calls = models.IntegerField(default=0)
+    rows_per_sec = models.FloatField(null=True, blank=True)
+    eta = models.DateTimeField('ETA', null=True, blank=True)
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    worker = models.CharField(max_length=64, null=True, blank=True)
+    dt_started = models.DateTimeField('Started', null=True, blank=True)
+    dt_finished = models.DateTimeField('Finished', null=True, blank=True)
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.name, self.status)
+
+    @classmethod
+    def enqueue(cls, name, target, **kwargs):
+        return cls.objects.create(name=name, target=target, kwargs=json.dumps(kwargs))
+
+    @classmethod
+    def claim(cls, worker):
+        """
+        Take the earliest pending job, by a conditional update so that each job is run once by the workers.
+        RETURN:
+            The job, or None if no pending job.
+        """
+        for pk in cls.objects.filter(status=cls.PENDING).order_by('pk').values_list('pk', flat=True)[:10]:
+            if cls.objects.filter(pk=pk, status=cls.PENDING).update(
+                    status=cls.RUNNING, worker=worker, dt_started=timezone.now()):
+                return cls.objects.get(pk=pk)
+        return None
+
+    def get_target(self):
+        module, _, attrs = self.target.partition(':')
+        func = import_module(module)
+        for attr in attrs.split('.'):
+            func = getattr(func, attr)
+        return func
+
+    @property
+    def percent(self):
+        if self.status == self.DONE:
+            return 100.0
+        return round(self.done * 100.0 / self.total, 1) if self.total else None
+
+    def report(self, done=None, total=None, dates=None, rows=None, api_calls=None, force=False):
+        """
+        Record the progress, written at most once per REPORT_INTERVAL unless forced.
+        """
+        for field, value in [('done', done), ('total', total), ('dates', dates), ('rows', rows), ('api_calls', api_calls)]:
+            if value is not None:
+                setattr(self, field, value)
+        now = timezone.now()
+        if not force and getattr(self, '_reported', None) and (now - self._reported).total_seconds() < self.REPORT_INTERVAL:
+            return
+        self._reported = now
+
+        elapse = max((now - self.dt_started).total_seconds(), 0.001) if self.dt_started else None
+        if elapse:
+            self.rows_per_sec = round(self.rows / elapse, 1)
+            if self.total and self.done:
+                self.eta = now + timedelta(seconds=elapse / self.done * (self.total - self.done))
+        Job.objects.filter(pk=self.pk).update(done=self.done, total=self.total, dates=self.dates, rows=self.rows,
+                                              api_calls=self.api_calls, rows_per_sec=self.rows_per_sec, eta=self.eta)
+
+    def run(self):
+        func = self.get_target()
+        kwargs = json.loads(self.kwargs or '{}')
+        if 'progress' in inspect.signature(func).parameters:
+            kwargs['progress'] = self.report
+        try:
+            result = func(**kwargs)
+        except Exception:
+            self.status, self.error = self.FAILED, traceback.format_exc()
+        else:
+            self.status, self.result = self.DONE, repr(result)[:10000]
+        self.dt_finished = timezone.now()
+        self.report(force=True)
+        Job.objects.filter(pk=self.pk).update(status=self.status, result=self.result, error=self.error,
+                                              dt_finished=self.dt_finished)
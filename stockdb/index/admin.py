@@ -15,3 +15,15 @@ class IndexStockRefAdmin(admin.ModelAdmin):
     list_display = [f.name for f in IndexStockRef._meta.local_fields]
 
 
+@admin.register(IndexLevel)
+class IndexLevelAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in IndexLevel._meta.local_fields]
+    list_filter = ('index', )
+    date_hierarchy = 'date'
+
+
+@admin.register(IndexContribution)
+class IndexContributionAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in IndexContribution._meta.local_fields]
+    list_filter = ('index', )
+    date_hierarchy = 'date'
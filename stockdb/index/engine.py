@@ -0,0 +1,127 @@
+from datetime import datetime
+
+import numpy
+import pandas
+from django.db import transaction
+
+from index.models import Index, IndexStockRef, IndexLevel, IndexContribution
+from stock.models import StockPeriod, str_to_date
+from utils.db import bulk_upsert, frame_to_rows
+
+
+class IndexEngine:
+    """
+    Compute the daily levels of the index from the constituent weights of IndexStockRef and
+    the DAILY closes, vectorized across the dates:
+        return(t) = sum(weight(i) * (close(i, t) / pre_close(i, t) - 1))
+        level(t) = level(t - 1) * (1 + return(t))
+        points(i, t) = level(t - 1) * weight(i) * return(i, t)
+    The weights are normalized to sum 1 and rebalanced daily, the suspended stocks return 0.
+    The first level is based on BASE_LEVEL.
+    """
+    BASE_LEVEL = 1000.0
+
+    def __init__(self, index):
+        """
+        PARAMS:
+            * index:    The Index or its code.
+        """
+        self.index = index if isinstance(index, Index) else Index.objects.get(code=index)
+
+    def get_weights(self):
+        """
+        RETURN:
+            Series of the normalized weights indexed by stock_id.
+        """
+        weights = pandas.Series(dict(IndexStockRef.objects.filter(index_id=self.index.code).values_list(
+            'stock_id', 'weight')), dtype='float64')
+        total = weights.sum()
+        return weights / total if total else weights
+
+    def compute(self, start_date=None, end_date=None):
+        """
+        Compute the levels on the DAILY dates between the dates, continued from the stored level
+        before `start_date`.
+        RETURN:
+            (DataFrame of the levels indexed by date, with columns: level, percent,
+             DataFrame of the contributions, with columns: stock_id, date, weight, percent, points)
+        """
+        weights = self.get_weights()
+        start_date, end_date = str_to_date(start_date), str_to_date(end_date)
+        previous = None
+        if start_date:
+            previous = IndexLevel.objects.filter(index_id=self.index.code, date__lt=start_date).order_by(
+                '-date').values_list('level', flat=True).first()
+            # not continued from a stored level, computed from the beginning
+            start_date = start_date if previous is not None else None
+        base = float(previous) if previous is not None else self.BASE_LEVEL
+
+        qs = StockPeriod.objects.filter(period_id='DAILY', stock_id__in=list(weights.index))
+        if start_date:
+            qs = qs.filter(date__gte=start_date)
+        if end_date:
+            qs = qs.filter(date__lte=end_date)
+        return self.compute_levels(qs.to_frame(['date', 'stock_id', 'close', 'pre_close']), weights, base)
+
+    @classmethod
+    def compute_levels(cls, df, weights, base=None):
+        """
+        PARAMS:
+            * df:       DataFrame of the DAILY bars, with columns: date, stock_id, close, pre_close.
+            * weights:  Series of the normalized weights indexed by stock_id.
+            * base:     The level before the first date.
+                        If None, BASE_LEVEL.
+        RETURN:
+            The same as `compute()`.
+        """
+        base = cls.BASE_LEVEL if base is None else base
+        returns = pandas.DataFrame({'date': df.date.values, 'stock_id': df.stock_id.astype(str).values,
+                                    'ret': (df.close / df.pre_close - 1).values})
+        returns = returns.pivot(index='date', columns='stock_id', values='ret')
+        returns = returns.reindex(columns=weights.index).fillna(0.0)
+
+        w = weights.values
+        index_returns = returns.values @ w
+        levels = base * numpy.cumprod(1 + index_returns)
+        prev_levels = numpy.concatenate([[base], levels[:-1]])
+        points = prev_levels[:, None] * w[None, :] * returns.values
+
+        dates = returns.index
+        levels = pandas.DataFrame({'level': levels, 'percent': index_returns * 100}, index=dates)
+        contributions = pandas.DataFrame({
+            'stock_id': numpy.tile(weights.index.values, len(dates)),
+            'date': numpy.repeat(dates.values, len(weights)),
+            'weight': numpy.tile(w, len(dates)),
+            'percent': returns.values.ravel() * 100,
+            'points': points.ravel(),
+        })
+        return levels, contributions
+
+    def update(self, start_date=None, end_date=None):
+        """
+        Compute and replace the stored levels and contributions between the dates.
+        RETURN:
+            The number of the levels written.
+        """
+        levels, contributions = self.compute(start_date, end_date)
+        if levels.empty:
+            return 0
+        levels = levels.assign(index_id=self.index.code, date=levels.index.date,
+                               level=levels.level.round(4), percent=levels.percent.round(4))
+        contributions = contributions.assign(index_id=self.index.code, date=pandas.to_datetime(contributions.date).dt.date,
+                                             weight=contributions.weight.round(6),
+                                             percent=contributions.percent.round(4), points=contributions.points.round(4))
+        first, last = levels.date.iloc[0], levels.date.iloc[-1]
+
+        level_fields = ['index_id', 'date', 'level', 'percent']
+        contribution_fields = ['index_id', 'stock_id', 'date', 'weight', 'percent', 'points']
+        with transaction.atomic():
+            IndexLevel.objects.filter(index_id=self.index.code, date__gte=first, date__lte=last).delete()
+            IndexContribution.objects.filter(index_id=self.index.code, date__gte=first, date__lte=last).delete()
+            written = bulk_upsert(IndexLevel, level_fields, frame_to_rows(levels, level_fields),
+                                  unique_fields=['index_id', 'date'])
+            bulk_upsert(IndexContribution, contribution_fields, frame_to_rows(contributions, contribution_fields),
+                        unique_fields=['index_id', 'stock_id', 'date'])
+        print('%s: index %s: levels computed, dates: %s, last: %.4f'
+              % (datetime.now(), self.index.code, written, levels.level.iloc[-1]))
+        return written
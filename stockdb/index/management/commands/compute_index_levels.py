@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from index.models import Index
+from index.engine import IndexEngine
+
+
+class Command(BaseCommand):
+    help = 'Compute the daily levels and contributions of the indexes, they are updated after syncs then.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--indexes', nargs='*', help='The index codes. If omitted, all the indexes with constituents.')
+        parser.add_argument('--start-date', help='Example: 20200101. If omitted, from the beginning.')
+
+    def handle(self, *args, **options):
+        indexes = Index.objects.filter(stocks__isnull=False).distinct()
+        if options['indexes']:
+            indexes = indexes.filter(code__in=options['indexes'])
+        for index in indexes:
+            rows = IndexEngine(index).update(options['start_date'])
+            self.stdout.write('%s: %s levels' % (index.code, rows))
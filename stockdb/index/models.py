@@ -43,3 +43,35 @@ class IndexStockRef(models.Model):
     weight = models.DecimalField(max_digits=3, decimal_places=2)
     dt_created = models.DateTimeField('Created', auto_now_add=True)
     dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+
+class IndexLevel(models.Model):
+    """
+    The daily levels of the index computed by `index.engine.IndexEngine`.
+    """
+    index = models.ForeignKey(Index, to_field='code', on_delete=models.DO_NOTHING, related_name='levels')
+    date = models.DateField(db_index=True)
+    level = models.DecimalField(max_digits=16, decimal_places=4)
+    percent = models.DecimalField(max_digits=8, decimal_places=4)
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    class Meta:
+        unique_together = ('index', 'date')
+
+
+class IndexContribution(models.Model):
+    """
+    The daily contributions of the constituents to the index level, in points.
+    """
+    index = models.ForeignKey(Index, to_field='code', on_delete=models.DO_NOTHING, related_name='contributions')
+    stock = models.ForeignKey(Stock, to_field='code', on_delete=models.DO_NOTHING, related_name='index_contributions')
+    date = models.DateField(db_index=True)
+    weight = models.DecimalField(max_digits=8, decimal_places=6)
+    percent = models.DecimalField(max_digits=8, decimal_places=4, help_text='The return of the stock.')
+    points = models.DecimalField(max_digits=16, decimal_places=4)
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    class Meta:
+        unique_together = ('index', 'stock', 'date')
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.dispatch import receiver
+
+from index.models import Index
+from stock.models import StockPeriod
+from stock.signals import stockperiod_synced
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def update_index_levels(sender, period, markets, dates, **kwargs):
+    if not settings.STOCKDB_INDEX_LEVELS or period != 'DAILY' or not dates:
+        return
+    from index.engine import IndexEngine
+    # the levels after the synced dates are continued from them, so computed again
+    for index in Index.objects.filter(stocks__isnull=False).distinct():
+        IndexEngine(index).update(start_date=min(dates))
@@ -1,3 +1,37 @@
-from django.test import TestCase
+import pandas
+from django.test import SimpleTestCase
+
+from index.engine import IndexEngine
+
 
 # Create your tests here.
+
+class IndexEngineTest(SimpleTestCase):
+
+    def setUp(self):
+        self.weights = pandas.Series({'A': 0.6, 'B': 0.4})
+        # B is suspended on the 2nd date
+        self.bars = pandas.DataFrame({
+            'date': pandas.to_datetime(['19990104', '19990104', '19990105', '19990106', '19990106']),
+            'stock_id': ['A', 'B', 'A', 'A', 'B'],
+            'close': [11.0, 19.0, 11.0, 9.9, 20.9],
+            'pre_close': [10.0, 20.0, 11.0, 11.0, 19.0],
+        })
+
+    def test_levels(self):
+        levels, contributions = IndexEngine.compute_levels(self.bars, self.weights)
+        # 0.6 * 10% + 0.4 * -5%, 0, 0.6 * -10% + 0.4 * 10%
+        self.assertEqual(levels.level.round(4).tolist(), [1040.0, 1040.0, 1019.2])
+        self.assertEqual(levels.percent.round(4).tolist(), [4.0, 0.0, -2.0])
+
+        points = contributions.set_index(['date', 'stock_id']).points.round(4)
+        self.assertEqual(points[(pandas.Timestamp('19990106'), 'A')], -62.4)
+        self.assertEqual(points[(pandas.Timestamp('19990106'), 'B')], 41.6)
+        self.assertEqual(points[(pandas.Timestamp('19990105'), 'B')], 0.0)
+        # the points of the constituents sum to the change of the level
+        changes = contributions.groupby('date').points.sum().round(4)
+        self.assertEqual(changes.tolist(), [40.0, 0.0, -20.8])
+
+    def test_continued(self):
+        levels, _ = IndexEngine.compute_levels(self.bars[self.bars.date > '19990104'], self.weights, base=1040.0)
+        self.assertEqual(levels.level.round(4).tolist(), [1040.0, 1019.2])
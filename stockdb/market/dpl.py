@@ -0,0 +1,173 @@
+"""
+Compiler of the Daily Price Limit rules, `Subject.dpl_rule`.
+
+A rule is a Python expression of the limit ratio, -1 for unlimited, example:
+    0.1
+    0.05 if st else 0.1
+    -1 if days <= 5 else 0.2
+The names in the rules:
+    * pre_close:    The previous close.
+    * days:         The trading days since listed, 1 on the first day.
+    * st:           If the stock is under the special treatment, ST or *ST.
+The rules are parsed once and compiled to functions over the arrays of the names, with the
+conditional expressions and boolean operators rewritten to their numpy forms.
+"""
+import ast
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+import numpy
+
+from market.models import Subject, SubjectHist
+
+
+class RuleError(ValueError):
+    pass
+
+
+class Vectorize(ast.NodeTransformer):
+    """
+    Rewrite the expression to numpy operations, the nodes not in NODES are rejected.
+    """
+    NAMES = ('pre_close', 'days', 'st')
+    FUNCTIONS = {'min': 'minimum', 'max': 'maximum', 'abs': 'absolute', 'round': 'round'}
+    NODES = (ast.Expression, ast.Constant, ast.Name, ast.Load, ast.BinOp, ast.UnaryOp, ast.IfExp,
+             ast.Compare, ast.BoolOp, ast.Call, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd,
+             ast.Not, ast.And, ast.Or, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+    def generic_visit(self, node):
+        if not isinstance(node, self.NODES):
+            raise RuleError('unsupported `%s` in the rule.' % type(node).__name__)
+        return super(Vectorize, self).generic_visit(node)
+
+    @staticmethod
+    def call(func, args):
+        return ast.Call(func=ast.Attribute(value=ast.Name(id='numpy', ctx=ast.Load()), attr=func, ctx=ast.Load()),
+                        args=args, keywords=[])
+
+    def visit_Name(self, node):
+        if node.id not in self.NAMES:
+            raise RuleError('unknown name `%s` in the rule.' % node.id)
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self.call('where', [node.test, node.body, node.orelse])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = self.call(func, [result, value])
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self.call('logical_not', [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        parts = [ast.Compare(left=left, ops=[op], comparators=[right])
+                 for left, op, right in zip(operands, node.ops, operands[1:])]
+        result = parts[0]
+        for part in parts[1:]:
+            result = self.call('logical_and', [result, part])
+        return result
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in self.FUNCTIONS or node.keywords:
+            raise RuleError('unsupported call in the rule.')
+        args = [self.visit(x) for x in node.args]
+        return self.call(self.FUNCTIONS[node.func.id], args)
+
+
+def compile_rule(rule):
+    """
+    RETURN:
+        Function of (pre_close, days, st) arrays, returning the array of the limit ratios, -1 for unlimited.
+    """
+    try:
+        tree = ast.parse(rule.strip(), mode='eval')
+    except SyntaxError as e:
+        raise RuleError('invalid rule `%s`: %s' % (rule, e))
+    tree = ast.fix_missing_locations(Vectorize().visit(tree))
+    code = compile(tree, '<dpl_rule>', 'eval')
+
+    def evaluate(pre_close, days, st):
+        result = eval(code, {'__builtins__': {}, 'numpy': numpy}, {'pre_close': pre_close, 'days': days, 'st': st})
+        return numpy.broadcast_to(numpy.asarray(result, dtype=numpy.float64), numpy.shape(pre_close))
+    evaluate.rule = rule
+    return evaluate
+
+
+def limit_prices(pre_close, ratio):
+    """
+    RETURN:
+        (The up limits, the down limits) rounded half up to 0.01, NaN if unlimited.
+    """
+    unlimited = ratio < 0
+    up = numpy.floor(pre_close * (1 + ratio) * 100 + 0.5) / 100
+    down = numpy.floor(pre_close * (1 - ratio) * 100 + 0.5) / 100
+    return numpy.where(unlimited, numpy.nan, up), numpy.where(unlimited, numpy.nan, down)
+
+
+class RuleBook:
+    """
+    The point-in-time rules of the subjects, by the current `Subject.dpl_rule` and the
+    `dpl_rule` changes in SubjectHist. Each distinct rule is compiled once.
+    """
+
+    def __init__(self):
+        self.compiled = {}
+        self.versions = {}
+        current = dict(Subject.objects.values_list('code', 'dpl_rule'))
+        changes = SubjectHist.objects.filter(field='dpl_rule').order_by('dt_started').values_list(
+            'Subject_id', 'dt_started', 'old_value', 'new_value')
+
+        by_subject = {}
+        for subject, started, old, new in changes:
+            by_subject.setdefault(subject, []).append((started.date(), old, new))
+        for subject, rule in current.items():
+            hist = by_subject.get(subject, [])
+            # [(start date, rule)], the first one starts from the beginning
+            versions = [(date.min, hist[0][1] if hist and hist[0][1] else rule)]
+            versions.extend((started, new) for started, old, new in hist)
+            self.versions[subject] = versions
+
+    def get_rule(self, subject, day):
+        """
+        RETURN:
+            The compiled rule of the subject on the date, or None if no rule.
+        """
+        versions = self.versions.get(subject)
+        if not versions:
+            return None
+        rule = versions[bisect_right([x[0] for x in versions], day) - 1][1]
+        return self.compile(rule)
+
+    def get_ranges(self, subject, dates):
+        """
+        PARAMS:
+            * dates:    The sorted dates.
+        RETURN:
+            [(start, end, compiled rule or None), ...] of the slices of the dates under each version.
+        """
+        versions = self.versions.get(subject) or [(date.min, None)]
+        ranges = []
+        for i, (started, rule) in enumerate(versions):
+            ended = versions[i + 1][0] if i + 1 < len(versions) else date.max
+            start, end = bisect_left(dates, started), bisect_left(dates, ended)
+            if start < end:
+                ranges.append((start, end, self.compile(rule)))
+        return ranges
+
+    def compile(self, rule):
+        if not rule or not rule.strip():
+            return None
+        if rule not in self.compiled:
+            self.compiled[rule] = compile_rule(rule)
+        return self.compiled[rule]
@@ -1,3 +1,32 @@
-from django.test import TestCase
+import numpy
+from django.test import SimpleTestCase
+
+from market.dpl import RuleError, compile_rule, limit_prices
+
 
 # Create your tests here.
+
+class CompileRuleTest(SimpleTestCase):
+
+    def test_rule(self):
+        rule = compile_rule('-1 if days <= 5 else 0.05 if st else 0.1')
+        ratio = rule(numpy.array([10.0, 10.0, 10.0]), numpy.array([1, 6, 6]), numpy.array([False, True, False]))
+        numpy.testing.assert_allclose(ratio, [-1, 0.05, 0.1])
+
+    def test_limit_prices(self):
+        up, down = limit_prices(numpy.array([10.05, 10.0]), numpy.array([0.1, -1]))
+        numpy.testing.assert_allclose(up, [11.06, numpy.nan])
+        numpy.testing.assert_allclose(down, [9.05, numpy.nan])
+
+    def test_rejected(self):
+        for rule in [
+            "__import__('os').system('ls')",
+            'pre_close.__class__',
+            '[x for x in days]',
+            'lambda: 0.1',
+            'close * 0.1',
+            'max(pre_close, key=days)',
+            '0.1 if',
+        ]:
+            with self.subTest(rule=rule), self.assertRaises(RuleError):
+                compile_rule(rule)
@@ -3,9 +3,19 @@ from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from admin_actions.admin import ActionsModelAdmin
 
+from common.models import Job
 from .models import *
 
 
+def enqueue(request, modeladmin, name, target, **kwargs):
+    """
+    Enqueue the job for the `run_jobs` workers instead of running it in the request.
+    """
+    job = Job.enqueue(name, target, **kwargs)
+    modeladmin.message_user(request, 'Job %s enqueued: %s, see the progress in Jobs.' % (job.pk, name))
+    return redirect(reverse_lazy('admin:common_job_changelist'))
+
+
 # Register your models here.
 
 @admin.register(Stock)
@@ -13,8 +23,7 @@ class StockAdmin(ActionsModelAdmin):
     list_display = [f.name for f in Stock._meta.local_fields]
     actions_list = ('sync_from_tushare', )
     def sync_from_tushare(self, request):
-        self.model.sync_from_tushare()
-        return redirect(reverse_lazy('admin:stock_stock_changelist'))
+        return enqueue(request, self, 'Stock.sync_from_tushare', 'stock.models:Stock.sync_from_tushare')
 
 
 @admin.register(StockHist)
@@ -27,7 +36,43 @@ class StockPeriodAdmin(ActionsModelAdmin):
     list_display = [f.name for f in StockPeriod._meta.local_fields]
     actions_list = ('sync_daily_from_tushare', )
     def sync_daily_from_tushare(self, request):
-        self.model.sync_dialy_from_tushare()
-        return redirect(reverse_lazy('admin:stock_stockperiod_changelist'))
+        return enqueue(request, self, 'StockPeriod.sync_daily_from_tushare',
+                       'stock.models:StockPeriod.sync_daily_from_tushare')
+
+
+@admin.register(StockPeriodManifest)
+class StockPeriodManifestAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in StockPeriodManifest._meta.local_fields]
+    list_filter = ('market', 'period')
+    date_hierarchy = 'date'
+
+
+@admin.register(StockPeriodSyncLedger)
+class StockPeriodSyncLedgerAdmin(ActionsModelAdmin):
+    list_display = [f.name for f in StockPeriodSyncLedger._meta.local_fields]
+    list_filter = ('market', 'period', 'status')
+    date_hierarchy = 'date'
+    actions_list = ('backfill_daily_from_tushare', 'repair_daily_from_tushare')
+    def backfill_daily_from_tushare(self, request):
+        return enqueue(request, self, 'StockPeriod.backfill_daily_from_tushare',
+                       'stock.models:StockPeriod.backfill_daily_from_tushare')
+    def repair_daily_from_tushare(self, request):
+        return enqueue(request, self, 'StockPeriod.repair_daily_from_tushare',
+                       'stock.models:StockPeriod.repair_daily_from_tushare')
+
+
+@admin.register(StockAdjFactor)
+class StockAdjFactorAdmin(ActionsModelAdmin):
+    list_display = [f.name for f in StockAdjFactor._meta.local_fields]
+    list_filter = ('market', )
+    date_hierarchy = 'date'
+    actions_list = ('sync_from_tushare', )
+    def sync_from_tushare(self, request):
+        return enqueue(request, self, 'StockAdjFactor.sync_from_tushare', 'stock.models:StockAdjFactor.sync_from_tushare')
 
 
+@admin.register(StockLimit)
+class StockLimitAdmin(admin.ModelAdmin):
+    list_display = [f.name for f in StockLimit._meta.local_fields]
+    list_filter = ('market', 'flags')
+    date_hierarchy = 'date'
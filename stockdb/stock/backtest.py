@@ -0,0 +1,169 @@
+"""
+Vectorized backtest of the weights over the memory-mapped DAILY panel.
+
+The weights are a dates x stocks array of the target weights, decided and traded at the
+close of each date, and held over the next date. The stocks not tradable on a date keep
+their drifted weights:
+    * Not listed:   Before `Stock.dt_listed`, or since `Stock.dt_delisted`.
+    * Suspended:    No bar, or no volume.
+The daily returns are `close / pre_close - 1`, the `pre_close` of the exchange is adjusted
+on the ex-dates, so the returns include the corporate actions.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import pandas
+
+from stock.models import Stock, date_to_str
+from stock.panel import Panel
+
+
+class Backtest:
+    """
+    PARAMS:
+        * panel:        The `stock.panel.Panel`.
+        * returns:      The daily returns, dates x stocks, NaN if no bar.
+        * tradable:     The tradable mask, dates x stocks.
+        * buy_cost:     The cost rate of the bought value.
+        * sell_cost:    The cost rate of the sold value, including the stamp tax.
+        * leverage:     The max sum of the absolute weights.
+    """
+    TRADING_DAYS = 252
+
+    def __init__(self, panel, returns, tradable, buy_cost=0.0003, sell_cost=0.0013, leverage=1.0):
+        self.panel = panel
+        self.returns = returns
+        self.tradable = tradable
+        self.buy_cost = buy_cost
+        self.sell_cost = sell_cost
+        self.leverage = leverage
+
+    @classmethod
+    def get_arrays(cls, panel):
+        """
+        RETURN:
+            (The daily returns, the tradable mask), dates x stocks.
+        """
+        close, pre_close, volume = panel.get('close'), panel.get('pre_close'), panel.get('volume')
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            returns = numpy.asarray(close / pre_close - 1)
+
+        listed = dict((code, (date_to_str(s), date_to_str(e) if e else '99999999')) for code, s, e in
+                      Stock.objects.filter(code__in=panel.stocks).values_list('code', 'dt_listed', 'dt_delisted'))
+        starts = numpy.array([listed.get(s, ('', ''))[0] for s in panel.stocks])
+        ends = numpy.array([listed.get(s, ('', '99999999'))[1] for s in panel.stocks])
+        dates = numpy.array(panel.dates)[:, None]
+        tradable = (dates >= starts[None, :]) & (dates < ends[None, :]) & numpy.isfinite(close) & (volume > 0)
+        return returns, numpy.asarray(tradable)
+
+    @classmethod
+    def from_panel(cls, panel, **kwargs):
+        returns, tradable = cls.get_arrays(panel)
+        return cls(panel, returns, tradable, **kwargs)
+
+    def run(self, weights, start_date=None, end_date=None):
+        """
+        PARAMS:
+            * weights:      The target weights on the dates between `start_date` and `end_date`,
+                            dates x stocks of the panel, NaN as 0.
+            * start_date:   The first date, example: '19990101'.
+            * end_date:     The last date, example: '19991231'.
+        RETURN:
+            DataFrame indexed by date, with columns: gross, cost, net, turnover, equity.
+        """
+        rows = self.panel.select(start_date, end_date)
+        returns = numpy.nan_to_num(self.returns[rows])
+        tradable = self.tradable[rows]
+        weights = numpy.nan_to_num(numpy.asarray(weights, dtype=numpy.float64))
+        if weights.shape != returns.shape:
+            raise ValueError('requires weights in shape %s, but received %s.' % (returns.shape, weights.shape))
+
+        n = len(returns)
+        gross, cost, turnover = numpy.zeros(n), numpy.zeros(n), numpy.zeros(n)
+        held = numpy.zeros(weights.shape[1])
+        for t in range(n):
+            # hold over the date, the cash earns nothing
+            if t:
+                gross[t] = held @ returns[t]
+                held = held * (1 + returns[t]) / (1 + gross[t])
+
+            # trade at the close
+            target = numpy.where(tradable[t], weights[t], held)
+            fixed = numpy.abs(target[~tradable[t]]).sum()
+            free = numpy.abs(target[tradable[t]]).sum()
+            if fixed + free > self.leverage and free > 0:
+                target[tradable[t]] *= max(self.leverage - fixed, 0) / free
+            delta = target - held
+            cost[t] = delta[delta > 0].sum() * self.buy_cost - delta[delta < 0].sum() * self.sell_cost
+            turnover[t] = numpy.abs(delta).sum() / 2
+            held = target
+
+        net = gross - cost
+        dates = pandas.to_datetime(self.panel.dates[rows], format='%Y%m%d')
+        return pandas.DataFrame({'gross': gross, 'cost': cost, 'net': net, 'turnover': turnover,
+                                 'equity': numpy.cumprod(1 + net)}, index=pandas.DatetimeIndex(dates, name='date'))
+
+    @classmethod
+    def get_stats(cls, result):
+        """
+        RETURN:
+            {'total_return', 'annual_return', 'annual_volatility', 'sharpe', 'max_drawdown', 'turnover'}
+        """
+        equity, net = result.equity.values, result.net.values
+        if not len(equity):
+            return {}
+        years = len(equity) / cls.TRADING_DAYS
+        volatility = net.std() * numpy.sqrt(cls.TRADING_DAYS)
+        return {
+            'total_return': equity[-1] - 1,
+            'annual_return': equity[-1] ** (1 / years) - 1 if equity[-1] > 0 else -1.0,
+            'annual_volatility': volatility,
+            'sharpe': net.mean() * cls.TRADING_DAYS / volatility if volatility else numpy.nan,
+            'max_drawdown': (1 - equity / numpy.maximum.accumulate(equity)).max(),
+            'turnover': result.turnover.mean() * cls.TRADING_DAYS,
+        }
+
+
+# The Backtest of the worker process.
+worker_backtest = None
+
+
+def init_worker(panel_path, arrays_path, kwargs):
+    global worker_backtest
+    panel = Panel.open(panel_path)
+    returns = numpy.load(os.path.join(arrays_path, 'returns.npy'), mmap_mode='r')
+    tradable = numpy.load(os.path.join(arrays_path, 'tradable.npy'), mmap_mode='r')
+    worker_backtest = Backtest(panel, returns, tradable, **kwargs)
+
+
+def run_worker(signal, params, start_date, end_date):
+    weights = signal(worker_backtest.panel, start_date=start_date, end_date=end_date, **params)
+    return params, Backtest.get_stats(worker_backtest.run(weights, start_date, end_date))
+
+
+def run_variants(panel, signal, variants, start_date=None, end_date=None, workers=None, **kwargs):
+    """
+    Backtest the variants of the signal in a process pool. The workers attach the panel and
+    the returns and tradable mask as read-only memory maps, so they are shared, not copied.
+    PARAMS:
+        * panel:    The `stock.panel.Panel`.
+        * signal:   Module level function of (panel, start_date, end_date, **params), returning the weights.
+        * variants: The params of the variants, example: [{'n': 20}, {'n': 60}].
+        * workers:  The number of processes.
+                    If None, the number of CPUs.
+        * kwargs:   The options of Backtest, example: buy_cost=0.0003.
+    RETURN:
+        DataFrame of the params and the stats of each variant.
+    """
+    returns, tradable = Backtest.get_arrays(panel)
+    with tempfile.TemporaryDirectory() as arrays_path:
+        numpy.save(os.path.join(arrays_path, 'returns.npy'), returns)
+        numpy.save(os.path.join(arrays_path, 'tradable.npy'), tradable)
+        del returns, tradable
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(panel.path, arrays_path, kwargs)) as executor:
+            results = list(executor.map(run_worker, [signal] * len(variants), variants,
+                                        [start_date] * len(variants), [end_date] * len(variants)))
+    return pandas.DataFrame([dict(params, **stats) for params, stats in results])
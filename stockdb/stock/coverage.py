@@ -0,0 +1,195 @@
+import os
+from collections import defaultdict
+
+import numpy
+
+from stock.models import StockPeriod, Stock, date_to_str
+
+
+# bits set in each byte value
+POPCOUNT = numpy.array([bin(x).count('1') for x in range(256)], dtype=numpy.uint16)
+
+
+class CoverageIndex:
+    """
+    The stocks covered per trade date, as bitsets.
+
+    Each stock is given a dense integer id by its position in `stocks`, new stocks
+    are appended, so the ids never change. Each layer is a bit matrix of dates x
+    stocks, packed 8 stocks per byte:
+        * local:    The stocks synced into StockPeriod.
+        * remote:   The stocks found in the remote data when verified.
+    The bitset of a (date, market) is the date row masked by the stocks of the market.
+    """
+    LAYERS = ('local', 'remote')
+
+    def __init__(self, path=None, period='DAILY'):
+        self.path = path
+        self.period = period
+        self.stocks = []
+        self.stock_ids = {}
+        self.dates = []
+        self.date_ids = {}
+        self.markets = {}
+        self.bits = {layer: numpy.zeros((0, 0), dtype=numpy.uint8) for layer in self.LAYERS}
+
+    @classmethod
+    def load(cls, path, period='DAILY'):
+        """
+        Load the index from the file, or an empty index if the file is not found.
+        """
+        index = cls(path, period)
+        if path and os.path.exists(path):
+            with numpy.load(path, allow_pickle=False) as data:
+                index.add_stocks(data['stocks'].tolist(), data['markets'].tolist())
+                index.add_dates(data['dates'].tolist())
+                for layer in cls.LAYERS:
+                    index.bits[layer] = data[layer]
+        return index
+
+    def save(self, path=None):
+        path = str(path or self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = '%s.%s.tmp.npz' % (path, os.getpid())
+        numpy.savez_compressed(tmp, stocks=numpy.array(self.stocks, dtype=str),
+                               markets=numpy.array([self.markets[x] for x in self.stocks], dtype=str),
+                               dates=numpy.array(self.dates, dtype=str), **self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def build(cls, path=None, period='DAILY'):
+        """
+        Build the local layer from StockPeriod, the remote layer is kept from the file,
+        which is filled by verifying.
+        """
+        index = cls.load(path, period)
+        index.bits['local'][:] = 0
+        stocks = list(Stock.objects.order_by('pk').values_list('code', 'market_id'))
+        index.add_stocks([x[0] for x in stocks], [x[1] for x in stocks])
+        rows = defaultdict(list)
+        for d, stock_id in StockPeriod.objects.filter(period_id=period).values_list('date', 'stock_id').iterator():
+            rows[date_to_str(d)].append(stock_id)
+        for d, stocks in rows.items():
+            index.update('local', d, stocks)
+        return index
+
+    def add_stocks(self, stocks, markets):
+        new = [(s, m) for s, m in zip(stocks, markets) if s not in self.stock_ids]
+        for s, m in new:
+            self.stock_ids[s] = len(self.stocks)
+            self.stocks.append(s)
+            self.markets[s] = m
+        width = (len(self.stocks) + 7) // 8
+        for layer, bits in self.bits.items():
+            if bits.shape[1] < width:
+                self.bits[layer] = numpy.pad(bits, ((0, 0), (0, width - bits.shape[1])))
+
+    def add_dates(self, dates):
+        new = sorted(set(dates) - set(self.date_ids))
+        if not new:
+            return
+        self.dates = sorted(self.dates + new)
+        self.date_ids = {d: i for i, d in enumerate(self.dates)}
+        positions = [self.date_ids[d] - i for i, d in enumerate(new)]
+        for layer, bits in self.bits.items():
+            self.bits[layer] = numpy.insert(bits, positions, 0, axis=0) if len(bits) else \
+                numpy.zeros((len(self.dates), (len(self.stocks) + 7) // 8), dtype=numpy.uint8)
+
+    def to_bits(self, stocks):
+        flags = numpy.zeros(len(self.stocks), dtype=bool)
+        flags[[self.stock_ids[s] for s in stocks if s in self.stock_ids]] = True
+        return numpy.packbits(flags)
+
+    def from_bits(self, bits):
+        return [self.stocks[i] for i in numpy.flatnonzero(numpy.unpackbits(bits)[:len(self.stocks)])]
+
+    def market_mask(self, markets=None):
+        if markets is None:
+            return numpy.packbits(numpy.ones(len(self.stocks), dtype=bool))
+        return self.to_bits([s for s in self.stocks if self.markets[s] in markets])
+
+    def update(self, layer, date, stocks, markets=None):
+        """
+        Replace the stocks covered on the date in the layer.
+        PARAMS:
+            * date:     The date, example: '19991231'.
+            * stocks:   The stock codes covered on the date.
+            * markets:  Replace the stocks of the markets only, example: ['XSHG'].
+                        If None, replace all.
+        """
+        unknown = [s for s in stocks if s not in self.stock_ids]
+        if unknown:
+            market_ids = dict(Stock.objects.filter(code__in=unknown).values_list('code', 'market_id'))
+            self.add_stocks([s for s in unknown if s in market_ids], [market_ids[s] for s in unknown if s in market_ids])
+        date = date_to_str(date)
+        self.add_dates([date])
+        mask = self.market_mask(markets)
+        row = self.bits[layer][self.date_ids[date]]
+        row[:] = (row & ~mask) | (self.to_bits(stocks) & mask)
+
+    def select(self, start_date=None, end_date=None):
+        """
+        RETURN:
+            The slice of the date rows between the dates, both included.
+        """
+        start = numpy.searchsorted(self.dates, date_to_str(start_date)) if start_date else 0
+        end = numpy.searchsorted(self.dates, date_to_str(end_date), side='right') if end_date else len(self.dates)
+        return slice(start, end)
+
+    def counts(self, layer, start_date=None, end_date=None, markets=None):
+        """
+        RETURN:
+            {
+                {date}: {stocks count},
+                ...
+            }
+        """
+        rows = self.select(start_date, end_date)
+        counts = POPCOUNT[self.bits[layer][rows] & self.market_mask(markets)].sum(axis=1)
+        return dict(zip(self.dates[rows], counts.tolist()))
+
+    def union(self, layer, start_date=None, end_date=None, markets=None):
+        """
+        RETURN:
+            The stocks covered on any of the dates.
+        """
+        rows = self.bits[layer][self.select(start_date, end_date)]
+        return self.from_bits(numpy.bitwise_or.reduce(rows, axis=0) & self.market_mask(markets)) if len(rows) else []
+
+    def difference(self, layer, other, start_date=None, end_date=None, markets=None):
+        """
+        RETURN:
+            The stocks covered in the layer but not in the other layer, by date and market,
+            the dates without remote data are not verified and skipped:
+            {
+                {date}: {
+                    {market_id}: [{stock_id}, ...],
+                    ...
+                },
+                ...
+            }
+        """
+        rows = self.select(start_date, end_date)
+        delta = self.bits[layer][rows] & ~self.bits[other][rows] & self.market_mask(markets)
+        delta[~self.bits['remote'][rows].any(axis=1)] = 0
+        result = {}
+        for i in numpy.flatnonzero(delta.any(axis=1)):
+            by_market = defaultdict(list)
+            for s in self.from_bits(delta[i]):
+                by_market[self.markets[s]].append(s)
+            result[self.dates[rows][i]] = dict(by_market)
+        return result
+
+    def missing(self, start_date=None, end_date=None, markets=None):
+        """
+        RETURN:
+            The stocks in the remote data but not synced, see `difference()`.
+        """
+        return self.difference('remote', 'local', start_date, end_date, markets)
+
+    def extra(self, start_date=None, end_date=None, markets=None):
+        """
+        RETURN:
+            The stocks synced but not in the remote data, see `difference()`.
+        """
+        return self.difference('local', 'remote', start_date, end_date, markets)
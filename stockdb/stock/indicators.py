@@ -0,0 +1,384 @@
+"""
+Technical indicators over the dates x stocks panels, vectorized across the stocks.
+
+Each indicator is evaluated by `step(inputs, state)` on a block of rows (dates), and
+returns the state to continue from, such as the last EMA values or the tail rows of a
+rolling window. The full history and the rows appended after a sync are evaluated by
+the same code, so extending from the stored state gives the same values as recomputing.
+
+The NaN bars (not listed, suspended) are skipped by the recursive indicators, which
+carry their state over, and the rolling windows with a NaN bar are NaN.
+"""
+import abc
+import os
+import json
+from datetime import datetime
+
+import numpy
+
+
+def rolling_sum(tail, x, n):
+    """
+    PARAMS:
+        * tail: The last rows before `x`, up to n - 1.
+        * x:    The rows, dates x stocks.
+    RETURN:
+        (The sums of the windows of n rows ending on each row of `x`, NaN if any NaN in the window,
+         the tail to continue from)
+    """
+    data = numpy.concatenate([tail, x]) if len(tail) else x
+    valid = numpy.isfinite(data)
+    sums = numpy.zeros((len(data) + 1, data.shape[1]))
+    counts = numpy.zeros((len(data) + 1, data.shape[1]), dtype=numpy.int64)
+    numpy.cumsum(numpy.where(valid, data, 0), axis=0, out=sums[1:])
+    numpy.cumsum(valid, axis=0, out=counts[1:])
+    end = numpy.arange(len(tail) + 1, len(data) + 1)
+    start = numpy.maximum(end - n, 0)
+    result = numpy.where(counts[end] - counts[start] == n, sums[end] - sums[start], numpy.nan)
+    return result, data[max(len(data) - (n - 1), 0):] if n > 1 else data[:0]
+
+
+def ema(x, alpha, last):
+    """
+    PARAMS:
+        * alpha:    The smoothing factor.
+        * last:     The EMA before `x` per stock, NaN if not started, it's seeded by the first value.
+    RETURN:
+        (The EMA of the rows, NaN on the NaN rows, the last EMA to continue from)
+    """
+    out = numpy.empty_like(x)
+    for i in range(len(x)):
+        xi = x[i]
+        missing = numpy.isnan(xi)
+        last = numpy.where(numpy.isnan(last), xi, numpy.where(missing, last, last + alpha * (xi - last)))
+        out[i] = numpy.where(missing, numpy.nan, last)
+    return out, last
+
+
+def diff(x, prev):
+    """
+    RETURN:
+        (The change of each row from the previous valid row, the last valid row to continue from)
+    """
+    out = numpy.empty_like(x)
+    for i in range(len(x)):
+        out[i] = x[i] - prev
+        prev = numpy.where(numpy.isnan(x[i]), prev, x[i])
+    return out, prev
+
+
+class Indicator(abc.ABC):
+    """
+    The base of the indicators.
+        * inputs:   The panel fields used.
+        * outputs:  The names of the output panels.
+    """
+    inputs = ('close', )
+
+    def __init__(self, n):
+        self.n = n
+
+    @property
+    def name(self):
+        return '%s%s' % (type(self).__name__.lower(), self.n)
+
+    @property
+    def outputs(self):
+        return [self.name]
+
+    def init_state(self, width):
+        return {}
+
+    @abc.abstractmethod
+    def step(self, inputs, state):
+        pass
+
+
+class MA(Indicator):
+
+    def init_state(self, width):
+        return {'tail': numpy.empty((0, width))}
+
+    def step(self, inputs, state):
+        sums, tail = rolling_sum(state['tail'], inputs['close'], self.n)
+        return {self.name: sums / self.n}, {'tail': tail}
+
+
+class EMA(Indicator):
+
+    def init_state(self, width):
+        return {'last': numpy.full(width, numpy.nan)}
+
+    def step(self, inputs, state):
+        out, last = ema(inputs['close'], 2.0 / (self.n + 1), state['last'])
+        return {self.name: out}, {'last': last}
+
+
+class RSI(Indicator):
+    """
+    Wilder's RSI, the averages are seeded by the first change.
+    """
+
+    def init_state(self, width):
+        return {'prev': numpy.full(width, numpy.nan), 'gain': numpy.full(width, numpy.nan),
+                'loss': numpy.full(width, numpy.nan)}
+
+    def step(self, inputs, state):
+        change, prev = diff(inputs['close'], state['prev'])
+        gain, gain_last = ema(numpy.where(change > 0, change, numpy.where(numpy.isnan(change), numpy.nan, 0)),
+                              1.0 / self.n, state['gain'])
+        loss, loss_last = ema(numpy.where(change < 0, -change, numpy.where(numpy.isnan(change), numpy.nan, 0)),
+                              1.0 / self.n, state['loss'])
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            rsi = numpy.where(gain + loss > 0, 100 * gain / (gain + loss), 50.0)
+        rsi[numpy.isnan(gain)] = numpy.nan
+        return {self.name: rsi}, {'prev': prev, 'gain': gain_last, 'loss': loss_last}
+
+
+class ATR(Indicator):
+    """
+    Wilder's ATR, seeded by the first true range.
+    """
+    inputs = ('high', 'low', 'close')
+
+    def init_state(self, width):
+        return {'prev': numpy.full(width, numpy.nan), 'last': numpy.full(width, numpy.nan)}
+
+    def step(self, inputs, state):
+        high, low, close = inputs['high'], inputs['low'], inputs['close']
+        prev_close = numpy.empty_like(close)
+        prev = state['prev']
+        for i in range(len(close)):
+            prev_close[i] = prev
+            prev = numpy.where(numpy.isnan(close[i]), prev, close[i])
+        with numpy.errstate(invalid='ignore'):
+            tr = numpy.fmax(high - low, numpy.fmax(numpy.abs(high - prev_close), numpy.abs(low - prev_close)))
+        tr[numpy.isnan(close)] = numpy.nan
+        out, last = ema(tr, 1.0 / self.n, state['last'])
+        return {self.name: out}, {'prev': prev, 'last': last}
+
+
+class MACD(Indicator):
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        super(MACD, self).__init__(fast)
+        self.fast, self.slow, self.signal = fast, slow, signal
+
+    @property
+    def name(self):
+        return 'macd%s_%s_%s' % (self.fast, self.slow, self.signal)
+
+    @property
+    def outputs(self):
+        return ['%s.%s' % (self.name, x) for x in ('dif', 'dea', 'hist')]
+
+    def init_state(self, width):
+        return {x: numpy.full(width, numpy.nan) for x in ('fast', 'slow', 'dea')}
+
+    def step(self, inputs, state):
+        fast, fast_last = ema(inputs['close'], 2.0 / (self.fast + 1), state['fast'])
+        slow, slow_last = ema(inputs['close'], 2.0 / (self.slow + 1), state['slow'])
+        dif = fast - slow
+        dea, dea_last = ema(dif, 2.0 / (self.signal + 1), state['dea'])
+        dif_name, dea_name, hist_name = self.outputs
+        return {dif_name: dif, dea_name: dea, hist_name: 2 * (dif - dea)}, \
+            {'fast': fast_last, 'slow': slow_last, 'dea': dea_last}
+
+
+class BOLL(Indicator):
+
+    def __init__(self, n=20, k=2):
+        super(BOLL, self).__init__(n)
+        self.k = k
+
+    @property
+    def name(self):
+        return 'boll%s_%s' % (self.n, self.k)
+
+    @property
+    def outputs(self):
+        return ['%s.%s' % (self.name, x) for x in ('mid', 'upper', 'lower')]
+
+    def init_state(self, width):
+        return {'tail': numpy.empty((0, width))}
+
+    def step(self, inputs, state):
+        close = inputs['close']
+        sums, tail = rolling_sum(state['tail'], close, self.n)
+        squares, _ = rolling_sum(state['tail'] ** 2, close ** 2, self.n)
+        mid = sums / self.n
+        std = numpy.sqrt(numpy.maximum(squares / self.n - mid ** 2, 0))
+        mid_name, upper_name, lower_name = self.outputs
+        return {mid_name: mid, upper_name: mid + self.k * std, lower_name: mid - self.k * std}, {'tail': tail}
+
+
+DEFAULT_INDICATORS = [MA(5), MA(20), MA(60), EMA(12), RSI(14), MACD(12, 26, 9), ATR(14), BOLL(20, 2)]
+
+
+class IndicatorStore:
+    """
+    The outputs of the indicators, persisted with their states under `path`:
+        * {output}.f4:  The values of the output, float32, dates x `width` stocks, appended by rows.
+        * state.npz:    The states of the indicators after the last date, and before it, to evaluate
+                        the last date again when it's synced again.
+        * index.json:   The indicators, dates, stocks and width.
+    The stocks are appended into the spare width, the outputs are recomputed if they don't fit,
+    or the stocks or indicators are changed.
+    """
+    STOCK_RESERVE = 500
+    # The rows evaluated in one block, to bound the memory of the full compute.
+    BLOCK_SIZE = 500
+
+    def __init__(self, path, indicators=None):
+        self.path = str(path)
+        self.indicators = indicators or DEFAULT_INDICATORS
+        self.dates, self.stocks, self.width, self.states = [], [], 0, {}
+        # The states before the last date, None if not stored.
+        self.prev_states = None
+        index_file = os.path.join(self.path, 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                index = json.load(f)
+            if index['indicators'] == [x.name for x in self.indicators]:
+                self.dates, self.stocks, self.width = index['dates'], index['stocks'], index['width']
+                with numpy.load(os.path.join(self.path, 'state.npz')) as data:
+                    for key in data.files:
+                        if key.startswith('prev/'):
+                            name, field = key[len('prev/'):].split(':', 1)
+                            self.prev_states = self.prev_states or {}
+                            self.prev_states.setdefault(name, {})[field] = data[key]
+                        else:
+                            name, field = key.split(':', 1)
+                            self.states.setdefault(name, {})[field] = data[key]
+
+    @property
+    def inputs(self):
+        return sorted({f for x in self.indicators for f in x.inputs})
+
+    def get_file(self, output):
+        return os.path.join(self.path, '%s.f4' % output)
+
+    def get(self, output):
+        """
+        RETURN:
+            The memory-mapped values of the output, dates x stocks.
+        """
+        if not self.dates:
+            return numpy.empty((0, len(self.stocks)), dtype=numpy.float32)
+        data = numpy.memmap(self.get_file(output), dtype=numpy.float32, mode='r', shape=(len(self.dates), self.width))
+        return data[:, :len(self.stocks)]
+
+    def save_index(self):
+        tmp = os.path.join(self.path, 'state.%s.tmp.npz' % os.getpid())
+        arrays = {'%s:%s' % (name, field): value for name, state in self.states.items() for field, value in state.items()}
+        arrays.update({'prev/%s:%s' % (name, field): value
+                       for name, state in (self.prev_states or {}).items() for field, value in state.items()})
+        numpy.savez(tmp, **arrays)
+        os.replace(tmp, os.path.join(self.path, 'state.npz'))
+        tmp = os.path.join(self.path, 'index.json.%s.tmp' % os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'indicators': [x.name for x in self.indicators], 'dates': self.dates,
+                       'stocks': self.stocks, 'width': self.width}, f)
+        os.replace(tmp, os.path.join(self.path, 'index.json'))
+
+    def evaluate(self, inputs, files):
+        """
+        Evaluate the indicators on the rows from the states, in blocks, and append the outputs to the files.
+        The last row is evaluated in its own block, to keep the states before it.
+        """
+        rows = len(next(iter(inputs.values())))
+        ends = list(range(self.BLOCK_SIZE, rows - 1, self.BLOCK_SIZE)) + [rows - 1, rows]
+        for start, end in zip([0] + ends, ends):
+            if start >= end:
+                continue
+            if end == rows:
+                self.prev_states = dict(self.states)
+            block = {f: self.pad(x[start:end]) for f, x in inputs.items()}
+            for indicator in self.indicators:
+                state = self.states.get(indicator.name) or indicator.init_state(self.width)
+                outputs, self.states[indicator.name] = indicator.step(block, state)
+                for name, values in outputs.items():
+                    files[name].write(values.astype(numpy.float32).tobytes())
+
+    def pad(self, x):
+        x = numpy.asarray(x, dtype=numpy.float64)
+        if x.shape[1] < self.width:
+            x = numpy.pad(x, ((0, 0), (0, self.width - x.shape[1])), constant_values=numpy.nan)
+        return x
+
+    def compute(self, dates, stocks, inputs):
+        """
+        Recompute the outputs of the full history.
+        PARAMS:
+            * dates:    The dates of the rows, example: ['19991230', '19991231'].
+            * stocks:   The stocks of the columns.
+            * inputs:   {field: dates x stocks array} of the `inputs` fields.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self.dates, self.stocks, self.width, self.states = list(dates), list(stocks), len(stocks) + self.STOCK_RESERVE, {}
+        self.prev_states = None
+        outputs = [x for indicator in self.indicators for x in indicator.outputs]
+        files = {x: open(self.get_file(x) + '.tmp', 'wb') for x in outputs}
+        try:
+            self.evaluate(inputs, files)
+        finally:
+            for f in files.values():
+                f.close()
+        for x in outputs:
+            os.replace(self.get_file(x) + '.tmp', self.get_file(x))
+        self.save_index()
+        print('%s: indicators computed, dates: %s, stocks: %s' % (datetime.now(), len(self.dates), len(self.stocks)))
+
+    def extend(self, dates, stocks, inputs):
+        """
+        Evaluate the dates after the last one from the stored states, and append the outputs.
+        The full history is recomputed if the dates or stocks don't continue the stored ones,
+        the stored dates are not evaluated again.
+        PARAMS:
+            * dates:    All the dates of the rows of `inputs`.
+            * stocks:   All the stocks of the columns of `inputs`, the stored ones first.
+            * inputs:   {field: dates x stocks array}, the full panels, only the new rows are read.
+        RETURN:
+            The number of dates appended, or None if recomputed.
+        """
+        continued = self.dates and list(dates[:len(self.dates)]) == self.dates and \
+            list(stocks[:len(self.stocks)]) == self.stocks and len(stocks) <= self.width
+        if not continued:
+            self.compute(dates, stocks, inputs)
+            return None
+
+        start = len(self.dates)
+        if start == len(dates):
+            return 0
+        files = {x: open(self.get_file(x), 'r+b') for indicator in self.indicators for x in indicator.outputs}
+        try:
+            # drop the rows of an interrupted extend, not in the index
+            for f in files.values():
+                f.truncate(start * self.width * 4)
+                f.seek(0, os.SEEK_END)
+            self.evaluate({f: x[start:] for f, x in inputs.items()}, files)
+        finally:
+            for f in files.values():
+                f.close()
+        self.dates, self.stocks = list(dates), list(stocks)
+        self.save_index()
+        return len(self.dates) - start
+
+    def rewind(self):
+        """
+        Drop the last date and restore the states before it, so it's evaluated again by `extend`.
+        The files are truncated by `extend`.
+        RETURN:
+            True if rewound, False if the states before the last date are not stored.
+        """
+        if not self.dates or self.prev_states is None:
+            return False
+        self.dates, self.states, self.prev_states = self.dates[:-1], self.prev_states, None
+        return True
+
+    def update_from_panel(self, panel):
+        """
+        Extend the outputs with the dates of the `stock.panel.Panel`.
+        """
+        inputs = {f: panel.get(f) for f in self.inputs}
+        return self.extend(panel.dates, panel.stocks, inputs)
@@ -0,0 +1,114 @@
+"""
+Evaluate the daily price limits of the DAILY panel by the compiled `Subject.dpl_rule`,
+vectorized over the stocks of each subject and the dates under each rule version.
+"""
+from datetime import datetime
+from collections import defaultdict
+
+import numpy
+import pandas
+from django.db import transaction
+
+from market.dpl import RuleBook, limit_prices
+from stock.models import Stock, StockLimit, date_to_str, str_to_date
+from utils.db import bulk_upsert, frame_to_rows
+
+
+# The tolerance of the price comparisons.
+EPSILON = 0.005
+
+
+def evaluate(panel, start_date=None, end_date=None, book=None, streak=None):
+    """
+    PARAMS:
+        * panel:    The `stock.panel.Panel`.
+        * book:     The `market.dpl.RuleBook`.
+                    If None, loaded from DB.
+        * streak:   The streaks on the date before `start_date`, {stock_id: streak}.
+                    If None, loaded from StockLimit.
+    RETURN:
+        {'up_limit', 'down_limit', 'flags', 'streak'} of dates x stocks arrays, and the slice of the dates.
+    """
+    book = book or RuleBook()
+    rows = panel.select(start_date, end_date)
+    fields = {f: numpy.asarray(panel.get(f)[rows], dtype=numpy.float64)
+              for f in ('pre_close', 'open', 'high', 'low', 'close')}
+
+    stocks = dict((x[0], x[1:]) for x in Stock.objects.filter(code__in=panel.stocks).values_list(
+        'code', 'subject_id', 'name', 'dt_listed'))
+    # the trading days since listed, by the dates of the panel, on the selected dates only,
+    # counted from the first date of the panel if the stock is not found
+    listed = numpy.searchsorted(panel.dates, [date_to_str(stocks[s][2]) if s in stocks else '' for s in panel.stocks])
+    days = numpy.arange(rows.start, rows.stop)[:, None] + 1 - listed[None, :]
+    # by the current names, the ST history is not kept
+    st = numpy.array([(stocks.get(s, (None, None))[1] or '').lstrip('*').startswith('ST') for s in panel.stocks])
+    by_subject = defaultdict(list)
+    for i, s in enumerate(panel.stocks):
+        by_subject[stocks.get(s, (None, ))[0]].append(i)
+
+    dates = [str_to_date(d) for d in panel.dates[rows]]
+    pre_close = fields['pre_close']
+    ratio = numpy.full(pre_close.shape, numpy.nan)
+    for subject, cols in by_subject.items():
+        if subject is None:
+            continue
+        cols = numpy.array(cols)
+        for start, end, rule in book.get_ranges(subject, dates):
+            if rule is None:
+                continue
+            block = pre_close[start:end, cols]
+            ratio[start:end, cols] = rule(block, days[start:end, cols], numpy.broadcast_to(st[cols], block.shape))
+
+    with numpy.errstate(invalid='ignore'):
+        up, down = limit_prices(pre_close, ratio)
+        high, low, close = fields['high'], fields['low'], fields['close']
+        flags = (StockLimit.UP_TOUCHED * (high >= up - EPSILON) +
+                 StockLimit.UP_CLOSED * (close >= up - EPSILON) +
+                 StockLimit.UP_LOCKED * (low >= up - EPSILON) +
+                 StockLimit.DOWN_TOUCHED * (low <= down + EPSILON) +
+                 StockLimit.DOWN_CLOSED * (close <= down + EPSILON) +
+                 StockLimit.DOWN_LOCKED * (high <= down + EPSILON)).astype(numpy.int16)
+
+    if streak is None:
+        streak = {}
+        if rows.start > 0:
+            streak = dict(StockLimit.objects.filter(date=str_to_date(panel.dates[rows.start - 1]))
+                          .values_list('stock_id', 'streak'))
+    last = numpy.array([streak.get(s, 0) for s in panel.stocks], dtype=numpy.int16)
+    streaks = numpy.zeros(flags.shape, dtype=numpy.int16)
+    closed_up, closed_down = (flags & StockLimit.UP_CLOSED) > 0, (flags & StockLimit.DOWN_CLOSED) > 0
+    for t in range(len(flags)):
+        last = numpy.where(closed_up[t], numpy.maximum(last, 0) + 1,
+                           numpy.where(closed_down[t], numpy.minimum(last, 0) - 1, 0)).astype(numpy.int16)
+        streaks[t] = last
+    return {'up_limit': up, 'down_limit': down, 'flags': flags, 'streak': streaks}, rows
+
+
+def save(panel, start_date=None, end_date=None):
+    """
+    Evaluate the dates of the panel and replace their StockLimit rows.
+    RETURN:
+        The number of rows written.
+    """
+    result, rows = evaluate(panel, start_date, end_date)
+    t, s = numpy.nonzero(result['flags'])
+    dates = [str_to_date(d) for d in panel.dates[rows]]
+    market_ids = dict(Stock.objects.filter(code__in=panel.stocks).values_list('code', 'market_id'))
+    df = pandas.DataFrame({
+        'stock_id': numpy.array(panel.stocks, dtype=object)[s],
+        'date': numpy.array(dates, dtype=object)[t],
+        'up_limit': result['up_limit'][t, s].round(2),
+        'down_limit': result['down_limit'][t, s].round(2),
+        'flags': result['flags'][t, s],
+        'streak': result['streak'][t, s],
+    })
+    df['market_id'] = df.stock_id.map(market_ids)
+    df = df[df.market_id.notna()]
+
+    fields = ['stock_id', 'market_id', 'date', 'up_limit', 'down_limit', 'flags', 'streak']
+    with transaction.atomic():
+        if dates:
+            StockLimit.objects.filter(date__gte=dates[0], date__lte=dates[-1]).delete()
+        written = bulk_upsert(StockLimit, fields, frame_to_rows(df, fields), unique_fields=['stock_id', 'date'])
+    print('%s: limits evaluated, dates: %s, rows: %s' % (datetime.now(), len(dates), written))
+    return written
@@ -0,0 +1,75 @@
+import time
+
+import pandas
+from django.core.management.base import BaseCommand
+
+from stock.models import StockPeriod, str_to_date
+from tusharepro.standin import Synthesizer
+from utils.db import frame_to_rows
+
+
+FIELDS = 'ts_code,trade_date,open,high,low,close,pre_close,change,pct_chg,vol,amount'
+
+
+def transform_rowwise(df, markets, trade_date, tushare_code_to_market, tushare_code_to_code, pks):
+    """
+    The transform before vectorized, with row-wise lookups and model instances, for comparison.
+    """
+    df.insert(loc=0, column='market_id', value=df.ts_code.apply(tushare_code_to_market.get))
+    df = df[df.market_id.isin(markets)].copy()
+    df.insert(loc=0, column='stock_id', value=df.ts_code.apply(tushare_code_to_code.get))
+    df.insert(loc=2, column='period_id', value='DAILY')
+    df.insert(loc=0, column='pk', value=df.apply(lambda row: pks.get(hash(trade_date + row.stock_id)), axis=1))
+    df.rename(columns={'trade_date': 'date', 'pct_chg': 'percent', 'vol': 'volume'}, inplace=True)
+    df.loc[:, 'date'] = str_to_date(trade_date)
+    df.drop(['ts_code'], axis=1, inplace=True)
+    cdf = df[df.pk.isnull()].drop(['pk'], axis=1).dropna()
+    return [StockPeriod(**d) for d in cdf.to_dict('records')]
+
+
+def transform_vectorized(df, markets, trade_date, stocks, pks):
+    df = StockPeriod.transform_daily(df, markets, trade_date, stocks)
+    df.insert(loc=0, column='pk', value=df.stock_id.map(pks))
+    cdf = df.dropna(subset=[x for x in df.columns if x != 'pk'])
+    return list(frame_to_rows(cdf, ['stock_id', 'market_id', 'period_id', 'date'] + StockPeriod.VALUE_FIELDS))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the transform of the daily sync, row-wise vs vectorized, on a synthetic day. No DB is used.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stocks', type=int, default=5000, help='Number of stocks of the day.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each transform, the best is reported.')
+
+    def handle(self, *args, **options):
+        synthesizer = Synthesizer(stocks=options['stocks'], dates=2)
+        trade_date = synthesizer.dates[-1]
+        data = synthesizer({'api_name': 'daily', 'params': {'trade_date': trade_date}, 'fields': FIELDS})
+        source = pandas.DataFrame(data['items'], columns=data['fields'])
+
+        markets = ['XSHG', 'XSHE']
+        stocks = pandas.DataFrame([{
+            'tushare_code': x['ts_code'],
+            'stock_id': ('XSHG' if x['exchange'] == 'SSE' else 'XSHE') + x['symbol'],
+            'market_id': 'XSHG' if x['exchange'] == 'SSE' else 'XSHE',
+        } for x in synthesizer.stocks]).set_index('tushare_code')
+        tushare_code_to_code = stocks.stock_id.to_dict()
+        tushare_code_to_market = stocks.market_id.to_dict()
+
+        results = {}
+        for name, func in [
+            ('row-wise', lambda df: transform_rowwise(
+                df, markets, trade_date, tushare_code_to_market, tushare_code_to_code, {})),
+            ('vectorized', lambda df: transform_vectorized(df, markets, trade_date, stocks, {})),
+        ]:
+            best = None
+            for _ in range(options['repeat']):
+                df = source.copy()
+                started = time.perf_counter()
+                rows = func(df)
+                elapse = time.perf_counter() - started
+                best = elapse if best is None else min(best, elapse)
+            results[name] = best
+            self.stdout.write('%-10s rows: %s, best: %.4fs, rows/s: %.0f' % (name, len(rows), best, len(rows) / best))
+
+        self.stdout.write('speedup: %.1fx' % (results['row-wise'] / results['vectorized']))
@@ -0,0 +1,69 @@
+import time
+import tempfile
+
+import numpy
+import pandas
+from django.core.management.base import BaseCommand
+
+from stock.indicators import IndicatorStore
+
+
+def compute_per_stock(close, high, low):
+    """
+    The ad-hoc pandas loop over the stocks, for comparison.
+    """
+    for i in range(close.shape[1]):
+        c, h, l = pandas.Series(close[:, i]), pandas.Series(high[:, i]), pandas.Series(low[:, i])
+        for n in (5, 20, 60):
+            c.rolling(n).mean()
+        c.ewm(span=12, adjust=False).mean()
+        change = c.diff()
+        gain = change.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+        loss = (-change).clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+        100 * gain / (gain + loss)
+        dif = c.ewm(span=12, adjust=False).mean() - c.ewm(span=26, adjust=False).mean()
+        dif.ewm(span=9, adjust=False).mean()
+        prev = c.shift()
+        pandas.concat([h - l, (h - prev).abs(), (l - prev).abs()], axis=1).max(axis=1).ewm(alpha=1 / 14, adjust=False).mean()
+        c.rolling(20).mean() + 2 * c.rolling(20).std(ddof=0)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the indicator engine on a synthetic panel, full compute and daily extend, vs a per-stock pandas loop.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stocks', type=int, default=5000, help='Number of stocks.')
+        parser.add_argument('--dates', type=int, default=7500, help='Number of dates, 7500 for about 30 years.')
+        parser.add_argument('--loop-stocks', type=int, default=50,
+                            help='Stocks run by the pandas loop, the time is extrapolated to all.')
+
+    def handle(self, *args, **options):
+        n_dates, n_stocks = options['dates'], options['stocks']
+        rnd = numpy.random.RandomState(0)
+        close = 10 * numpy.exp(numpy.cumsum(rnd.normal(0, 0.02, (n_dates, n_stocks)), axis=0))
+        high = close * (1 + rnd.uniform(0, 0.02, close.shape))
+        low = close * (1 - rnd.uniform(0, 0.02, close.shape))
+        # suspended days
+        close[rnd.uniform(size=close.shape) < 0.01] = numpy.nan
+        inputs = {'close': close, 'high': high, 'low': low}
+        dates = ['%08d' % i for i in range(n_dates)]
+        stocks = ['S%06d' % i for i in range(n_stocks)]
+
+        with tempfile.TemporaryDirectory() as path:
+            store = IndicatorStore(path)
+            started = time.perf_counter()
+            store.compute(dates[:-1], stocks, {f: x[:-1] for f, x in inputs.items()})
+            full = time.perf_counter() - started
+            self.stdout.write('full compute: %s dates x %s stocks, %.2fs' % (n_dates - 1, n_stocks, full))
+
+            started = time.perf_counter()
+            IndicatorStore(path).extend(dates, stocks, inputs)
+            extend = time.perf_counter() - started
+            self.stdout.write('extend 1 date: %.4fs, %.0fx faster than recompute' % (extend, full / extend))
+
+        k = min(options['loop_stocks'], n_stocks)
+        started = time.perf_counter()
+        compute_per_stock(close[:, :k], high[:, :k], low[:, :k])
+        loop = (time.perf_counter() - started) * n_stocks / k
+        self.stdout.write('per-stock pandas loop: %.2fs (extrapolated from %s stocks), %.1fx slower than full compute'
+                          % (loop, k, loop / full))
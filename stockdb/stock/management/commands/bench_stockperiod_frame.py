@@ -0,0 +1,53 @@
+import time
+
+import pandas
+from django.core.management.base import BaseCommand
+
+from stock.models import StockPeriod, str_to_date
+
+
+def load_orm(qs, fields):
+    """
+    The load before `to_frame()`, with `values()` dicts and Decimal values, for comparison.
+    """
+    df = pandas.DataFrame.from_records(list(qs.values(*fields)), columns=fields)
+    return df.astype({x: 'float64' for x in fields if x in StockPeriod.VALUE_FIELDS})
+
+
+class Command(BaseCommand):
+    help = 'Benchmark loading StockPeriod to a DataFrame, ORM values() vs to_frame(), on the DB.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', default='DAILY')
+        parser.add_argument('--markets', nargs='*', help='Example: XSHG XSHE. If omitted, all the markets.')
+        parser.add_argument('--start-date', help='Example: 20200101.')
+        parser.add_argument('--end-date', help='Example: 20201231.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of each loader, the best is reported.')
+
+    def handle(self, *args, **options):
+        qs = StockPeriod.objects.filter(period_id=options['period'])
+        if options['markets']:
+            qs = qs.filter(market_id__in=options['markets'])
+        if options['start_date']:
+            qs = qs.filter(date__gte=str_to_date(options['start_date']))
+        if options['end_date']:
+            qs = qs.filter(date__lte=str_to_date(options['end_date']))
+        fields = ['stock_id', 'market_id', 'date'] + StockPeriod.VALUE_FIELDS
+
+        results = {}
+        for name, func in [
+            ('orm', lambda: load_orm(qs, fields)),
+            ('to_frame', lambda: qs.to_frame(fields)),
+            ('to_panel', lambda: qs.to_panel('close')),
+        ]:
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                df = func()
+                elapse = time.perf_counter() - started
+                best = elapse if best is None else min(best, elapse)
+            results[name] = best
+            self.stdout.write('%-10s shape: %s, memory: %.1fMB, best: %.4fs' % (
+                name, df.shape, df.memory_usage(deep=True).sum() / 1024 ** 2, best))
+
+        self.stdout.write('speedup: %.1fx' % (results['orm'] / results['to_frame']))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stock.coverage import CoverageIndex
+
+
+class Command(BaseCommand):
+    help = 'Build the coverage index of the synced StockPeriod from DB, the remote layer is filled by verifying.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.STOCKDB_COVERAGE_PATH)
+        parser.add_argument('--period', default='DAILY')
+
+    def handle(self, *args, **options):
+        index = CoverageIndex.build(options['path'], options['period'])
+        index.save()
+        self.stdout.write('Coverage index of %s stocks x %s dates saved to %s'
+                          % (len(index.stocks), len(index.dates), options['path']))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stock.panel import Panel
+
+
+class Command(BaseCommand):
+    help = 'Build the memory-mapped panel of the DAILY StockPeriod from DB, it is appended after syncs then.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.STOCKDB_PANEL_PATH)
+        parser.add_argument('--fields', nargs='*', help='Example: close volume. If omitted, all the value fields.')
+
+    def handle(self, *args, **options):
+        panel = Panel.build(options['path'], options['fields'] or None)
+        self.stdout.write('Panel of %s fields x %s dates x %s stocks saved to %s'
+                          % (*panel.shape, options['path']))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stock.panel import Panel
+from stock import limits
+
+
+class Command(BaseCommand):
+    help = 'Evaluate the daily price limits of the DAILY panel into StockLimit, they are updated after syncs then.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='Example: 20200101. If omitted, the first date of the panel.')
+        parser.add_argument('--end-date', help='Example: 20201231. If omitted, the last date of the panel.')
+
+    def handle(self, *args, **options):
+        rows = limits.save(Panel.open(settings.STOCKDB_PANEL_PATH), options['start_date'], options['end_date'])
+        self.stdout.write('%s limit hits saved' % rows)
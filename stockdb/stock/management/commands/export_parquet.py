@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stock.parquet import ParquetStore
+
+
+class Command(BaseCommand):
+    help = 'Export StockPeriod to the Parquet dataset partitioned by period, market and year.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.STOCKDB_PARQUET_PATH)
+        parser.add_argument('--period', default='DAILY')
+        parser.add_argument('--markets', nargs='*', help='Example: XSHG XSHE. If omitted, all the markets.')
+
+    def handle(self, *args, **options):
+        rows = ParquetStore(options['path']).export(options['period'], options['markets'] or None)
+        self.stdout.write('%s rows of %s exported to %s' % (rows, options['period'], options['path']))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from stock.models import StockPeriod
+
+
+class Command(BaseCommand):
+    help = 'Materialize the WEEKLY and MONTHLY StockPeriod from the DAILY bars, they are updated after syncs then.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periods', nargs='*', choices=list(StockPeriod.RESAMPLE_FREQS.keys()),
+                            help='If omitted, all the periods.')
+        parser.add_argument('--markets', nargs='*', help='Example: XSHG XSHE. If omitted, all the markets.')
+        parser.add_argument('--dates', nargs='*', help='Recompute the buckets of the DAILY dates only, example: 20201231.')
+
+    def handle(self, *args, **options):
+        result = StockPeriod.resample_from_daily(options['periods'] or None, options['markets'] or None,
+                                                 options['dates'] or None)
+        for period, rows in result.items():
+            self.stdout.write('%s: %s rows' % (period, rows))
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stock.panel import Panel
+from stock.indicators import IndicatorStore
+from stock.screener import Screener
+
+
+class Command(BaseCommand):
+    help = "Screen the stocks on the DAILY panel, example: screen \"close > ma(close, 60)\" --rank-by amount --limit 20"
+
+    def add_arguments(self, parser):
+        parser.add_argument('expr')
+        parser.add_argument('--date', help='Example: 20201231. If omitted, the last date of the panel.')
+        parser.add_argument('--rank-by')
+        parser.add_argument('--ascending', action='store_true')
+        parser.add_argument('--limit', type=int)
+
+    def handle(self, *args, **options):
+        panel = Panel.open(settings.STOCKDB_PANEL_PATH)
+        indicators = IndicatorStore(settings.STOCKDB_INDICATORS_PATH) if settings.STOCKDB_INDICATORS_PATH else None
+        screener = Screener(panel, indicators if indicators and indicators.dates == panel.dates else None)
+
+        started = time.perf_counter()
+        df = screener.screen(options['expr'], options['date'], options['rank_by'], options['ascending'], options['limit'])
+        elapse = time.perf_counter() - started
+        self.stdout.write(df.to_string(index=False))
+        self.stdout.write('%s stocks in %.1fms' % (len(df), elapse * 1000))
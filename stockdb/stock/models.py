@@ -1,16 +1,24 @@
+import time
+import queue
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy
 import pandas
-from django.db import models
-from django.db.models import Value
+from django.db import models, connections, transaction
+from django.db.models import Q, Value, Max, Count
 from django.db.models.functions import Concat
 from django.utils import timezone
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from collections import defaultdict
 
 from utils.functional import BaseMapper, cached_classproperty, clean_empty, chunks
+from utils.db import bulk_upsert, frame_to_rows
 from common.models import Currency, Region, Industry, Period
 from firm.models import Firm
 from market.models import Market, Subject
 from tusharepro.models import Api as TushareApi
+from stock.signals import stockperiod_synced, stockperiod_verified, send_robust
 
 
 def date_to_str(d):
@@ -31,6 +39,13 @@ def str_to_date(d):
     else:
         raise TypeError('requires `%s` in format `%%Y%%m%%d`, but received a `%s`.' % (str, type(d)))
 
+def hash_codes(codes):
+    """
+    RETURN:
+        SHA1 of the sorted codes, same for the same set of codes.
+    """
+    return hashlib.sha1(','.join(sorted(codes)).encode()).hexdigest()
+
 # Create your models here.
 
 # refer to:
@@ -106,6 +121,15 @@ class Stock(models.Model):
             objs = Stock.objects.filter(tushare_code__isnull=False).values('tushare_code', 'market_id')
             return {obj['tushare_code']: obj['market_id'] for obj in objs}
 
+        @cached_classproperty
+        def tushare_code_frame(cls):
+            """
+            RETURN:
+                DataFrame indexed by {tushare_code}, with columns: stock_id, market_id.
+            """
+            objs = Stock.objects.filter(tushare_code__isnull=False).values_list('tushare_code', 'code', 'market_id')
+            return pandas.DataFrame(list(objs), columns=['tushare_code', 'stock_id', 'market_id']).set_index('tushare_code')
+
         @cached_classproperty
         def code_to_pk(cls):
             """
@@ -135,9 +159,9 @@ class Stock(models.Model):
         def save(df, create=True, update=True):
             print('%s: %s: started with args: %s' % (datetime.now(), save.__name__, locals()))
 
-            created, updated, skipped = [], [], []
+            created_cnt, updated_cnt, skipped = 0, 0, []
             if len(df) == 0:
-                return created, updated, skipped
+                return created_cnt, updated_cnt, skipped
 
             # add columns to df
             df.insert(loc=3, column='market_id', value=df.exchange.apply(Market.Mapper.acronym_to_code.get))
@@ -161,40 +185,28 @@ class Stock(models.Model):
             df.drop(['exchange', 'market'], axis=1, inplace=True)
 
             clean_cols = ['code', 'native_code', 'tushare_code', 'name', 'market_id']
-            if create:
-                # filter df rows for creating
-                cdf = df[df.pk.isnull()].copy()
-                if len(cdf):
-                    cdf.drop(['pk'], axis=1, inplace=True)
-                    cleaned_cdf = cdf[~cdf[clean_cols].isna().all(1)]
-                    skipped.extend(cdf[~cdf.index.isin(cleaned_cdf.index)].to_dict('records'))
-
-                    # bulk create
-                    created = cls.objects.bulk_create(
-                        [cls(**d) for d in cleaned_cdf.to_dict('records')],
-                        batch_size=5000)
-
-            if update:
-                # filter df rows for updating
-                udf = df[~df.pk.isnull()]
-                if len(udf):
-                    cleaned_udf = udf[~udf[clean_cols].isna().all(1)]
-                    skipped.extend(udf[~udf.index.isin(cleaned_udf.index)].to_dict('records'))
-
-                    # auto_now is not handled by bulk_update(), handle it manually here.
-                    cleaned_udf.insert(loc=11, column='dt_updated', value=timezone.now())
-
-                    objs = [cls(**d) for d in cleaned_udf.to_dict('records')]
-
-                    # bulk update
-                    updated = cls.objects.bulk_update(
-                        objs,
-                        fields=['name', 'status', 'is_listed', 'dt_delisted', 'dt_updated'],
-                        batch_size=5000) or objs # bulk_update() returns nothing
+
+            # filter df rows for writing
+            if not create:
+                df = df[~df.pk.isnull()]
+            if not update:
+                df = df[df.pk.isnull()]
+            cleaned_df = df[~df[clean_cols].isna().all(1)]
+            skipped.extend(df[~df.index.isin(cleaned_df.index)].to_dict('records'))
+
+            if len(cleaned_df):
+                # bulk upsert
+                fields = ['code', 'native_code', 'tushare_code', 'name', 'market_id', 'subject_id',
+                          'status', 'is_listed', 'dt_listed', 'dt_delisted']
+                bulk_upsert(cls, fields, frame_to_rows(cleaned_df, fields),
+                            unique_fields=['code'],
+                            update_fields=['name', 'status', 'is_listed', 'dt_delisted'] if update else [])
+                created_cnt = int(cleaned_df.pk.isnull().sum())
+                updated_cnt = len(cleaned_df) - created_cnt
 
             print('%s: %s: ended, created: %s, updated: %s, skipped: %s'
-                  % (datetime.now(), save.__name__, len(created), len(updated), len(skipped)))
-            return created, updated, skipped
+                  % (datetime.now(), save.__name__, created_cnt, updated_cnt, len(skipped)))
+            return created_cnt, updated_cnt, skipped
         ## Inner Functions End
 
         api = TushareApi.objects.get(code='stock_basic')
@@ -208,7 +220,7 @@ class Stock(models.Model):
         if clear_mapper:
             for mapper_cls in [cls, Market, Subject]: mapper_cls.Mapper.clear()
 
-        created, updated, skipped = [], [], []
+        created_cnt, updated_cnt, skipped = 0, 0, []
 
         for status in ['D','L','P']:
             api_kwargs['list_status'] = status
@@ -218,12 +230,13 @@ class Stock(models.Model):
 
             if len(df):
                 c, u, s = save(df)
-                created.extend(c)
-                updated.extend(u)
+                created_cnt += c
+                updated_cnt += u
                 skipped.extend(s)
+        api.report_usage()
         print('%s: %s ended, created: %s, updated: %s, skipped: %s' % (
-            datetime.now(), cls.sync_from_tushare.__name__, len(created), len(updated), len(skipped)))
-        return created, updated, skipped
+            datetime.now(), cls.sync_from_tushare.__name__, created_cnt, updated_cnt, len(skipped)))
+        return created_cnt, updated_cnt, skipped
 
 class StockHist(models.Model):
     stock = models.ForeignKey(Stock, to_field='code', on_delete=models.DO_NOTHING, related_name='changes')
@@ -238,6 +251,102 @@ class StockHist(models.Model):
     dt_updated = models.DateTimeField('Updated', auto_now=True)
 
 
+class StockPeriodQuerySet(models.QuerySet):
+
+    # The fields loaded as categorical.
+    CATEGORY_FIELDS = ('stock_id', 'market_id', 'period_id')
+
+    def to_frame(self, fields=None, index=None, chunk_size=20000):
+        """
+        Load the rows to a DataFrame, without model instances or Decimal values.
+
+        The rows are streamed in chunks from a server-side cursor, see `stream_cursor()`,
+        each chunk is converted to typed arrays by column:
+            * The decimal fields:       float64, NULL as NaN.
+            * The integer fields:       int64.
+            * The date fields:          datetime64[ns].
+            * CATEGORY_FIELDS:          category.
+        PARAMS:
+            * fields:       The fields to load, example: ['stock_id', 'date', 'close'].
+                            If None, stock_id, market_id, date and the VALUE_FIELDS.
+            * index:        The fields to set as the index, example: ('date', 'stock_id').
+            * chunk_size:   The rows fetched in one round trip.
+        RETURN:
+            DataFrame
+        """
+        fields = list(fields or ['stock_id', 'market_id', 'date'] + StockPeriod.VALUE_FIELDS)
+        dtypes = {}
+        for f in fields:
+            internal = self.model._meta.get_field(f).get_internal_type()
+            if f in self.CATEGORY_FIELDS:
+                dtypes[f] = object
+            elif internal in ('DecimalField', 'FloatField'):
+                dtypes[f] = numpy.float64
+            elif internal in ('AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField', 'SmallIntegerField'):
+                dtypes[f] = numpy.int64
+            elif internal == 'DateField':
+                dtypes[f] = 'datetime64[D]'
+            else:
+                dtypes[f] = object
+
+        sql, params = self.values_list(*fields).query.sql_with_params()
+        parts = {f: [] for f in fields}
+        with self.stream_cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for f, values in zip(fields, zip(*rows)):
+                    parts[f].append(numpy.array(values, dtype=dtypes[f]))
+
+        data = {}
+        for f in fields:
+            values = numpy.concatenate(parts[f]) if parts[f] else numpy.array([], dtype=dtypes[f])
+            if f in self.CATEGORY_FIELDS:
+                values = pandas.Categorical(values)
+            elif dtypes[f] == 'datetime64[D]':
+                values = values.astype('datetime64[ns]')
+            data[f] = values
+        df = pandas.DataFrame(data, columns=fields)
+        return df.set_index(list(index)) if index else df
+
+    @contextmanager
+    def stream_cursor(self):
+        """
+        The cursor fetching the rows from the server as they are read: SSCursor on MySQL, where the
+        chunked cursor of Django is a buffered one, loading the whole result into the client first.
+        The chunked cursor on the other backends.
+        """
+        connection = connections[self.db]
+        if connection.vendor != 'mysql':
+            with connection.chunked_cursor() as cursor:
+                yield cursor
+            return
+
+        from MySQLdb.cursors import SSCursor
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(SSCursor)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def to_panel(self, field='close', chunk_size=20000):
+        """
+        Load the field to a wide panel of dates x stocks.
+        RETURN:
+            DataFrame indexed by date, with the stock_id as columns, NaN if no bar.
+        """
+        df = self.to_frame(['date', 'stock_id', field], chunk_size=chunk_size)
+        dates, date_codes = numpy.unique(df.date.values, return_inverse=True)
+        stocks = df.stock_id.cat.remove_unused_categories()
+        panel = numpy.full((len(dates), len(stocks.cat.categories)), numpy.nan)
+        panel[date_codes, stocks.cat.codes.values] = df[field].values
+        return pandas.DataFrame(panel, index=pandas.DatetimeIndex(dates, name='date'),
+                                columns=pandas.Index(stocks.cat.categories, name='stock_id'))
+
+
 class StockPeriod(models.Model):
     stock = models.ForeignKey(Stock, to_field='code', on_delete=models.DO_NOTHING, related_name='periods')
     market = models.ForeignKey(Market, to_field='code', on_delete=models.DO_NOTHING, related_name='stockperiods')
@@ -255,98 +364,118 @@ class StockPeriod(models.Model):
     dt_created = models.DateTimeField('Created', auto_now_add=True)
     dt_updated = models.DateTimeField('Updated', auto_now=True)
 
+    objects = StockPeriodQuerySet.as_manager()
+
     class Meta:
         unique_together = ('stock', 'period', 'date')
 
+    # The fields of the bar values, updated when the bar is synced again.
+    VALUE_FIELDS = ['pre_close', 'open', 'close', 'high', 'low', 'change', 'percent', 'volume', 'amount']
+
+    # The periods resampled from DAILY, with the pandas frequency of their buckets.
+    RESAMPLE_FREQS = {'WEEKLY': 'W-SUN', 'MONTHLY': 'M'}
+
+    # The verified dates sent to the receivers in one signal, the remote codes are not kept for all the dates.
+    VERIFY_BATCH_SIZE = 250
+
     class Mapper(BaseMapper):
+        pass
 
-        @cached_classproperty
-        def daily_hash_date_and_stock_to_pk(cls):
-            """
-            RETURN:
-                {
-                    hash({date}.strftime('%Y%m%d') + {stock_id}): {pk},
-                    ...
-                }
-            """
-            PERIOD = 'DAILY'
-            objs = StockPeriod.objects.filter(
-                period_id=PERIOD).values('date', 'stock_id', 'pk')
-            return {hash(date_to_str(obj['date']) + obj['stock_id']): obj['pk'] for obj in objs}
+    @classmethod
+    def transform_daily(cls, df, markets, trade_date, stocks=None):
+        """
+        Transform the data of the Tushare `daily` API on the trade date to the columns of DB model,
+        with vectorized lookups of the stocks.
+        PARAMS:
+            * df:           DataFrame returned by the `daily` API.
+            * markets:      Keep the rows of the markets only, example: ['XSHG', 'XSHE'].
+            * trade_date:   The trade date of the data, example: '19991231'.
+            * stocks:       DataFrame indexed by {tushare_code}, with columns: stock_id, market_id.
+                            If None, Stock.Mapper.tushare_code_frame.
+        RETURN:
+            DataFrame with columns: stock_id, market_id, period_id, date, and the VALUE_FIELDS.
+        """
+        PERIOD = 'DAILY'
+        stocks = Stock.Mapper.tushare_code_frame if stocks is None else stocks
 
-        @cached_classproperty
-        def daily_date_to_market_to_stocks(cls):
-            """
-            RETURN:
-                {
-                    {date}.strftime('%Y%m%d'): {
-                        {market_id}: [{stock_id}, ...],
-                        ...
-                    },
-                    ...
-                }
-            """
-            PERIOD = 'DAILY'
-            result = defaultdict(lambda: defaultdict(list))
-            objs = StockPeriod.objects.filter(
-                period_id=PERIOD).values('date', 'stock_id', 'market_id')
-            for obj in objs:
-                result[date_to_str(obj['date'])][obj['market_id']].append(obj['stock_id'])
-            return result
+        # the rows of unknown stocks are dropped by the inner join
+        df = df.join(stocks, on='ts_code', how='inner')
+        df = df[df.market_id.isin(markets)]
 
-        @cached_classproperty
-        def daily_api_date_to_market_to_stocks(cls):
-            """
-            RETURN:
-                {
-                    {date}.strftime('%Y%m%d'): {
-                        {market_id}: [{stock_id}, ...],
-                        ...
-                    },
-                    ...
-                }
-            """
-            PERIOD = 'DAILY'
-            tc_api = TushareApi.objects.get(code='trade_cal')
-            tc_api.set_token()
+        # rename columns name to map to DB model
+        df = df.rename(columns={'pct_chg': 'percent', 'vol': 'volume'})
+        df = df.assign(period_id=PERIOD, date=str_to_date(trade_date))
 
-            sp_api = TushareApi.objects.get(code=PERIOD.lower())
-            sp_api.set_token()
-            sp_api_kwargs = dict(fields='ts_code')
+        return df[['stock_id', 'market_id', 'period_id', 'date'] + cls.VALUE_FIELDS].reset_index(drop=True)
 
-            # Call trade calendar API
-            tc_df = tc_api.call(fields='cal_date', end_date=date_to_str(datetime.today()), is_open=1)
+    @classmethod
+    def get_pks(cls, period, date, stocks):
+        """
+        Resolve the existing rows of the stocks on the date, with an indexed query.
+        RETURN:
+            {
+                {stock_id}: {pk},
+                ...
+            }
+        """
+        objs = cls.objects.filter(period_id=period, date=date, stock_id__in=stocks).values_list('stock_id', 'pk')
+        return dict(objs)
 
-            result = {}
-            for tc_index, tc_row in tc_df.iterrows():
-                sp_api_kwargs['trade_date'] = tc_row['cal_date']
-                # Call daily trade data API
-                sp_df = sp_api.call(**sp_api_kwargs)
+    @classmethod
+    def get_trade_dates(cls, markets, start_date, end_date):
+        """
+        RETURN:
+            The sorted trade dates of the exchanges of the markets, example: ['19991230', '19991231'].
+        """
+        if start_date and start_date == end_date:
+            return [start_date]
 
-                # add new columns to df
-                sp_df.insert(loc=0, column='market_id', value=sp_df.ts_code.apply(Stock.Mapper.tushare_code_to_market.get))
-                sp_df.insert(loc=1, column='stock_id', value=sp_df.ts_code.apply(Stock.Mapper.tushare_code_to_code.get))
-                # drop rows with empty ts_code, market, or stock_id
-                sp_df.dropna()
+        api = TushareApi.objects.get(code='trade_cal')
+        api.set_token()
 
-                result[tc_row['cal_date']] = sp_df.groupby('market_id')['stock_id'].apply(list).to_dict()
-            return result
+        results = set()
+        for exchange in sorted(set(Market.Mapper.code_to_acronym.get(m) for m in markets)):
+            # Call trade calendar API
+            df = api.call(
+                fields='cal_date',
+                exchange=exchange,
+                start_date=start_date,
+                end_date=end_date,
+                is_open=1)
+            results.update(df['cal_date'].to_list())
+        return sorted(results)
 
     @classmethod
-    def sync_daily_from_tushare(cls, market, dates=None, start_date=None, end_date=None, stocks=None, clear_mapper=True):
+    def sync_daily_from_tushare(cls, markets=None, dates=None, start_date=None, end_date=None, stocks=None, clear_mapper=True,
+                                workers=1, queue_size=None, update=True, plan=None, progress=None, use_cache=True):
         """
         PARAMS:
-            * market:       The market to sync, example: 'XSHG'.
+            * markets:      The markets to sync, example: 'XSHG' or ['XSHG', 'XSHE'].
+                            If None, sync all the markets which have stocks.
+                            Each trade date is fetched once, the rows are routed to all the markets in one pass.
             * dates:        Sync for the dates, example: '19991231' or ['19991230', '19991231'].
                             If Set, `start_date` and `end_date` are ignored.
             * start_date:   Sync starts from the date, example: 19900101.
-                            If None, sync starts from the latest synced date in the appreciated market.
-                            If an existing synced date is not found, sync starts from the earliest date.
+                            If None, sync starts from the earliest one of the latest synced dates in the markets.
+                            If an existing synced date is not found for any market, sync starts from the earliest date.
             * end_date:     Sync ends to the date, example: 19991231.
                             If None, sync ends to today.
             * stocks:       Sync the stocks only, example: 'XSHG000001' or ['XSHG000001', 'XSHG000002'].
-                            If None, sync all the stocks of the market.
+                            If None, sync all the stocks of the markets.
             * clear_mapper: [True|False] Clear used mappers before to sync if set True.
+            * workers:      The number of workers calling the API concurrently, they share one API rate budget.
+                            If 1, the dates are fetched one after another.
+            * queue_size:   The max number of fetched but unsaved results waiting for the DB writer.
+                            If None, 2 times of `workers`.
+            * update:       [True|False] Update the existing bars with the synced values if set True.
+                            Otherwise the existing bars are skipped.
+            * plan:         The SyncPlan to execute, see `stock.planner.SyncPlanner`.
+                            If set, `markets` defaults to the markets of the plan,
+                            `dates`, `start_date`, `end_date` and `stocks` are ignored.
+            * progress:     Callable of keyword arguments: done, total, dates, rows, api_calls,
+                            called after each API call is saved, example: `common.models.Job.report`.
+            * use_cache:    [True|False] Serve the calls from the API cache if set True.
+                            Set False to fetch the remote data again, the past dates are cached with no expiry.
         TODO:
             * trade date timezone
         """
@@ -355,128 +484,177 @@ class StockPeriod(models.Model):
         print('%s: %s: sync started with args: %s' % (datetime.now(), PERIOD, locals()))
 
         ## Inner Functions
-        def get_start_date(market, stocks=[]):
-            kwargs={'period_id': PERIOD, 'market_id': market}
+        def get_start_date(markets, stocks=[]):
+            kwargs={'period_id': PERIOD, 'market_id__in': markets}
             if stocks: kwargs['stock_id__in'] = stocks
-            try:
-                d = date_to_str(cls.objects.filter(**kwargs).latest('date').date)
-            except cls.DoesNotExist:
-                d = None
-            return d
+            latest = cls.objects.filter(**kwargs).values('market_id').annotate(latest=Max('date'))
+            latest = {obj['market_id']: obj['latest'] for obj in latest}
+            if set(markets) - set(latest.keys()):
+                return None
+            return date_to_str(min(latest.values()))
 
         def get_end_date():
             return date_to_str(datetime.today())
 
-        def get_dates(market, start_date, end_date):
-            if start_date and start_date == end_date:
-                results = [start_date]
-            else:
-                api = TushareApi.objects.get(code='trade_cal')
-                api.set_token()
-
-                # Call trade calendar API
-                df = api.call(
-                    fields='cal_date',
-                    exchange=Market.Mapper.code_to_acronym.get(market),
-                    start_date=start_date,
-                    end_date=end_date,
-                    is_open=1)
-                results = df['cal_date'].to_list()
-
-            return results
-
-        def save(market, trade_date, df, create=True, update=False):
+        def save(markets, trade_date, df, create=True, update=True):
             PERIOD = 'DAILY'
             print('%s: %s: save StockPeriod with args: %s' % (datetime.now(), PERIOD, locals()))
 
-            created, updated, skipped = [], [], []
+            created_cnt, updated_cnt, skipped = 0, 0, []
             if len(df) == 0:
-                return len(created), len(updated), skipped
-
-            # add column market_id to df
-            df.insert(loc=0, column='market_id', value=df.ts_code.apply(Stock.Mapper.tushare_code_to_market.get))
+                return created_cnt, updated_cnt, skipped
 
-            # filter df rows with appreciated market
-            df = df[df.market_id == market].copy()
-
-            # add columns to df
-            df.insert(loc=0, column='stock_id', value=df.ts_code.apply(Stock.Mapper.tushare_code_to_code.get))
-            df.insert(loc=2, column='period_id', value=PERIOD)
+            # transform df to the columns of DB model, with rows of the appreciated markets
+            df = cls.transform_daily(df, markets, trade_date)
+            for m, n in df.groupby('market_id').size().items():
+                stats['rows'][m] += n
 
             # add column pk to df if found one in DB
-            df.insert(loc=0, column='pk', value=df.apply(
-                lambda row: StockPeriod.Mapper.daily_hash_date_and_stock_to_pk.get(
-                    hash(trade_date + row.stock_id)), axis=1))
-
-            # rename columns name to map to DB model
-            df.rename(columns={'trade_date': 'date', 'pct_chg': 'percent', 'vol': 'volume'},
-                      inplace=True)
-
-            # update column date in df
-            df.loc[:, 'date'] = str_to_date(trade_date)
-
-            # remove unused columns
-            df.drop(['ts_code'], axis=1, inplace=True)
-
-            if create:
-                # filter df rows for creating
-                cdf = df[df.pk.isnull()].copy()
-                if len(cdf):
-                    cdf.drop(['pk'], axis=1, inplace=True)
-                    cleaned_cdf = cdf.dropna()
-                    skipped.extend(cdf[~cdf.index.isin(cleaned_cdf.index)].to_dict('records'))
-
-                    # bulk create
-                    created = cls.objects.bulk_create(
-                        [cls(**d) for d in cleaned_cdf.to_dict('records')],
-                        batch_size=5000)
-
-            if update:
-                # filter df rows for updating
-                udf = df[~df.pk.isnull()]
-                if len(udf):
-                    cleaned_udf = udf.dropna()
-                    skipped.extend(udf[~udf.index.isin(cleaned_udf.index)].to_dict('records'))
-
-                    # auto_now is not handled by bulk_update(), handle it manually here.
-                    cleaned_udf.insert(loc=11, column='dt_updated', value=timezone.now())
-
-                    objs = [cls(**d) for d in cleaned_udf.to_dict('records')]
-
-                    # bulk update
-                    updated = cls.objects.bulk_update(
-                        objs,
-                        fields=['pre_close', 'open', 'close', 'high', 'low', 'change', 'percent', 'volume', 'amount'],
-                        batch_size=5000) or objs # bulk_update() returns nothing
+            pks = cls.get_pks(PERIOD, str_to_date(trade_date), df.stock_id.unique().tolist())
+            df.insert(loc=0, column='pk', value=df.stock_id.map(pks))
+            existing = df[~df.pk.isnull()]
+
+            # filter df rows for writing
+            if not create:
+                df = df[~df.pk.isnull()]
+            if not update:
+                df = df[df.pk.isnull()]
+            cleaned_df = df.dropna(subset=[x for x in df.columns if x != 'pk'])
+            skipped.extend(df[~df.index.isin(cleaned_df.index)].to_dict('records'))
+
+            # the rows of the date in DB after saving, the written ones and the existing ones not updated
+            stored = cleaned_df if update else pandas.concat([cleaned_df, existing])
+            for m, n in stored.groupby('market_id').size().items():
+                stats['date_rows'][trade_date][m] += n
+
+            if len(cleaned_df):
+                stats['dates'].add(trade_date)
+
+                # bulk upsert
+                fields = ['stock_id', 'market_id', 'period_id', 'date'] + cls.VALUE_FIELDS
+                bulk_upsert(cls, fields, frame_to_rows(cleaned_df, fields),
+                            unique_fields=['stock_id', 'period_id', 'date'],
+                            update_fields=cls.VALUE_FIELDS if update else [])
+                created_cnt = int(cleaned_df.pk.isnull().sum())
+                updated_cnt = len(cleaned_df) - created_cnt
 
             print('%s: %s: save StockPeriod ended, created: %s, updated: %s, skipped: %s'
-                  % (datetime.now(), PERIOD, len(created), len(updated), len(skipped)))
+                  % (datetime.now(), PERIOD, created_cnt, updated_cnt, len(skipped)))
 
-            return len(created), len(updated), skipped
+            return created_cnt, updated_cnt, skipped
 
-        def sync(market, dates, stocks=None):
+        def fetch(api, requests, workers=1, queue_size=None):
+            """
+            Call the API for the requests, and yield the (request, df, seconds of the call) in the order the calls
+            are finished.
+            With more than 1 worker, the calls run on a worker pool sharing the rate budget of the `api`,
+            the results are passed back through a bounded queue, so the caller saves the data while the
+            workers are waiting for the network.
+            """
+            if workers <= 1:
+                for kwargs in requests:
+                    started = time.time()
+                    df = api.call(**kwargs)
+                    yield kwargs, df, time.time() - started
+                return
+
+            results = queue.Queue(maxsize=queue_size or workers * 2)
+            pending = iter(requests)
+            lock, stopped = threading.Lock(), threading.Event()
+
+            def put(item):
+                while not stopped.is_set():
+                    try:
+                        results.put(item, timeout=1)
+                        return
+                    except queue.Full:
+                        pass
+
+            def work():
+                kwargs = None
+                try:
+                    while not stopped.is_set():
+                        with lock:
+                            kwargs = next(pending, None)
+                        if kwargs is None:
+                            break
+                        started = time.time()
+                        df = api.call(**kwargs)
+                        put((kwargs, df, None, time.time() - started))
+                except Exception as e:
+                    put((kwargs, None, e, 0))
+                finally:
+                    put(None)
+
+            threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+            for t in threads: t.start()
+            try:
+                finished = 0
+                while finished < len(threads):
+                    item = results.get()
+                    if item is None:
+                        finished += 1
+                        continue
+                    kwargs, df, e, elapse = item
+                    if e is not None:
+                        raise e
+                    yield kwargs, df, elapse
+            finally:
+                stopped.set()
+
+        def sync(markets, dates, stocks=None, workers=1, queue_size=None, plan=None):
             api = TushareApi.objects.get(code=PERIOD.lower())
             api.set_token()
+            api.use_cache = use_cache
             api_kwargs = dict(fields='ts_code,trade_date,open,high,low,close,pre_close,change,pct_chg,vol,amount')
             if stocks:
                 stocks = clean_empty([Stock.Mapper.code_to_tushare_code.get(x) for x in stocks if x])
                 stocks = [','.join(chunk) for chunk in chunks(stocks, 100)]
 
-            created_cnt, updated_cnt, skipped = 0, 0, []
-            for d in dates:
-                api_kwargs['trade_date'] = d
+            if plan is not None:
+                requests = [dict(api_kwargs, **x) for x in plan.requests]
+            else:
+                requests = [dict(api_kwargs, trade_date=d, ts_code=stock) for d in dates for stock in stocks or [None]]
+
+            # the full-market syncs of the dates are recorded in the ledger, one call per date
+            ledger = plan is None and not stocks
+            if ledger:
+                StockPeriodSyncLedger.record(PERIOD, markets, dates, StockPeriodSyncLedger.RUNNING)
+            finished = set()
 
-                for stock in stocks or [None]:
-                    api_kwargs['ts_code'] = stock
-                    # Call daily trade data API
-                    df = api.call(**api_kwargs)
+            created_cnt, updated_cnt, skipped = 0, 0, []
+            try:
+                # Call daily trade data API
+                for kwargs, df, elapse in fetch(api, requests, workers, queue_size):
+                    stats['api_calls'] += 1
+                    started = time.time()
 
-                    if len(df):
-                        i, j, m = save(market, d, df)
+                    # a call over a date range returns the data of many dates
+                    for trade_date, ddf in df.groupby('trade_date') if len(df) else []:
+                        i, j, m = save(markets, trade_date, ddf.copy(), update=update)
                         created_cnt += i
                         updated_cnt += j
                         skipped.extend(m)
 
+                    if ledger:
+                        d = kwargs['trade_date']
+                        rows = stats['date_rows'].get(d, {})
+                        StockPeriodSyncLedger.record(
+                            PERIOD, markets, [d], StockPeriodSyncLedger.get_statuses(PERIOD, markets, d, rows),
+                            rows=rows, api_calls=1, seconds=round(elapse + time.time() - started, 3))
+                        finished.add(d)
+
+                    if progress:
+                        progress(done=stats['api_calls'], total=len(requests), dates=len(stats['dates']),
+                                 rows=sum(stats['rows'].values()), api_calls=stats['api_calls'])
+            except BaseException as e:
+                if ledger:
+                    # the date being saved may be written partly
+                    StockPeriodSyncLedger.record(PERIOD, markets, [d for d in dates if d not in finished],
+                                                 StockPeriodSyncLedger.FAILED, error='%s: %s' % (type(e).__name__, e))
+                raise
+
+            api.report_usage()
             return created_cnt, updated_cnt, skipped
         ## Inner Functions End
 
@@ -498,12 +676,26 @@ class StockPeriod(models.Model):
         if clear_mapper:
             for mapper_cls in [cls, Market, Stock]: mapper_cls.Mapper.clear()
 
-        if not dates:
-            start_date = date_to_str(start_date) if start_date else get_start_date(market, stocks)
+        markets = plan.markets if not markets and plan is not None else cls.get_sync_markets(markets)
+
+        if not dates and plan is None:
+            start_date = date_to_str(start_date) if start_date else get_start_date(markets, stocks)
             end_date = date_to_str(end_date) if end_date else get_end_date()
-            dates = get_dates(market, start_date, end_date)
+            dates = cls.get_trade_dates(markets, start_date, end_date)
+
+        stats = {'api_calls': 0, 'rows': defaultdict(int), 'date_rows': defaultdict(lambda: defaultdict(int)), 'dates': set()}
+        started = time.time()
+
+        created_cnt, updated_cnt, skipped = sync(markets, dates, stocks, workers, queue_size, plan)
+
+        elapse = max(time.time() - started, 0.001)
+        for m in markets:
+            print('%s: %s: sync market %s: rows: %s, rows/s: %.1f'
+                  % (datetime.now(), PERIOD, m, stats['rows'][m], stats['rows'][m] / elapse))
+        print('%s: %s: sync API calls: %s, saved: %s (compared to syncing %s markets one by one)'
+              % (datetime.now(), PERIOD, stats['api_calls'], stats['api_calls'] * (len(markets) - 1), len(markets)))
 
-        created_cnt, updated_cnt, skipped = sync(market, dates, stocks)
+        send_robust(stockperiod_synced, cls, period=PERIOD, markets=markets, dates=sorted(stats['dates']))
 
         print('%s: %s: sync ended, created: %s, updated: %s, skipped: %s %s'
               % (datetime.now(), PERIOD, created_cnt, updated_cnt, len(skipped), skipped))
@@ -511,12 +703,306 @@ class StockPeriod(models.Model):
         return created_cnt, updated_cnt, skipped
 
     @classmethod
-    def checksum_daily_from_tushare(cls, sync=False, remove=False, clear_mapper=True):
+    def backfill_daily_from_tushare(cls, markets=None, start_date=None, end_date=None, progress=None, **kwargs):
+        """
+        Sync the trade dates not DONE in the ledger for all the markets, so an interrupted
+        backfill resumes from where it stopped instead of fetching the synced dates again.
+        PARAMS:
+            * markets:      The markets to sync, example: 'XSHG' or ['XSHG', 'XSHE'].
+                            If None, all the markets which have stocks.
+            * start_date:   Backfill starts from the date, example: 19900101.
+                            If None, from the earliest opened date of the markets.
+            * end_date:     Backfill ends to the date, example: 19991231.
+                            If None, to today.
+            * progress:     Passed to `sync_daily_from_tushare`.
+            * kwargs:       The other params of `sync_daily_from_tushare`, example: workers=4.
+        """
+        PERIOD = 'DAILY'
+        markets = cls.get_sync_markets(markets)
+        start_date = date_to_str(start_date) if start_date else date_to_str(
+            min(Market.objects.filter(code__in=markets).values_list('dt_opened', flat=True)))
+        end_date = date_to_str(end_date) if end_date else date_to_str(datetime.today())
+
+        done = StockPeriodSyncLedger.objects.filter(
+            period_id=PERIOD, market_id__in=markets, status=StockPeriodSyncLedger.DONE,
+            date__gte=str_to_date(start_date), date__lte=str_to_date(end_date)
+        ).values('date').annotate(markets=Count('market_id')).filter(markets=len(markets)).values_list('date', flat=True)
+        done = {date_to_str(d) for d in done}
+        dates = [d for d in cls.get_trade_dates(markets, start_date, end_date) if d not in done]
+
+        print('%s: %s: backfill dates: %s, done: %s' % (datetime.now(), PERIOD, len(dates), len(done)))
+        if not dates:
+            return 0, 0, []
+        return cls.sync_daily_from_tushare(markets=markets, dates=dates, progress=progress, **kwargs)
+
+    @classmethod
+    def repair_daily_from_tushare(cls, markets=None, start_date=None, end_date=None, progress=None, **kwargs):
         """
+        Sync again the dates in `StockPeriodSyncLedger.REPAIR_STATUSES`, and the RUNNING ones left
+        by a dead sync, not updated in `StockPeriodSyncLedger.STALE_SECONDS`. The API cache is bypassed,
+        it would replay the same responses of the past dates.
         PARAMS:
+            * markets:      The markets to repair, example: 'XSHG' or ['XSHG', 'XSHE'].
+                            If None, all the markets which have stocks.
+            * start_date:   Repair starts from the date, example: 19900101.
+            * end_date:     Repair ends to the date, example: 19991231.
+            * progress:     Passed to `sync_daily_from_tushare`.
+            * kwargs:       The other params of `sync_daily_from_tushare`, example: workers=4.
+        """
+        PERIOD = 'DAILY'
+        markets = cls.get_sync_markets(markets)
+        dates = set(StockPeriodSyncLedger.get_dates(
+            PERIOD, markets, StockPeriodSyncLedger.REPAIR_STATUSES, start_date, end_date))
+        stale = StockPeriodSyncLedger.objects.filter(
+            period_id=PERIOD, market_id__in=markets, status=StockPeriodSyncLedger.RUNNING,
+            dt_updated__lt=timezone.now() - timedelta(seconds=StockPeriodSyncLedger.STALE_SECONDS))
+        if start_date:
+            stale = stale.filter(date__gte=str_to_date(start_date))
+        if end_date:
+            stale = stale.filter(date__lte=str_to_date(end_date))
+        dates.update(date_to_str(d) for d in stale.values_list('date', flat=True).distinct().order_by())
+
+        print('%s: %s: repair dates: %s' % (datetime.now(), PERIOD, len(dates)))
+        if not dates:
+            return 0, 0, []
+        kwargs.setdefault('use_cache', False)
+        return cls.sync_daily_from_tushare(markets=markets, dates=sorted(dates), progress=progress, **kwargs)
+
+    @classmethod
+    def get_sync_markets(cls, markets=None):
+        """
+        RETURN:
+            The list of the markets, all the markets which have stocks if None.
+        """
+        if isinstance(markets, (list, tuple, set)):
+            markets = [x for x in markets if x is not None]
+        else:
+            markets = [markets] if markets is not None else []
+        return markets or sorted(set(Stock.Mapper.tushare_code_to_market.values()))
+
+    @classmethod
+    def resample_daily(cls, df, freq):
+        """
+        Aggregate the DAILY bars to the buckets of the frequency, vectorized over all the stocks.
+        The bar of a bucket is dated on the last trade date of the bucket in the DAILY data,
+        not the last date of the stock, so the suspended stocks are dated the same.
+        PARAMS:
+            * df:   DataFrame with columns: stock_id, market_id, date, and the VALUE_FIELDS.
+            * freq: The pandas frequency of the buckets, example: 'W-SUN'.
+        RETURN:
+            DataFrame with columns: stock_id, market_id, date, and the VALUE_FIELDS.
+        """
+        columns = ['stock_id', 'market_id', 'date'] + cls.VALUE_FIELDS
+        if df.empty:
+            return pandas.DataFrame(columns=columns)
+
+        df = df.sort_values(['stock_id', 'date'])
+        df = df.assign(bucket=df.date.dt.to_period(freq))
+        ends = df.groupby('bucket').date.max()
+
+        bars = df.groupby(['stock_id', 'bucket'], observed=True, sort=False).agg(
+            market_id=('market_id', 'last'), pre_close=('pre_close', 'first'), open=('open', 'first'),
+            close=('close', 'last'), high=('high', 'max'), low=('low', 'min'),
+            volume=('volume', 'sum'), amount=('amount', 'sum')).reset_index()
+        bars['date'] = bars.bucket.map(ends).dt.date
+        bars['change'] = (bars.close - bars.pre_close).round(2)
+        bars['percent'] = (bars.change / bars.pre_close * 100).round(2)
+        bars['stock_id'] = bars.stock_id.astype(str)
+        bars['market_id'] = bars.market_id.astype(str)
+        return bars[columns]
+
+    @classmethod
+    def resample_from_daily(cls, periods=None, markets=None, dates=None):
+        """
+        Materialize the bars of the periods from the DAILY bars. Only the buckets (weeks, months)
+        containing the dates are recomputed, their existing bars are deleted and written again.
+        PARAMS:
+            * periods:  The periods, example: ['WEEKLY'].
+                        If None, all of RESAMPLE_FREQS.
+                        The periods without their row of common.Period are skipped.
+            * markets:  The markets, example: ['XSHG', 'XSHE'].
+                        If None, all the markets.
+            * dates:    The DAILY dates changed, example: ['19991230', '19991231'].
+                        If None, all the buckets are recomputed.
+        RETURN:
+            {
+                {period}: {rows written},
+                ...
+            }
+        """
+        daily = cls.objects.filter(period_id='DAILY')
+        if markets:
+            daily = daily.filter(market_id__in=markets)
+
+        result = {}
+        periods = list(periods or cls.RESAMPLE_FREQS.keys())
+        found = set(Period.objects.filter(code__in=periods).values_list('code', flat=True))
+        for period in periods:
+            if period not in found:
+                print('%s: %s: WARNING: resample skipped, the period is not found in common.Period'
+                      % (datetime.now(), period))
+                continue
+            freq = cls.RESAMPLE_FREQS[period]
+            existing = cls.objects.filter(period_id=period)
+            if markets:
+                existing = existing.filter(market_id__in=markets)
+
+            if dates is not None:
+                buckets = pandas.to_datetime([date_to_str(d) for d in dates], format='%Y%m%d').to_period(freq).unique()
+                if not len(buckets):
+                    continue
+                q = Q()
+                for b in buckets:
+                    q |= Q(date__gte=b.start_time.date(), date__lte=b.end_time.date())
+                daily_qs, existing = daily.filter(q), existing.filter(q)
+            else:
+                daily_qs = daily
+
+            bars = cls.resample_daily(daily_qs.to_frame(['stock_id', 'market_id', 'date'] + cls.VALUE_FIELDS), freq)
+            bars['period_id'] = period
+            fields = ['stock_id', 'market_id', 'period_id', 'date'] + cls.VALUE_FIELDS
+
+            # the bar of an unfinished bucket moves to the later date, the old one is deleted
+            changed = set(existing.values_list('date', flat=True).distinct().order_by()) | set(bars.date.unique())
+            with transaction.atomic():
+                existing.delete()
+                result[period] = bulk_upsert(cls, fields, frame_to_rows(bars, fields),
+                                             unique_fields=['stock_id', 'period_id', 'date'])
+
+            print('%s: %s: resampled from DAILY, buckets: %s, rows: %s'
+                  % (datetime.now(), period, bars.date.nunique(), result[period]))
+            send_robust(stockperiod_synced, cls, period=period,
+                        markets=markets or sorted(set(bars.market_id.unique())),
+                        dates=sorted(date_to_str(d) for d in changed))
+        return result
+
+    @classmethod
+    def get_daily_remote_stocks(cls, api, trade_date, markets):
+        """
+        PARAMS:
+            * api:          The `daily` TushareApi with token set.
+            * trade_date:   The trade date, example: '19991231'.
+            * markets:      The markets, example: ['XSHG', 'XSHE'].
+        RETURN:
+            {
+                {market_id}: [{stock_id}, ...],
+                ...
+            }
+        """
+        df = api.call(fields='ts_code', trade_date=trade_date)
+        if len(df) == 0:
+            return {}
+        df = df.join(Stock.Mapper.tushare_code_frame, on='ts_code', how='inner')
+        df = df[df.market_id.isin(markets)]
+        return {m: sorted(codes) for m, codes in df.groupby('market_id')['stock_id'].apply(list).items()}
+
+    @classmethod
+    def verify_daily_from_tushare(cls, markets=None, start_date=None, end_date=None, recent_days=10, clear_mapper=True):
+        """
+        Verify the remote data of the trade dates, which are not verified yet or within the recent days,
+        and save the remote row count and code set hash per market into StockPeriodManifest.
+        PARAMS:
+            * markets:      The markets to verify, example: 'XSHG' or ['XSHG', 'XSHE'].
+                            If None, verify all the markets which have stocks.
+            * start_date:   Verify starts from the date, example: 19900101.
+                            If None, verify starts from the earliest date.
+            * end_date:     Verify ends to the date, example: 19991231.
+                            If None, verify ends to today.
+            * recent_days:  The trade dates within the days before today are verified again even if verified.
+            * clear_mapper: [True|False] Clear used mappers before verify if set True.
+        RETURN:
+            {({date}.strftime('%Y%m%d'), {market_id}), ...} of the verified ones whose remote code set
+            changed, or verified the first time.
+            The remote codes are sent by `stockperiod_verified` in batches of VERIFY_BATCH_SIZE dates.
+        """
+        PERIOD = 'DAILY'
+
+        print('%s: %s: verify started with args: %s' % (datetime.now(), PERIOD, locals()))
+
+        # Clear Mappers before verify
+        if clear_mapper:
+            for mapper_cls in [cls, Stock]: mapper_cls.Mapper.clear()
+
+        markets = cls.get_sync_markets(markets)
+
+        start_date = date_to_str(start_date)
+        end_date = date_to_str(end_date) or date_to_str(datetime.today())
+
+        tc_api = TushareApi.objects.get(code='trade_cal')
+        tc_api.set_token()
+        sp_api = TushareApi.objects.get(code=PERIOD.lower())
+        sp_api.set_token()
+
+        # Call trade calendar API
+        dates = tc_api.call(fields='cal_date', start_date=start_date, end_date=end_date, is_open=1)['cal_date'].to_list()
+
+        # skip the dates verified for all the markets, except the recent ones
+        recent = date_to_str(datetime.today() - timedelta(days=recent_days))
+        kwargs = {'period_id': PERIOD, 'market_id__in': markets, 'date__lte': str_to_date(end_date)}
+        if start_date: kwargs['date__gte'] = str_to_date(start_date)
+        verified = StockPeriodManifest.objects.filter(**kwargs).values('date').annotate(cnt=Count('market_id'))
+        verified = {date_to_str(obj['date']) for obj in verified if obj['cnt'] >= len(markets)}
+        dates = [d for d in dates if d not in verified or d >= recent]
+        # the remote hashes before this run, to find the code sets changed
+        previous = {(date_to_str(d), m): h for d, m, h in StockPeriodManifest.objects.filter(**kwargs).values_list(
+            'date', 'market_id', 'remote_hash')}
+
+        print('%s: %s: verify %s dates, %s dates skipped' % (datetime.now(), PERIOD, len(dates), len(verified)))
+
+        changed, result = set(), {}
+        for d in dates:
+            # the recent dates are cached with no expiry once past, so they are verified on the remote
+            sp_api.use_cache = d < recent
+            stocks = cls.get_daily_remote_stocks(sp_api, d, markets)
+            hashes = {m: hash_codes(stocks.get(m, [])) for m in markets}
+            now = timezone.now()
+            bulk_upsert(StockPeriodManifest,
+                        ['market_id', 'period_id', 'date', 'remote_count', 'remote_hash', 'dt_verified'],
+                        [(m, PERIOD, str_to_date(d), len(stocks.get(m, [])), hashes[m], now) for m in markets],
+                        unique_fields=['market_id', 'period_id', 'date'])
+            changed.update((d, m) for m in markets if previous.get((d, m)) != hashes[m])
+
+            result[d] = stocks
+            if len(result) >= cls.VERIFY_BATCH_SIZE:
+                send_robust(stockperiod_verified, cls, period=PERIOD, remote_by_date=result)
+                result = {}
+        if result:
+            send_robust(stockperiod_verified, cls, period=PERIOD, remote_by_date=result)
+
+        sp_api.report_usage()
+        print('%s: %s: verify ended, verified: %s, changed: %s' % (datetime.now(), PERIOD, len(dates), len(changed)))
+
+        return changed
+
+    @classmethod
+    def checksum_daily_from_tushare(cls, markets=None, start_date=None, end_date=None, recent_days=10,
+                                    sync=False, remove=False, dry_run=False, clear_mapper=True):
+        """
+        Compare the local data with the remote data recorded in StockPeriodManifest, the remote data is
+        verified incrementally before comparing, see `verify_daily_from_tushare()`.
+        PARAMS:
+            * markets:      The markets to check, example: 'XSHG' or ['XSHG', 'XSHE'].
+                            If None, check all the markets which have stocks.
+            * start_date:   Check starts from the date, example: 19900101.
+                            If None, check starts from the earliest date.
+            * end_date:     Check ends to the date, example: 19991231.
+                            If None, check ends to today.
+            * recent_days:  The trade dates within the days before today are verified again.
             * sync:         [True|False] Sync the missing local data if set True.
+                            The API requests are planned with the fewest calls, see `stock.planner.SyncPlanner`.
             * remove:       [True|False] Remove the extra local data if set True.
+            * dry_run:      [True|False] Print the sync plan with the estimated calls and time,
+                            but not to sync or remove if set True.
             * clear_mapper: [True|False] Clear used mappers before sync if set True.
+        RETURN:
+            (local_missing_by_date, local_extra_by_date), both in:
+            {
+                {date}.strftime('%Y%m%d'): {
+                    {market_id}: [{stock_id}, ...],
+                    ...
+                },
+                ...
+            }
         """
         PERIOD = 'DAILY'
 
@@ -526,64 +1012,385 @@ class StockPeriod(models.Model):
         if clear_mapper:
             for mapper_cls in [cls, Stock]: mapper_cls.Mapper.clear()
 
+        markets = cls.get_sync_markets(markets)
+        start_date, end_date = date_to_str(start_date), date_to_str(end_date) or date_to_str(datetime.today())
+
         ## 1. Check remote data
         print('%s: %s: checksum getting remote data' % (datetime.now(), PERIOD))
 
-        remote_by_date = cls.Mapper.daily_api_date_to_market_to_stocks
+        changed = cls.verify_daily_from_tushare(markets, start_date, end_date, recent_days, clear_mapper=False)
+
+        kwargs = {'period_id': PERIOD, 'market_id__in': markets, 'date__lte': str_to_date(end_date)}
+        if start_date: kwargs['date__gte'] = str_to_date(start_date)
+        manifest = {(date_to_str(obj['date']), obj['market_id']): (obj['remote_count'], obj['remote_hash'])
+                    for obj in StockPeriodManifest.objects.filter(**kwargs).values(
+                        'date', 'market_id', 'remote_count', 'remote_hash')}
 
         ## 2. Check local data
         print('%s: %s: checksum getting local data' % (datetime.now(), PERIOD))
 
-        local_by_date = cls.Mapper.daily_date_to_market_to_stocks
+        local = {(date_to_str(obj['date']), obj['market_id']): obj['cnt']
+                 for obj in cls.objects.filter(**kwargs).values('date', 'market_id').annotate(cnt=Count('pk'))}
+
+        def get_local_stocks(dt, m):
+            return cls.objects.filter(
+                period_id=PERIOD, date=str_to_date(dt), market_id=m).values_list('stock_id', flat=True)
+
+        def get_local_hashes(keys):
+            """
+            RETURN:
+                {(date, market_id): hash of the local codes} of the keys, read in one query per batch of dates.
+            """
+            hashes = {}
+            for batch in chunks(sorted({dt for dt, m in keys}), 100):
+                codes = defaultdict(list)
+                for dt, m, stock in cls.objects.filter(
+                        period_id=PERIOD, market_id__in=markets, date__in=[str_to_date(x) for x in batch]
+                ).values_list('date', 'market_id', 'stock_id').iterator():
+                    codes[(date_to_str(dt), m)].append(stock)
+                hashes.update({key: hash_codes(value) for key, value in codes.items() if key in keys})
+            return hashes
 
         ## 3. Calculate delta between remote and local data
         print('%s: %s: checksum calculating delta between remote and local data' % (datetime.now(), PERIOD))
 
-        for vt, v1, v2 in [
-            ('local_missing_by_date', 'local_by_date', 'remote_by_date'),
-            ('local_extra_by_date', 'remote_by_date', 'local_by_date'),
-        ]:
-            v1, v2 = locals()[v1], locals()[v2]
-            locals()[vt] = {
-                dt: {m: list(set(codes) - set((v1.get(dt) or {}).get(m) or [])) for m, codes in val.items() if codes}
-                for dt, val in v2.items() if val}
-            locals()[vt] = clean_empty(locals()[vt])
+        # the counts differ, or the code sets differ where the remote code set changed in this run
+        mismatched = {key for key in set(manifest.keys()) | set(local.keys())
+                      if manifest.get(key, (0, None))[0] != local.get(key, 0)}
+        hashed = {key for key in changed if key in manifest and key not in mismatched and local.get(key)}
+        local_hashes = get_local_hashes(hashed)
+        mismatched |= {key for key in hashed if manifest[key][1] != local_hashes.get(key)}
+        print('%s: %s: checksum mismatched: %s of %s' % (datetime.now(), PERIOD, len(mismatched), len(manifest)))
+
+        sp_api = TushareApi.objects.get(code=PERIOD.lower())
+        sp_api.set_token()
+
+        recent = date_to_str(datetime.today() - timedelta(days=recent_days))
+        local_missing_by_date, local_extra_by_date = defaultdict(dict), defaultdict(dict)
+        remote_date, remote_stocks = None, {}
+        for dt, m in sorted(mismatched):
+            # the remote codes of one date are kept at a time
+            if dt != remote_date:
+                remote_date = dt
+                # the recent dates are verified on the remote, not cached
+                sp_api.use_cache = dt < recent
+                remote_stocks = cls.get_daily_remote_stocks(sp_api, dt, markets) \
+                    if any((dt, x) in manifest for x in markets) else {}
+            remote_codes = set(remote_stocks.get(m) or [])
+            local_codes = set(get_local_stocks(dt, m)) if local.get((dt, m)) else set()
+            local_missing_by_date[dt][m] = sorted(remote_codes - local_codes)
+            local_extra_by_date[dt][m] = sorted(local_codes - remote_codes)
+        local_missing_by_date = clean_empty(dict(local_missing_by_date))
+        local_extra_by_date = clean_empty(dict(local_extra_by_date))
 
         ## 4. Output checksum results
         for name, vr in [
-            ('missing', 'local_missing_by_date'),
-            ('extra', 'local_extra_by_date'),
+            ('missing', local_missing_by_date),
+            ('extra', local_extra_by_date),
         ]:
-            vr = locals()[vr]
             print('%s: %s: checksum result: %s data (%s): %s' % (datetime.now(), PERIOD, name, len(vr.keys()), vr))
 
         ## 5. Sync the missing local data
-        if sync:
-            print('%s: %s: checksum syncing the missing local data' % (datetime.now(), PERIOD))
-            created_cnt, updated_cnt, skipped = 0, 0, []
-            for dt, val in locals()['local_missing_by_date'].items():
-                for m, codes in val.items():
-                    stocks = [Stock.Mapper.tushare_code_to_code.get(ts_code) for ts_code in codes]
-                    i, j, m = cls.sync_daily_from_tushare(
-                        market=m,
-                        dates=dt,
-                        stocks=clean_empty(stocks),
-                        clear_mapper=False
-                    )
-                    created_cnt += i
-                    updated_cnt += j
-                    skipped.extend(m)
-
-            print('%s: %s: checksum sync ended, created: %s, updated: %s, skipped: %s %s'
-                  % (datetime.now(), PERIOD, created_cnt, updated_cnt, len(skipped), skipped))
+        if sync and local_missing_by_date:
+            from stock.planner import SyncPlanner
+
+            plan = SyncPlanner([dt for dt, m in manifest.keys()]).plan(local_missing_by_date)
+            plan.describe(sp_api.get_pool_rate_limit())
+
+            if dry_run:
+                print('%s: %s: checksum dry run, skipped syncing the missing local data' % (datetime.now(), PERIOD))
+            else:
+                print('%s: %s: checksum syncing the missing local data' % (datetime.now(), PERIOD))
+                # the cached responses are what mismatched, fetch the remote data again
+                created_cnt, updated_cnt, skipped = cls.sync_daily_from_tushare(plan=plan, clear_mapper=False,
+                                                                                use_cache=False)
+
+                print('%s: %s: checksum sync ended, created: %s, updated: %s, skipped: %s %s'
+                      % (datetime.now(), PERIOD, created_cnt, updated_cnt, len(skipped), skipped))
 
         ## 6. Remove the extra local data
-        if remove:
+        if remove and dry_run:
+            print('%s: %s: checksum dry run, skipped removing the extra local data' % (datetime.now(), PERIOD))
+        elif remove:
             print('%s: %s: checksum removing the extra local data' % (datetime.now(), PERIOD))
-            for dt, val in locals()['local_extra_by_date'].items():
+            for dt, val in local_extra_by_date.items():
                 for m, codes in val.items():
-                    cls.objects.filter(period=PERIOD, date=str_to_date(dt), stock__tushare_code__in=codes).delete()
+                    cls.objects.filter(period=PERIOD, date=str_to_date(dt), stock_id__in=codes).delete()
 
         print('%s: %s: checksum ended' % (datetime.now(), PERIOD))
 
-        return (locals()['local_missing_by_date'], locals()['local_extra_by_date'])
+        return local_missing_by_date, local_extra_by_date
+
+
+class StockPeriodManifest(models.Model):
+    """
+    The remote data verified per (market, period, date), for checksum without calling the API again.
+    """
+    market = models.ForeignKey(Market, to_field='code', on_delete=models.DO_NOTHING, related_name='stockperiodmanifests')
+    period = models.ForeignKey(Period, to_field='code', on_delete=models.DO_NOTHING)
+    date = models.DateField(db_index=True)
+    remote_count = models.IntegerField(help_text='The number of stocks in the remote data.')
+    remote_hash = models.CharField(max_length=40, help_text='SHA1 of the sorted stock codes in the remote data.')
+    dt_verified = models.DateTimeField('Verified', db_index=True)
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    class Meta:
+        unique_together = ('market', 'period', 'date')
+
+
+class StockAdjFactor(models.Model):
+    """
+    The cumulative adjustment factors (hfq) of the stocks from the Tushare `adj_factor` API.
+    Only the change points are stored, a factor is valid from its date until the next one.
+    """
+    stock = models.ForeignKey(Stock, to_field='code', on_delete=models.DO_NOTHING, related_name='adjfactors')
+    market = models.ForeignKey(Market, to_field='code', on_delete=models.DO_NOTHING, related_name='stockadjfactors')
+    date = models.DateField(db_index=True)
+    factor = models.DecimalField(max_digits=16, decimal_places=6)
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    class Meta:
+        unique_together = ('stock', 'date')
+
+    # The price fields adjusted by the factors.
+    PRICE_FIELDS = ['pre_close', 'open', 'close', 'high', 'low', 'change']
+
+    class Mapper(BaseMapper):
+
+        @cached_classproperty
+        def code_to_latest_factor(cls):
+            """
+            RETURN:
+                {
+                    {stock_id}: {latest factor},
+                    ...
+                }
+            """
+            # the later factors overwrite the earlier ones
+            objs = StockAdjFactor.objects.order_by('date').values_list('stock_id', 'factor')
+            return {stock_id: float(factor) for stock_id, factor in objs}
+
+    @classmethod
+    def sync_from_tushare(cls, markets=None, dates=None, start_date=None, end_date=None, clear_mapper=True):
+        """
+        Sync the factors by trade date, only the changed factors are saved.
+        The trade dates are the ones of the synced DAILY StockPeriod.
+        PARAMS:
+            * markets:      The markets to sync, example: ['XSHG', 'XSHE'].
+                            If None, all the markets which have stocks.
+            * dates:        Sync for the dates, example: ['19991230', '19991231'].
+                            If Set, `start_date` and `end_date` are ignored.
+            * start_date:   Sync starts from the date, example: 19900101.
+                            If None, sync starts from the latest synced date.
+            * end_date:     Sync ends to the date, example: 19991231.
+                            If None, sync ends to today.
+            * clear_mapper: [True|False] Clear used mappers before to sync if set True.
+        RETURN:
+            The number of factors saved.
+        """
+        if clear_mapper:
+            for mapper_cls in [cls, Market, Stock]: mapper_cls.Mapper.clear()
+
+        markets = list(markets or sorted(set(Stock.Mapper.tushare_code_to_market.values())))
+        if dates:
+            dates = sorted(date_to_str(x) for x in ([dates] if isinstance(dates, str) else dates))
+        else:
+            latest = cls.objects.filter(market_id__in=markets).aggregate(latest=Max('date'))['latest']
+            start_date = date_to_str(start_date) if start_date else date_to_str(latest)
+            end_date = date_to_str(end_date) if end_date else date_to_str(datetime.today())
+            dates = sorted(set(StockPeriod.objects.filter(
+                period_id='DAILY', market_id__in=markets,
+                date__gte=str_to_date(start_date) if start_date else date.min,
+                date__lte=str_to_date(end_date)).values_list('date', flat=True).distinct().order_by()))
+            dates = [date_to_str(x) for x in dates]
+
+        api = TushareApi.objects.get(code='adj_factor')
+        api.set_token()
+        stocks = Stock.Mapper.tushare_code_frame
+        latest = dict(cls.Mapper.code_to_latest_factor)
+
+        saved = 0
+        for trade_date in dates:
+            df = api.call(trade_date=trade_date, fields='ts_code,trade_date,adj_factor')
+            if df is None or df.empty:
+                continue
+            df = df.join(stocks, on='ts_code', how='inner')
+            df = df[df.market_id.isin(markets) & df.adj_factor.notna()]
+            df = df.assign(date=str_to_date(trade_date), factor=df.adj_factor.astype('float64').round(6))
+            # the factor is saved on its first date and when it changes
+            df = df[(df.factor - df.stock_id.map(latest)).abs().fillna(1) > 1e-6]
+            if df.empty:
+                continue
+            fields = ['stock_id', 'market_id', 'date', 'factor']
+            saved += bulk_upsert(cls, fields, frame_to_rows(df, fields), unique_fields=['stock_id', 'date'])
+            latest.update(zip(df.stock_id, df.factor))
+            print('%s: adj_factor: %s changed factors on %s' % (datetime.now(), len(df), trade_date))
+
+        api.report_usage()
+        cls.Mapper.clear()
+        return saved
+
+    @classmethod
+    def adjust(cls, df, how='qfq', base_date=None, factors=None):
+        """
+        Adjust the prices of the bars, vectorized over all the stocks:
+            * hfq:  price * factor, the history never changes, the later prices change on corporate actions.
+            * qfq:  price * factor / base factor, the prices on the base date are not changed.
+        The qfq series only divides the hfq series by the base factor of each stock, so a new
+        corporate action changes one number per stock, not the history.
+        PARAMS:
+            * df:           DataFrame with columns: stock_id, date, and the PRICE_FIELDS to adjust.
+            * how:          'qfq' or 'hfq'.
+            * base_date:    The base date of qfq, example: '19991231'.
+                            If None, the latest factor.
+            * factors:      DataFrame of the factor change points with columns: stock_id, date, factor.
+                            If None, loaded from DB.
+        RETURN:
+            The DataFrame with the prices adjusted, and the column `factor`.
+        """
+        if how not in ('qfq', 'hfq'):
+            raise ValueError('requires `how` in qfq or hfq, but received `%s`.' % how)
+        if df.empty:
+            return df.assign(factor=pandas.Series(dtype='float64'))
+
+        stocks = sorted(set(df.stock_id.astype(str)))
+        dates = pandas.to_datetime(df.date)
+        loaded = factors is None
+        if loaded:
+            qs = cls.objects.filter(stock_id__in=stocks, date__lte=dates.max().date())
+            factors = pandas.DataFrame.from_records(qs.values_list('stock_id', 'date', 'factor').iterator(),
+                                                    columns=['stock_id', 'date', 'factor'])
+        factors = factors.assign(stock_id=factors.stock_id.astype(str), date=pandas.to_datetime(factors.date),
+                                 factor=factors.factor.astype('float64')).sort_values('date')
+
+        bars = df.assign(_order=numpy.arange(len(df)), _stock=df.stock_id.astype(str), _date=dates).sort_values('_date')
+        bars = pandas.merge_asof(bars, factors.rename(columns={'stock_id': '_stock', 'date': '_date'}),
+                                 on='_date', by='_stock', direction='backward')
+        # the bars before the first factor are not adjusted
+        bars['factor'] = bars.factor.fillna(1.0)
+
+        if how == 'qfq':
+            if base_date:
+                base = factors[factors.date <= pandas.Timestamp(str_to_date(base_date))].groupby('stock_id').factor.last()
+            elif loaded:
+                # the factors loaded end at the last bar, the latest ones may be later
+                base = pandas.Series(cls.Mapper.code_to_latest_factor, dtype='float64')
+            else:
+                base = factors.groupby('stock_id').factor.last()
+            bars['factor'] = bars.factor / bars._stock.map(base).fillna(1.0)
+
+        for f in [x for x in cls.PRICE_FIELDS if x in bars.columns]:
+            bars[f] = (bars[f].astype('float64') * bars.factor).round(4)
+        return bars.sort_values('_order').drop(columns=['_order', '_stock', '_date']).set_index(df.index)
+
+
+class StockLimit(models.Model):
+    """
+    The daily price limit hits of the stocks, evaluated from `Subject.dpl_rule` by `stock.limits`.
+    Only the bars with any flag are stored.
+    """
+    stock = models.ForeignKey(Stock, to_field='code', on_delete=models.DO_NOTHING, related_name='limits')
+    market = models.ForeignKey(Market, to_field='code', on_delete=models.DO_NOTHING, related_name='stocklimits')
+    date = models.DateField(db_index=True)
+    up_limit = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    down_limit = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    flags = models.SmallIntegerField(db_index=True, help_text='Bits of the FLAGS.')
+    streak = models.SmallIntegerField(help_text='The consecutive days closed at the up limit, negative for the down limit.')
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    class Meta:
+        unique_together = ('stock', 'date')
+
+    UP_TOUCHED = 1
+    UP_CLOSED = 2
+    UP_LOCKED = 4
+    DOWN_TOUCHED = 8
+    DOWN_CLOSED = 16
+    DOWN_LOCKED = 32
+    FLAGS = {
+        UP_TOUCHED: 'The high reached the up limit.',
+        UP_CLOSED: 'The close at the up limit.',
+        UP_LOCKED: 'The whole day at the up limit, the low at the up limit.',
+        DOWN_TOUCHED: 'The low reached the down limit.',
+        DOWN_CLOSED: 'The close at the down limit.',
+        DOWN_LOCKED: 'The whole day at the down limit, the high at the down limit.',
+    }
+
+
+class StockPeriodSyncLedger(models.Model):
+    """
+    The sync state per (period, market, date) of the full-market syncs, to resume the backfills
+    and to repair the failed or partial dates only.
+    """
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    EMPTY = 'EMPTY'
+    PARTIAL = 'PARTIAL'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [(x, x) for x in (RUNNING, DONE, EMPTY, PARTIAL, FAILED)]
+    # The statuses synced again by the repair.
+    REPAIR_STATUSES = (EMPTY, PARTIAL, FAILED)
+    # The RUNNING entries not updated in the seconds are left by a dead sync, and repaired.
+    STALE_SECONDS = 3600
+
+    market = models.ForeignKey(Market, to_field='code', on_delete=models.DO_NOTHING, related_name='stockperiodsyncledgers')
+    period = models.ForeignKey(Period, to_field='code', on_delete=models.DO_NOTHING)
+    date = models.DateField(db_index=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, db_index=True)
+    rows = models.IntegerField(default=0)
+    api_calls = models.IntegerField(default=0)
+    seconds = models.FloatField(default=0, help_text='The seconds of the API calls and the saving.')
+    error = models.TextField(null=True, blank=True)
+    dt_created = models.DateTimeField('Created', auto_now_add=True)
+    dt_updated = models.DateTimeField('Updated', auto_now=True)
+
+    class Meta:
+        unique_together = ('market', 'period', 'date')
+
+    @classmethod
+    def get_statuses(cls, period, markets, date, rows):
+        """
+        RETURN:
+            {market_id: status} of the synced date, PARTIAL if fewer rows than the verified remote data,
+            DONE without rows if the remote data is verified empty, example: a market closed on the date.
+        """
+        expected = dict(StockPeriodManifest.objects.filter(
+            period_id=period, market_id__in=markets, date=str_to_date(date)).values_list('market_id', 'remote_count'))
+        statuses = {}
+        for m in markets:
+            if not rows.get(m):
+                statuses[m] = cls.DONE if expected.get(m) == 0 else cls.EMPTY
+            else:
+                statuses[m] = cls.PARTIAL if rows[m] < expected.get(m, 0) else cls.DONE
+        return statuses
+
+    @classmethod
+    def record(cls, period, markets, dates, status, rows=None, api_calls=0, seconds=0, error=None):
+        """
+        Write the entries of the dates in the markets.
+        PARAMS:
+            * status:   The status, or {market_id: status}.
+            * rows:     {market_id: rows} of the dates in DB after saving, 0 if missing.
+        """
+        rows = rows or {}
+        statuses = status if isinstance(status, dict) else {m: status for m in markets}
+        fields = ['market_id', 'period_id', 'date', 'status', 'rows', 'api_calls', 'seconds', 'error']
+        values = [(m, period, str_to_date(d), statuses[m], rows.get(m, 0), api_calls, seconds, error)
+                  for d in dates for m in markets]
+        return bulk_upsert(cls, fields, values, unique_fields=['market_id', 'period_id', 'date'])
+
+    @classmethod
+    def get_dates(cls, period, markets, statuses, start_date=None, end_date=None):
+        """
+        RETURN:
+            The sorted dates with an entry in the statuses for any of the markets, example: ['19991231'].
+        """
+        qs = cls.objects.filter(period_id=period, market_id__in=markets, status__in=statuses)
+        if start_date:
+            qs = qs.filter(date__gte=str_to_date(start_date))
+        if end_date:
+            qs = qs.filter(date__lte=str_to_date(end_date))
+        return sorted({date_to_str(d) for d in qs.values_list('date', flat=True).distinct().order_by()})
@@ -0,0 +1,183 @@
+import os
+import json
+from datetime import datetime
+
+import numpy
+import pandas
+from numpy.lib.format import open_memmap
+
+from stock.models import StockPeriod, Stock, date_to_str, str_to_date
+
+
+class Panel:
+    """
+    The DAILY bars of StockPeriod as a dense float64 array of fields x dates x stocks,
+    memory-mapped from a .npy file, NaN if no bar. The processes opening the same
+    file share the pages of the OS cache, instead of loading a copy each.
+
+    The files under `path`:
+        * data.npy:     The array, allocated with spare dates and stocks for appending.
+        * index.json:   The fields, dates and stocks in use, example:
+                        {"fields": ["close", ...], "dates": ["19991231", ...], "stocks": ["XSHG600000", ...]}
+    The used region of the array is [:, :len(dates), :len(stocks)], the index is
+    replaced after the data is written, so the readers never see unwritten bars.
+    """
+    FIELDS = StockPeriod.VALUE_FIELDS
+    # The spare capacity allocated for appending.
+    DATE_RESERVE = 250
+    STOCK_RESERVE = 500
+    PERIOD = 'DAILY'
+
+    def __init__(self, path, data, fields, dates, stocks):
+        self.path = str(path)
+        self.data = data
+        self.fields = fields
+        self.dates = dates
+        self.stocks = stocks
+        self.field_ids = {f: i for i, f in enumerate(fields)}
+        self.date_ids = {d: i for i, d in enumerate(dates)}
+        self.stock_ids = {s: i for i, s in enumerate(stocks)}
+
+    @classmethod
+    def get_files(cls, path):
+        return os.path.join(str(path), 'data.npy'), os.path.join(str(path), 'index.json')
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Attach the panel, the data is not read until accessed.
+        PARAMS:
+            * mode: 'r' to read, 'r+' to update in place.
+        """
+        data_file, index_file = cls.get_files(path)
+        with open(index_file) as f:
+            index = json.load(f)
+        data = numpy.load(data_file, mmap_mode=mode)
+        return cls(path, data, index['fields'], index['dates'], index['stocks'])
+
+    @classmethod
+    def exists(cls, path):
+        return all(os.path.exists(x) for x in cls.get_files(path))
+
+    def save_index(self):
+        index_file = self.get_files(self.path)[1]
+        tmp = '%s.%s.tmp' % (index_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'fields': self.fields, 'dates': self.dates, 'stocks': self.stocks}, f)
+        os.replace(tmp, index_file)
+
+    @property
+    def shape(self):
+        return len(self.fields), len(self.dates), len(self.stocks)
+
+    @property
+    def values(self):
+        """
+        RETURN:
+            The view of the used region, fields x dates x stocks.
+        """
+        return self.data[:, :len(self.dates), :len(self.stocks)]
+
+    def select(self, start_date=None, end_date=None):
+        """
+        RETURN:
+            The slice of the dates between the dates, both included.
+        """
+        start = numpy.searchsorted(self.dates, date_to_str(start_date)) if start_date else 0
+        end = numpy.searchsorted(self.dates, date_to_str(end_date), side='right') if end_date else len(self.dates)
+        return slice(start, end)
+
+    def get(self, field, start_date=None, end_date=None):
+        """
+        RETURN:
+            The view of the field, dates x stocks, between the dates, both included.
+        """
+        return self.data[self.field_ids[field], self.select(start_date, end_date), :len(self.stocks)]
+
+    def frame(self, field, start_date=None, end_date=None):
+        """
+        RETURN:
+            DataFrame of the field indexed by date, with the stocks as columns, backed by the view.
+        """
+        rows = self.select(start_date, end_date)
+        dates = pandas.to_datetime(self.dates[rows], format='%Y%m%d')
+        return pandas.DataFrame(self.data[self.field_ids[field], rows, :len(self.stocks)],
+                                index=pandas.DatetimeIndex(dates, name='date'),
+                                columns=pandas.Index(self.stocks, name='stock_id'), copy=False)
+
+    @classmethod
+    def build(cls, path, fields=None):
+        """
+        Build the panel from DB, the existing one is replaced.
+        """
+        fields = list(fields or cls.FIELDS)
+        qs = StockPeriod.objects.filter(period_id=cls.PERIOD)
+        dates = sorted(date_to_str(d) for d in qs.values_list('date', flat=True).distinct().order_by())
+        stocks = list(Stock.objects.order_by('pk').values_list('code', flat=True))
+
+        os.makedirs(str(path), exist_ok=True)
+        data_file = cls.get_files(path)[0]
+        tmp = '%s.%s.tmp.npy' % (data_file, os.getpid())
+        data = open_memmap(tmp, mode='w+', dtype=numpy.float64,
+                           shape=(len(fields), len(dates) + cls.DATE_RESERVE, len(stocks) + cls.STOCK_RESERVE))
+        data[:] = numpy.nan
+        panel = cls(path, data, fields, dates, stocks)
+
+        years = sorted({d[:4] for d in dates})
+        for year in years:
+            panel.fill(qs.filter(date__gte=str_to_date(year + '0101'), date__lte=str_to_date(year + '1231')))
+            print('%s: %s: panel built year: %s' % (datetime.now(), cls.PERIOD, year))
+        data.flush()
+        del data, panel
+        os.replace(tmp, data_file)
+
+        panel = cls.open(path, mode='r+')
+        panel.save_index()
+        return panel
+
+    def fill(self, qs):
+        """
+        Write the bars of the queryset into the data, the dates and stocks must be in the index.
+        """
+        df = qs.to_frame(['date', 'stock_id'] + self.fields)
+        if df.empty:
+            return
+        date_ids = numpy.array([self.date_ids[d] for d in df.date.dt.strftime('%Y%m%d')])
+        stock_codes = numpy.array([self.stock_ids.get(s, -1) for s in df.stock_id.cat.categories])
+        stock_ids = stock_codes[df.stock_id.cat.codes.values]
+        known = stock_ids >= 0
+        for f in self.fields:
+            self.data[self.field_ids[f], date_ids[known], stock_ids[known]] = df[f].values[known]
+
+    def update(self, dates):
+        """
+        Write the bars on the dates from DB in place. The new dates after the last one and
+        the new stocks are appended into the spare capacity, or the panel is rebuilt if they
+        don't fit.
+        PARAMS:
+            * dates:    The dates synced, example: ['19991230', '19991231'].
+        RETURN:
+            The updated Panel, it's a new one if rebuilt.
+        """
+        dates = sorted({date_to_str(d) for d in dates})
+        new_dates = [d for d in dates if d not in self.date_ids]
+        qs = StockPeriod.objects.filter(period_id=self.PERIOD, date__in=[str_to_date(d) for d in dates])
+        new_stocks = sorted(set(qs.values_list('stock_id', flat=True).distinct().order_by()) - set(self.stock_ids))
+
+        fits = (not new_dates or not self.dates or new_dates[0] > self.dates[-1]) and \
+            len(self.dates) + len(new_dates) <= self.data.shape[1] and \
+            len(self.stocks) + len(new_stocks) <= self.data.shape[2]
+        if not fits:
+            print('%s: %s: panel rebuilding, dates: %s, stocks: %s not fit'
+                  % (datetime.now(), self.PERIOD, len(new_dates), len(new_stocks)))
+            return self.build(self.path, self.fields)
+
+        self.dates = self.dates + new_dates
+        self.stocks = self.stocks + new_stocks
+        self.date_ids = {d: i for i, d in enumerate(self.dates)}
+        self.stock_ids = {s: i for i, s in enumerate(self.stocks)}
+        self.data[:, [self.date_ids[d] for d in dates], :] = numpy.nan
+        self.fill(qs)
+        self.data.flush()
+        self.save_index()
+        return self
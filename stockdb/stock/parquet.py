@@ -0,0 +1,152 @@
+import os
+import shutil
+from datetime import datetime
+from collections import defaultdict
+
+import pandas
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+
+from stock.models import StockPeriod, str_to_date
+
+
+class ParquetStore:
+    """
+    StockPeriod exported to a Parquet dataset, partitioned as:
+        {path}/period={period}/market={market_id}/year={year}/data.parquet
+
+    The rows in a file are sorted by date and stock, and split in row groups, so
+    the date and stock predicates skip the row groups by their statistics, and
+    the period, market and year predicates skip the files by the partitions.
+    The VALUE_FIELDS are stored as float64.
+    """
+    FIELDS = ['stock_id', 'date'] + StockPeriod.VALUE_FIELDS
+    ROW_GROUP_SIZE = 100000
+    PARTITIONING = pyarrow.dataset.partitioning(
+        pyarrow.schema([('period', pyarrow.string()), ('market', pyarrow.string()), ('year', pyarrow.int32())]),
+        flavor='hive')
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def get_file(self, period, market, year):
+        return os.path.join(self.path, 'period=%s' % period, 'market=%s' % market, 'year=%s' % year, 'data.parquet')
+
+    def query(self, period, market, start_date, end_date=None, dates=None):
+        """
+        RETURN:
+            DataFrame of the rows in DB, with columns: FIELDS.
+        """
+        qs = StockPeriod.objects.filter(period_id=period, market_id=market)
+        if dates is not None:
+            qs = qs.filter(date__in=dates)
+        else:
+            qs = qs.filter(date__gte=start_date, date__lte=end_date)
+        df = pandas.DataFrame.from_records(qs.values_list(*self.FIELDS).iterator(), columns=self.FIELDS)
+        return df.astype({x: 'float64' for x in StockPeriod.VALUE_FIELDS})
+
+    def write(self, period, market, year, df):
+        file = self.get_file(period, market, year)
+        if df.empty:
+            if os.path.exists(file):
+                os.remove(file)
+            return
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        df = df.sort_values(['date', 'stock_id']).reset_index(drop=True)
+        table = pyarrow.Table.from_pandas(df[self.FIELDS], preserve_index=False)
+        # hidden from the dataset discovery until replaced
+        tmp = os.path.join(os.path.dirname(file), '.%s.%s.tmp' % (os.path.basename(file), os.getpid()))
+        pyarrow.parquet.write_table(table, tmp, row_group_size=self.ROW_GROUP_SIZE, compression='zstd',
+                                    use_dictionary=['stock_id'])
+        os.replace(tmp, file)
+
+    def export(self, period='DAILY', markets=None):
+        """
+        Export all the rows of the markets, the existing partitions of the markets are replaced.
+        PARAMS:
+            * markets:  The markets to export, example: ['XSHG', 'XSHE'].
+                        If None, all the markets which have rows.
+        RETURN:
+            The number of rows exported.
+        """
+        qs = StockPeriod.objects.filter(period_id=period)
+        if markets is not None:
+            qs = qs.filter(market_id__in=markets)
+        ranges = defaultdict(set)
+        for m, d in qs.values_list('market_id', 'date').distinct().order_by().iterator():
+            ranges[m].add(d.year)
+
+        rows = 0
+        for m, years in ranges.items():
+            shutil.rmtree(os.path.dirname(os.path.dirname(self.get_file(period, m, 0))), ignore_errors=True)
+            for year in sorted(years):
+                df = self.query(period, m, '%s-01-01' % year, '%s-12-31' % year)
+                self.write(period, m, year, df)
+                rows += len(df)
+                print('%s: %s: parquet exported market: %s, year: %s, rows: %s'
+                      % (datetime.now(), period, m, year, len(df)))
+        return rows
+
+    def update(self, period, markets, dates):
+        """
+        Replace the rows on the dates of the markets with the ones in DB, only the partitions
+        of the dates are rewritten.
+        PARAMS:
+            * dates:    The dates, example: ['19991230', '19991231'].
+        RETURN:
+            The number of rows written.
+        """
+        by_year = defaultdict(list)
+        for d in dates:
+            d = str_to_date(d)
+            by_year[d.year].append(d)
+
+        rows = 0
+        for m in markets:
+            for year, ds in by_year.items():
+                new = self.query(period, m, None, dates=ds)
+                file = self.get_file(period, m, year)
+                if os.path.exists(file):
+                    old = pyarrow.parquet.read_table(file, columns=self.FIELDS).to_pandas()
+                    old = old[~old.date.isin(ds)]
+                    new = pandas.concat([old, new], ignore_index=True)
+                self.write(period, m, year, new)
+                rows += len(new)
+        return rows
+
+    def read(self, period='DAILY', columns=None, markets=None, start_date=None, end_date=None, stocks=None):
+        """
+        Read the rows with the columns and predicates pushed down to the dataset scanner,
+        only the matched partitions, row groups and columns are read.
+        PARAMS:
+            * columns:      The columns to read, example: ['stock_id', 'date', 'close'].
+                            If None, FIELDS.
+            * markets:      The markets, example: ['XSHG', 'XSHE'].
+                            If None, all the markets.
+            * start_date:   The dates from, included, example: '19990101'.
+            * end_date:     The dates to, included, example: '19991231'.
+            * stocks:       The stocks, example: ['XSHG600000'].
+                            If None, all the stocks.
+        RETURN:
+            DataFrame with the columns, empty if nothing exported.
+        """
+        columns = list(columns or self.FIELDS)
+        root = os.path.join(self.path, 'period=%s' % period)
+        if not os.path.isdir(root):
+            return pandas.DataFrame(columns=columns)
+
+        field = pyarrow.dataset.field
+        start_date, end_date = str_to_date(start_date), str_to_date(end_date)
+        expr = field('period') == period
+        if markets is not None:
+            expr = expr & field('market').isin(list(markets))
+        if start_date:
+            expr = expr & (field('year') >= start_date.year) & (field('date') >= start_date)
+        if end_date:
+            expr = expr & (field('year') <= end_date.year) & (field('date') <= end_date)
+        if stocks is not None:
+            expr = expr & field('stock_id').isin(list(stocks))
+
+        dataset = pyarrow.dataset.dataset(self.path, format='parquet', partitioning=self.PARTITIONING)
+        return dataset.to_table(columns=columns, filter=expr).to_pandas()
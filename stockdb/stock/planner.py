@@ -0,0 +1,116 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from utils.functional import chunks
+from stock.models import Stock
+
+
+class SyncPlan:
+    """
+    The requests of the `daily` API to sync the missing data, in the chosen shape.
+    """
+
+    def __init__(self, shape, requests, markets, costs):
+        """
+        PARAMS:
+            * shape:    The chosen shape of the requests, one of SyncPlanner.SHAPES.
+            * requests: The kwargs of each API call, without `fields`.
+            * markets:  The markets of the missing data.
+            * costs:    {shape: {API calls}} of all the shapes.
+        """
+        self.shape = shape
+        self.requests = requests
+        self.markets = markets
+        self.costs = costs
+
+    @property
+    def calls(self):
+        return len(self.requests)
+
+    def estimate_seconds(self, rate_limit):
+        """
+        PARAMS:
+            * rate_limit:   API calls allowed per minute.
+        """
+        return self.calls * 60.0 / rate_limit if rate_limit else None
+
+    def describe(self, rate_limit=None):
+        """
+        Print the estimated API calls of each shape, and the time of the chosen one under the rate limit.
+        """
+        for shape, calls in self.costs.items():
+            print('%s: plan: %s %-6s calls: %s' % (
+                datetime.now(), '*' if shape == self.shape else ' ', shape, calls))
+        seconds = self.estimate_seconds(rate_limit)
+        print('%s: plan: chosen: %s, calls: %s, markets: %s, estimated: %s' % (
+            datetime.now(), self.shape, self.calls, self.markets,
+            '%.1fs at %s calls/min' % (seconds, rate_limit) if seconds is not None else 'unknown'))
+
+
+class SyncPlanner:
+    """
+    Choose the request shape of the `daily` API with the fewest calls to sync the missing (date, stock) set:
+        * date:     One call per date for all the stocks.
+        * codes:    Calls per date with the missing stocks in lists of `CODES_LIMIT` codes.
+        * stock:    Calls per stock over the range of its missing dates, in windows of `ROW_LIMIT` trade dates.
+    """
+    # Max rows returned by one call.
+    ROW_LIMIT = 6000
+    # Max codes in `ts_code` of one call.
+    CODES_LIMIT = 100
+    # Preferred in this order if the calls are equal, fewer rows are transferred by the former.
+    SHAPES = ('codes', 'date', 'stock')
+
+    def __init__(self, trade_dates):
+        """
+        PARAMS:
+            * trade_dates:  The trade dates, to count the dates within the range of a stock.
+        """
+        self.trade_dates = sorted(trade_dates)
+
+    def plan(self, missing, shape=None):
+        """
+        PARAMS:
+            * missing:  The missing data, in:
+                        {
+                            {date}.strftime('%Y%m%d'): {
+                                {market_id}: [{stock_id}, ...],
+                                ...
+                            },
+                            ...
+                        }
+            * shape:    Use the shape, one of SHAPES.
+                        If None, the one with the fewest calls.
+        RETURN:
+            SyncPlan
+        """
+        code_to_tushare_code = Stock.Mapper.code_to_tushare_code
+        trade_dates = sorted(set(self.trade_dates) | set(missing.keys()))
+
+        markets = sorted({m for val in missing.values() for m in val.keys()})
+        by_date = {d: sorted({code_to_tushare_code[s] for codes in val.values() for s in codes
+                              if s in code_to_tushare_code})
+                   for d, val in missing.items()}
+        by_date = {d: codes for d, codes in by_date.items() if codes}
+        by_stock = defaultdict(list)
+        for d, codes in by_date.items():
+            for c in codes:
+                by_stock[c].append(d)
+
+        requests = {
+            'date': [{'trade_date': d} for d in sorted(by_date)],
+            'codes': [{'trade_date': d, 'ts_code': ','.join(chunk)}
+                      for d in sorted(by_date) for chunk in chunks(by_date[d], self.CODES_LIMIT)],
+            'stock': [],
+        }
+        for c, dates in sorted(by_stock.items()):
+            window = trade_dates[bisect_left(trade_dates, min(dates)):bisect_right(trade_dates, max(dates))]
+            for i in range(0, len(window), self.ROW_LIMIT):
+                part = window[i:i + self.ROW_LIMIT]
+                requests['stock'].append({'ts_code': c, 'start_date': part[0], 'end_date': part[-1]})
+
+        costs = {x: len(requests[x]) for x in self.SHAPES}
+        shape = shape or min(self.SHAPES, key=lambda x: (costs[x], self.SHAPES.index(x)))
+        return SyncPlan(shape, requests[shape], markets, costs)
+
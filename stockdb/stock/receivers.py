@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.dispatch import receiver
+
+from stock.models import StockPeriod, date_to_str, str_to_date
+from stock.signals import stockperiod_synced, stockperiod_verified
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def update_coverage_local(sender, period, markets, dates, **kwargs):
+    if not settings.STOCKDB_COVERAGE_UPDATE or not settings.STOCKDB_COVERAGE_PATH or period != 'DAILY':
+        return
+    from stock.coverage import CoverageIndex
+    index = CoverageIndex.load(settings.STOCKDB_COVERAGE_PATH, period)
+    stocks_by_date = {date_to_str(d): [] for d in dates}
+    rows = sender.objects.filter(period_id=period, date__in=[str_to_date(d) for d in dates],
+                                 market_id__in=markets).values_list('date', 'stock_id')
+    for d, stock in rows:
+        stocks_by_date[date_to_str(d)].append(stock)
+    for d, stocks in stocks_by_date.items():
+        index.update('local', d, stocks, markets)
+    index.save()
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def update_parquet(sender, period, markets, dates, **kwargs):
+    # the resampled periods are derived from DAILY, exported by `export_parquet`
+    if not settings.STOCKDB_PARQUET_UPDATE or not settings.STOCKDB_PARQUET_PATH or period != 'DAILY' or not dates:
+        return
+    from stock.parquet import ParquetStore
+    ParquetStore(settings.STOCKDB_PARQUET_PATH).update(period, markets, dates)
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def update_panel(sender, period, markets, dates, **kwargs):
+    if not settings.STOCKDB_PANEL_UPDATE or not settings.STOCKDB_PANEL_PATH or period != 'DAILY' or not dates:
+        return
+    from stock.panel import Panel
+    # the panel is built by the `build_panel` command first
+    if Panel.exists(settings.STOCKDB_PANEL_PATH):
+        Panel.open(settings.STOCKDB_PANEL_PATH, mode='r+').update(dates)
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def update_indicators(sender, period, markets, dates, **kwargs):
+    # connected after `update_panel`, so the panel has the dates
+    if not settings.STOCKDB_INDICATORS_UPDATE or not settings.STOCKDB_PANEL_UPDATE or \
+            not settings.STOCKDB_INDICATORS_PATH or not settings.STOCKDB_PANEL_PATH or period != 'DAILY' or not dates:
+        return
+    from stock.panel import Panel
+    from stock.indicators import IndicatorStore
+    if not Panel.exists(settings.STOCKDB_PANEL_PATH):
+        return
+    panel = Panel.open(settings.STOCKDB_PANEL_PATH)
+    store = IndicatorStore(settings.STOCKDB_INDICATORS_PATH)
+    dates = {date_to_str(d) for d in dates}
+    if dates & set(store.dates[:-1]) or (store.dates and store.dates[-1] in dates and not store.rewind()):
+        # the evaluated dates before the last one are synced again
+        store.compute(panel.dates, panel.stocks, {f: panel.get(f) for f in store.inputs})
+    else:
+        # the last date synced again is evaluated again from the states before it
+        store.update_from_panel(panel)
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def update_limits(sender, period, markets, dates, **kwargs):
+    # connected after `update_panel`, so the panel has the dates
+    if not settings.STOCKDB_LIMIT_FLAGS or not settings.STOCKDB_PANEL_UPDATE or \
+            not settings.STOCKDB_PANEL_PATH or period != 'DAILY' or not dates:
+        return
+    from stock.panel import Panel
+    from stock import limits
+    if Panel.exists(settings.STOCKDB_PANEL_PATH):
+        limits.save(Panel.open(settings.STOCKDB_PANEL_PATH), min(dates), max(dates))
+
+
+@receiver(stockperiod_synced, sender=StockPeriod)
+def resample_periods(sender, period, markets, dates, **kwargs):
+    if not settings.STOCKDB_RESAMPLE_PERIODS or period != 'DAILY' or not dates:
+        return
+    sender.resample_from_daily(settings.STOCKDB_RESAMPLE_PERIODS, markets, dates)
+
+
+@receiver(stockperiod_verified, sender=StockPeriod)
+def update_coverage_remote(sender, period, remote_by_date, **kwargs):
+    if not settings.STOCKDB_COVERAGE_UPDATE or not settings.STOCKDB_COVERAGE_PATH or period != 'DAILY':
+        return
+    from stock.coverage import CoverageIndex
+    index = CoverageIndex.load(settings.STOCKDB_COVERAGE_PATH, period)
+    for d, by_market in remote_by_date.items():
+        index.update('remote', d, [s for stocks in by_market.values() for s in stocks], list(by_market.keys()) or None)
+    index.save()
@@ -0,0 +1,257 @@
+"""
+Cross-sectional stock screener over the memory-mapped panel.
+
+A screen is an expression over the stocks on a date, example:
+    market == 'XSHE' and close > ma(close, 60) and volume > 2 * ma(volume, 20) and subject_name == '创业板'
+
+The names in the expressions:
+    * The panel fields:     close, open, high, low, pre_close, change, percent, volume, amount.
+    * The indicator outputs of `stock.indicators.IndicatorStore`, example: rsi14, macd12_26_9.dif.
+    * The stock attributes: ATTRIBUTES.
+The functions over the last n dates, on the date included:
+    * ma(field, n):     The mean, NaN if any bar is missing.
+    * max(field, n):    The highest.
+    * min(field, n):    The lowest.
+    * ref(field, n):    The value n dates before.
+The operators: and, or, not, in, not in, comparisons, +, -, *, /.
+"""
+import ast
+import operator
+
+import numpy
+import pandas
+
+from stock.models import Stock, date_to_str
+
+
+class ScreenerError(ValueError):
+    pass
+
+
+class Screener:
+    """
+    Evaluate the compiled expressions on the panel, the stocks are ranked by the per-date sort
+    indexes of the fields, computed once per (field, date) and cached.
+    """
+    # The attributes of the stocks, by the lookups of Stock.
+    ATTRIBUTES = {
+        'market': 'market_id',
+        'market_acronym': 'market__acronym',
+        'subject': 'subject_id',
+        'subject_name': 'subject__name',
+        'listed': 'is_listed',
+        'status': 'status',
+    }
+    FUNCTIONS = {
+        'ma': lambda x: numpy.nanmean(x, axis=0) if len(x) else numpy.nan,
+        'max': lambda x: numpy.nanmax(x, axis=0),
+        'min': lambda x: numpy.nanmin(x, axis=0),
+    }
+    COMPARES = {
+        ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+        ast.Gt: operator.gt, ast.GtE: operator.ge,
+    }
+    BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+    def __init__(self, panel, indicators=None, attributes=None):
+        """
+        PARAMS:
+            * panel:        The `stock.panel.Panel`.
+            * indicators:   The `stock.indicators.IndicatorStore` on the same dates and stocks.
+                            If None, the indicators are not available.
+            * attributes:   {name: array of the values of the stocks} of the ATTRIBUTES.
+                            If None, loaded from Stock.
+        """
+        self.panel = panel
+        self.indicators = indicators
+        self.compiled = {}
+        self.sort_indexes = {}
+        self.attributes = self.get_attributes(panel.stocks) if attributes is None else attributes
+
+    @classmethod
+    def get_attributes(cls, stocks):
+        """
+        RETURN:
+            {name: array of the values of the stocks} of the ATTRIBUTES, None if the stock is not found.
+        """
+        values = {x[0]: x[1:] for x in Stock.objects.filter(code__in=stocks).values_list(
+            'code', *cls.ATTRIBUTES.values())}
+        attributes = {}
+        for i, name in enumerate(cls.ATTRIBUTES.keys()):
+            attributes[name] = numpy.array([values[s][i] if s in values else None for s in stocks], dtype=object)
+        return attributes
+
+    def get_row(self, name, i, n=1):
+        """
+        RETURN:
+            The values of the field on the last n dates until the i-th date, n x stocks.
+        """
+        if name in self.panel.field_ids:
+            data = self.panel.get(name)
+        elif self.indicators is not None and any(name in x.outputs for x in self.indicators.indicators):
+            data = self.indicators.get(name)
+        else:
+            raise ScreenerError('unknown field `%s`.' % name)
+        return numpy.asarray(data[max(i - n + 1, 0):i + 1], dtype=numpy.float64)
+
+    def compile(self, expr):
+        """
+        Parse the expression once into a function of the date index.
+        """
+        if expr not in self.compiled:
+            try:
+                tree = ast.parse(expr, mode='eval')
+            except SyntaxError as e:
+                raise ScreenerError('invalid expression `%s`: %s' % (expr, e))
+            self.compiled[expr] = self.build(tree.body)
+        return self.compiled[expr]
+
+    def get_name(self, node):
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Attribute):
+            return '%s.%s' % (self.get_name(node.value), node.attr)
+        raise ScreenerError('requires a field name, but received `%s`.' % ast.dump(node))
+
+    def build(self, node):
+        if isinstance(node, ast.BoolOp):
+            funcs = [self.build(x) for x in node.values]
+            reduce = numpy.logical_and.reduce if isinstance(node.op, ast.And) else numpy.logical_or.reduce
+            return lambda i: reduce([f(i) for f in funcs])
+        if isinstance(node, ast.UnaryOp):
+            func = self.build(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda i: ~numpy.asarray(func(i), dtype=bool)
+            if isinstance(node.op, ast.USub):
+                return lambda i: -func(i)
+        if isinstance(node, ast.BinOp) and type(node.op) in self.BINOPS:
+            op, left, right = self.BINOPS[type(node.op)], self.build(node.left), self.build(node.right)
+            return lambda i: op(left(i), right(i))
+        if isinstance(node, ast.Compare):
+            return self.build_compare(node)
+        if isinstance(node, ast.Call):
+            return self.build_call(node)
+        if isinstance(node, ast.Constant):
+            return lambda i, value=node.value: value
+        if isinstance(node, (ast.Tuple, ast.List)):
+            values = [self.build(x)(None) for x in node.elts]
+            return lambda i: values
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            name = self.get_name(node)
+            if name in self.attributes:
+                values = self.attributes[name]
+                return lambda i: values
+            self.get_row(name, 0)
+            return lambda i: self.get_row(name, i)[-1]
+        raise ScreenerError('unsupported expression `%s`.' % ast.dump(node))
+
+    def build_compare(self, node):
+        funcs = [self.build(x) for x in [node.left] + node.comparators]
+
+        def compare(i):
+            values = [f(i) for f in funcs]
+            result = True
+            for op, left, right in zip(node.ops, values, values[1:]):
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    hit = numpy.isin(left, list(right))
+                    hit = ~hit if isinstance(op, ast.NotIn) else hit
+                else:
+                    with numpy.errstate(invalid='ignore'):
+                        hit = self.COMPARES[type(op)](left, right)
+                result = result & hit
+            return numpy.asarray(result, dtype=bool)
+
+        for op in node.ops:
+            if type(op) not in self.COMPARES and not isinstance(op, (ast.In, ast.NotIn)):
+                raise ScreenerError('unsupported operator `%s`.' % type(op).__name__)
+        return compare
+
+    def build_call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if name not in list(self.FUNCTIONS.keys()) + ['ref'] or len(node.args) != 2 or \
+                not isinstance(node.args[1], ast.Constant) or not isinstance(node.args[1].value, int):
+            raise ScreenerError('unsupported function call `%s`.' % ast.dump(node))
+        field, n = self.get_name(node.args[0]), node.args[1].value
+        self.get_row(field, 0)
+
+        if name == 'ref':
+            def ref(i):
+                if i - n < 0:
+                    return numpy.full(len(self.panel.stocks), numpy.nan)
+                return self.get_row(field, i - n)[-1]
+            return ref
+
+        func = self.FUNCTIONS[name]
+
+        def window(i):
+            rows = self.get_row(field, i, n)
+            result = func(rows) if len(rows) == n else numpy.full(len(self.panel.stocks), numpy.nan)
+            if name == 'ma':
+                result = numpy.where(numpy.isnan(rows).any(axis=0), numpy.nan, result)
+            return result
+        return window
+
+    def get_sort_index(self, field, i):
+        """
+        RETURN:
+            The stock indexes sorted by the field on the i-th date in descending order, NaN last.
+        """
+        key = (field, i)
+        if key not in self.sort_indexes:
+            row = self.get_row(field, i)[-1]
+            self.sort_indexes[key] = numpy.argsort(numpy.where(numpy.isnan(row), -numpy.inf, -row), kind='stable')
+        return self.sort_indexes[key]
+
+    def prepare(self, fields, start_date=None, end_date=None):
+        """
+        Precompute the sort indexes of the fields on the dates.
+        """
+        rows = self.panel.select(start_date, end_date)
+        for field in fields:
+            data = numpy.asarray(self.panel.get(field)[rows], dtype=numpy.float64)
+            indexes = numpy.argsort(numpy.where(numpy.isnan(data), -numpy.inf, -data), axis=1, kind='stable')
+            for i, index in zip(range(rows.start, rows.stop), indexes):
+                self.sort_indexes[(field, i)] = index
+
+    def screen(self, expr, date=None, rank_by=None, ascending=False, limit=None):
+        """
+        PARAMS:
+            * expr:         The expression.
+            * date:         The date, example: '19991231'.
+                            If None, the last date of the panel.
+            * rank_by:      The field or expression to rank by, example: 'amount' or 'close / ma(close, 20)'.
+                            If a field, the cached sort index is used.
+                            If None, the stocks are in the panel order.
+            * ascending:    [True|False] Rank in ascending order if set True.
+            * limit:        The max number of the stocks.
+        RETURN:
+            DataFrame with columns: stock_id, score, ranked.
+        """
+        if date is None:
+            i = len(self.panel.dates) - 1
+        else:
+            i = self.panel.date_ids.get(date_to_str(date))
+            if i is None:
+                raise ScreenerError('date `%s` is not in the panel.' % date)
+
+        mask = numpy.broadcast_to(numpy.asarray(self.compile(expr)(i), dtype=bool), (len(self.panel.stocks), ))
+        if rank_by is None:
+            order = numpy.flatnonzero(mask)
+            scores = numpy.full(len(order), numpy.nan)
+        else:
+            if rank_by in self.panel.field_ids:
+                index = self.get_sort_index(rank_by, i)
+                score = self.get_row(rank_by, i)[-1]
+            else:
+                score = numpy.asarray(self.compile(rank_by)(i), dtype=numpy.float64)
+                index = numpy.argsort(numpy.where(numpy.isnan(score), -numpy.inf, -score), kind='stable')
+            if ascending:
+                valid = index[~numpy.isnan(score[index])]
+                index = numpy.concatenate([valid[::-1], index[len(valid):]])
+            order = index[mask[index]]
+            scores = score[order]
+
+        if limit is not None:
+            order, scores = order[:limit], scores[:limit]
+        return pandas.DataFrame({'stock_id': [self.panel.stocks[x] for x in order], 'score': scores,
+                                 'ranked': numpy.arange(1, len(order) + 1)})
@@ -0,0 +1,28 @@
+import traceback
+from datetime import datetime
+
+from django.dispatch import Signal
+
+
+# Sent after StockPeriod is synced, with args: period, markets, dates.
+#   * dates: The dates with rows written, example: ['19991230', '19991231'].
+stockperiod_synced = Signal()
+
+# Sent after the remote data of StockPeriod is verified, with args: period, remote_by_date.
+#   * remote_by_date: {{date}: {{market_id}: [{stock_id}, ...]}} of a batch of the verified dates,
+#                     sent once per batch of `StockPeriod.VERIFY_BATCH_SIZE` dates.
+stockperiod_verified = Signal()
+
+
+def send_robust(signal, sender, **kwargs):
+    """
+    Send the signal to all the receivers, the errors of the receivers are printed instead of raised,
+    the rows are committed already, and the derived data can be rebuilt by the commands.
+    """
+    responses = signal.send_robust(sender=sender, **kwargs)
+    for receiver, response in responses:
+        if isinstance(response, Exception):
+            print('%s: WARNING: receiver %s.%s failed: %s' % (
+                datetime.now(), receiver.__module__, receiver.__name__,
+                ''.join(traceback.format_exception(type(response), response, response.__traceback__))))
+    return responses
@@ -1,3 +1,73 @@
-from django.test import TestCase
+from datetime import date
+
+import numpy
+import pandas
+from django.test import SimpleTestCase
+
+from stock.models import StockAdjFactor
+from stock.panel import Panel
+from stock.screener import Screener, ScreenerError
+
 
 # Create your tests here.
+
+class ScreenerTest(SimpleTestCase):
+
+    def setUp(self):
+        fields, dates, stocks = Panel.FIELDS, ['19991229', '19991230', '19991231'], ['A', 'B', 'C']
+        data = numpy.full((len(fields), len(dates), len(stocks)), numpy.nan)
+        panel = Panel('', data, fields, dates, stocks)
+        data[panel.field_ids['close']] = [[10, 20, numpy.nan], [11, 19, 5], [12, 18, 6]]
+        data[panel.field_ids['volume']] = 1
+        self.screener = Screener(panel, attributes={'market': numpy.array(['XSHG', 'XSHE', 'XSHG'], dtype=object)})
+
+    def test_screen(self):
+        result = self.screener.screen('close > ma(close, 2) and volume > 0')
+        self.assertEqual(result.stock_id.tolist(), ['A', 'C'])
+        result = self.screener.screen('close > ref(close, 1)', date='19991230', rank_by='close', limit=1)
+        self.assertEqual(result.stock_id.tolist(), ['A'])
+        result = self.screener.screen("market == 'XSHG'", rank_by='close', ascending=True)
+        self.assertEqual(result.stock_id.tolist(), ['C', 'A'])
+
+    def test_rejected(self):
+        for expr in [
+            "__import__('os')",
+            'close.__class__',
+            'ma(close, 2).real',
+            'close[0]',
+            'ma(close, volume)',
+            '[x for x in close]',
+            'lambda: 1',
+            'unknown > 1',
+            'close >',
+        ]:
+            with self.subTest(expr=expr), self.assertRaises(ScreenerError):
+                self.screener.compile(expr)
+
+
+class StockAdjFactorTest(SimpleTestCase):
+
+    def setUp(self):
+        # A: 2 for 1 on 19990104, B: no factor
+        self.factors = pandas.DataFrame({'stock_id': ['A', 'A'], 'date': [date(1999, 1, 1), date(1999, 1, 4)],
+                                         'factor': [1.0, 2.0]})
+        self.bars = pandas.DataFrame({
+            'stock_id': ['A', 'B', 'A', 'A', 'A'],
+            'date': [date(1999, 1, 5), date(1999, 1, 5), date(1998, 12, 31), date(1999, 1, 1), date(1999, 1, 4)],
+            'close': [5.5, 3.0, 20.0, 10.0, 5.2],
+        })
+
+    def test_hfq(self):
+        df = StockAdjFactor.adjust(self.bars, how='hfq', factors=self.factors)
+        self.assertEqual(df.close.tolist(), [11.0, 3.0, 20.0, 10.0, 10.4])
+        self.assertEqual(df.factor.tolist(), [2.0, 1.0, 1.0, 1.0, 2.0])
+
+    def test_qfq(self):
+        df = StockAdjFactor.adjust(self.bars, how='qfq', factors=self.factors)
+        self.assertEqual(df.close.tolist(), [5.5, 3.0, 10.0, 5.0, 5.2])
+        df = StockAdjFactor.adjust(self.bars, how='qfq', base_date='19990101', factors=self.factors)
+        self.assertEqual(df.close.tolist(), [11.0, 3.0, 20.0, 10.0, 10.4])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            StockAdjFactor.adjust(self.bars, how='none', factors=self.factors)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -130,3 +131,47 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Tushare.pro API
+# The URL of the API, set to a local stand-in (`manage.py tushare_standin`) for offline runs.
+# If None, the default of the tushare package.
+TUSHARE_API_URL = os.environ.get('TUSHARE_API_URL')
+# The state of the API rate limiter, shared by all the processes on the host.
+TUSHARE_RATELIMIT_PATH = BASE_DIR / 'var' / 'tushare_ratelimit.sqlite3'
+# The cache of the API responses, set None to disable.
+TUSHARE_CACHE_PATH = BASE_DIR / 'var' / 'tushare_cache'
+# The max total size of the cached responses, in bytes.
+TUSHARE_CACHE_MAX_SIZE = 2 * 1024 ** 3
+
+
+# StockDB
+# The derived data below are updated by the receivers of the syncs, run in the sync after the rows
+# are committed, the errors of the receivers are printed, not raised. They are off by default,
+# every sync pays for the updates enabled, otherwise they are built by the commands.
+
+# The bitmap index of the stocks covered per date, built by `build_coverage`.
+STOCKDB_COVERAGE_PATH = BASE_DIR / 'var' / 'coverage_daily.npz'
+# Update the coverage index after syncs and verifies.
+STOCKDB_COVERAGE_UPDATE = False
+# The Parquet dataset of StockPeriod, built by `export_parquet`.
+STOCKDB_PARQUET_PATH = BASE_DIR / 'var' / 'stockperiod'
+# Rewrite the Parquet files of the synced dates after syncs.
+STOCKDB_PARQUET_UPDATE = False
+# The memory-mapped panel of the DAILY bars, built by `build_panel`.
+STOCKDB_PANEL_PATH = BASE_DIR / 'var' / 'panel_daily'
+# Append the synced dates to the panel after syncs.
+STOCKDB_PANEL_UPDATE = False
+# The indicators of the DAILY panel, used by `screen`.
+STOCKDB_INDICATORS_PATH = BASE_DIR / 'var' / 'indicators_daily'
+# Extend the indicators with the synced dates after syncs, requires STOCKDB_PANEL_UPDATE.
+STOCKDB_INDICATORS_UPDATE = False
+# Evaluate the daily price limits of the synced dates by the DAILY panel into StockLimit after syncs,
+# requires STOCKDB_PANEL_UPDATE, otherwise evaluated by `evaluate_limits`.
+STOCKDB_LIMIT_FLAGS = False
+# Compute the levels of all the indexes with constituents after syncs,
+# otherwise computed by `compute_index_levels`.
+STOCKDB_INDEX_LEVELS = False
+# The periods of StockPeriod resampled from the DAILY bars after syncs, example: ['WEEKLY', 'MONTHLY'].
+# The periods without their rows of common.Period are skipped, otherwise resampled by `resample_stockperiod`.
+STOCKDB_RESAMPLE_PERIODS = []
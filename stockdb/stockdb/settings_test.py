@@ -0,0 +1,25 @@
+"""
+Django settings for the tests of stockdb, on SQLite without a MySQL server.
+
+Select the module by the environment of any runner, example:
+    DJANGO_SETTINGS_MODULE=stockdb.settings_test python manage.py test
+"""
+
+import tempfile
+
+from .settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# The migrations of the apps are not committed, their tables are created from the models.
+MIGRATION_MODULES = {app: None for app in ['common', 'market', 'firm', 'index', 'stock', 'tusharepro']}
+
+# The files of the tests are kept apart from the data.
+TEST_DIR = Path(tempfile.mkdtemp(prefix='stockdb-test-'))
+TUSHARE_RATELIMIT_PATH = TEST_DIR / 'ratelimit.sqlite3'
+TUSHARE_CACHE_PATH = None
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from tusharepro.standin import Server, Synthesizer, Recorder, Player
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in of the Tushare.pro API, point settings.TUSHARE_API_URL to it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['synth', 'record', 'replay'], default='synth',
+                            help='synth: generate data; record: proxy to the upstream and save the responses; '
+                                 'replay: serve the saved responses, generate data if not found.')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--path', default='var/tushare_record', help='Directory of the recorded responses.')
+        parser.add_argument('--upstream', default='http://api.waditu.com', help='The real API to record.')
+        parser.add_argument('--stocks', type=int, default=5000, help='Number of stocks to generate.')
+        parser.add_argument('--dates', type=int, default=250, help='Number of trade dates to generate.')
+        parser.add_argument('--start-date', default='20200101', help='The first trade date to generate.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency', type=float, default=0, help='Seconds to delay each response.')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of requests answered with the throttling error.')
+
+    def handle(self, *args, **options):
+        synthesizer = Synthesizer(options['stocks'], options['dates'], options['start_date'], options['seed'])
+        if options['mode'] == 'record':
+            backend = Recorder(options['path'], options['upstream'])
+        elif options['mode'] == 'replay':
+            backend = Player(options['path'], fallback=synthesizer)
+        else:
+            backend = synthesizer
+
+        server = Server((options['host'], options['port']), backend,
+                        latency=options['latency'], error_rate=options['error_rate'], seed=options['seed'])
+        self.stdout.write('Tushare stand-in (%s) serving at %s' % (options['mode'], server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('Served %s requests.' % server.counter)
@@ -1,9 +1,20 @@
-import time
+import hashlib
+import threading
 from datetime import datetime
+from collections import defaultdict
 
+from django.conf import settings
 from django.db import models
 import tushare
 
+from utils.cache import DataFrameCache
+from utils.ratelimit import RateLimiter
+
+
+limiter = RateLimiter(settings.TUSHARE_RATELIMIT_PATH)
+cache = DataFrameCache(settings.TUSHARE_CACHE_PATH, settings.TUSHARE_CACHE_MAX_SIZE) \
+    if settings.TUSHARE_CACHE_PATH else None
+
 
 # Create your models here.
 
@@ -24,6 +35,8 @@ class Account(models.Model):
     password = models.CharField(max_length=32, null=True, blank=True)
     token = models.CharField(max_length=64, null=True, blank=True)
     credit = models.IntegerField(null=True, blank=True)
+    is_active = models.BooleanField(default=True, db_index=True,
+        help_text='Used in the token pool of API calls.')
     dt_created = models.DateTimeField('Created', auto_now_add=True)
     dt_updated = models.DateTimeField('Updated', auto_now=True)
 
@@ -74,67 +87,142 @@ class Api(models.Model):
     category = models.ForeignKey(ApiCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='apis')
     desc = models.CharField('Description', max_length=512, null=True, blank=True)
     credit = models.IntegerField(default=0, null=True, blank=True)
+    rate_limit = models.IntegerField(null=True, blank=True,
+        help_text='Calls allowed per minute for an account. If empty, decided by the credit of the account.')
     dt_created = models.DateTimeField('Created', auto_now_add=True)
     dt_updated = models.DateTimeField('Updated', auto_now=True)
 
     objects = ApiManager()
 
+    # API throttling period, in seconds.
+    RATE_PERIOD = 61
+    # Calls allowed at once after idle.
+    RATE_BURST = 1
+    # ({min account credit}, {calls per minute}), used if `rate_limit` is empty.
+    RATE_LIMIT_TIERS = (
+        (5000, 500),
+        (2000, 200),
+        (0, 50),
+    )
+
+    # Seconds to keep the cached responses by API code, for the calls not bound to closed dates.
+    CACHE_TTL = {
+        'stock_basic': 24 * 60 * 60,
+        'trade_cal': 24 * 60 * 60,
+    }
+    # Seconds to keep the cached responses of the other APIs, or including today's data.
+    CACHE_TTL_DEFAULT = 5 * 60
+    # The params bound the dates of the response.
+    CACHE_DATE_PARAMS = ('trade_date', 'cal_date', 'end_date')
+
     class Meta:
         verbose_name = 'API'
 
-    class Timer:
-
-        PERIOD = 61
-
-        def __init__(self, api, *args, **kwargs):
-            self.api = api
-            self.reset()
-
-        def reset(self):
-            self.starter = time.time()
-            self.counter = 0
-
-        @property
-        def elapse(self):
-            return int(time.time() - self.starter)
-
-        def count(self, period=PERIOD):
-            '''
-            PARAMS:
-                * API throttling period, in seconds.
-            '''
-
-            if self.elapse > period:
-                self.reset()
-
-            self.counter += 1
-
-        def hang(self, period=PERIOD):
-            '''
-            PARAMS:
-                * API throttling period, in seconds.
-            '''
-
-            left = period - self.elapse
-            if left > 0:
-                print('%s: %s: WARNING: API has been throttling by server, was called %s times within %s seconds, sleeping %s seconds.' % (
-                    datetime.now(), self.api.code, self.counter, self.elapse, left))
-                time.sleep(left)
-
     def __str__(self):
         return '%s (%s)' % (self.name, self.code)
 
     def __init__(self, *args, **kwargs):
-        self.caller = tushare.pro_api()
-        self.timer = self.Timer(self)
+        self.pool = []
+        self.callers = {}
+        self.usage = defaultdict(lambda: {'calls': 0, 'waited': 0.0})
+        self.use_cache = True
+        # guards the callers, usage and pool shared by the threads calling the API
+        self.lock = threading.Lock()
 
         super(Api, self).__init__(*args, **kwargs)
 
     def set_token(self, token=None):
+        """
+        PARAMS:
+            * token:    Call the API with the token only.
+                        If None, call the API with the pool of all the active accounts,
+                        each call is scheduled on the account with the most quota left.
+        """
         if token:
-            self.caller.__init__(token)
+            self.pool = [Account.objects.filter(token=token).first() or Account(token=token)]
         else:
-            self.caller.__init__(Account.objects.first().token)
+            self.pool = list(Account.objects.filter(is_active=True, token__isnull=False).exclude(token=''))
+        if not self.pool:
+            raise Exception('No active account with token is found.')
+
+    def get_caller(self, account):
+        with self.lock:
+            if account.token not in self.callers:
+                caller = tushare.pro_api(account.token)
+                if settings.TUSHARE_API_URL:
+                    caller._DataApi__http_url = settings.TUSHARE_API_URL
+                self.callers[account.token] = caller
+            return self.callers[account.token]
+
+    def get_account_label(self, account):
+        return account.username or hashlib.sha1(account.token.encode()).hexdigest()[:16]
+
+    def get_account(self):
+        """
+        RETURN:
+            The account with the most tokens left in the rate limiter for this API.
+        """
+        if len(self.pool) == 1:
+            return self.pool[0]
+        # the buckets are read in one query, the token is taken from the chosen one only
+        pool = list(self.pool)
+        tokens = limiter.peek_many([self.get_rate_bucket(x.token, x) for x in pool])
+        return pool[tokens.index(max(tokens))]
+
+    def report_usage(self):
+        """
+        Print the calls and the seconds waited for the rate limit per account, and the cache stats.
+        """
+        for label, usage in self.usage.items():
+            print('%s: %s: usage of account %s: calls: %s, waited: %.1fs' % (
+                datetime.now(), self.code, label, usage['calls'], usage['waited']))
+        if cache:
+            print('%s: %s: usage of cache: %s' % (datetime.now(), self.code, cache.stats()))
+        return dict(self.usage)
+
+    def get_cache_ttl(self, **kwargs):
+        """
+        RETURN:
+            Seconds to keep the response of the call in cache.
+            None if the dates of the response are all closed, which never change.
+        """
+        today = datetime.today().strftime('%Y%m%d')
+        dates = [str(kwargs[x]) for x in self.CACHE_DATE_PARAMS if kwargs.get(x)]
+        if dates and max(dates) < today:
+            return None
+        if dates:
+            return self.CACHE_TTL_DEFAULT
+        return self.CACHE_TTL.get(self.code, self.CACHE_TTL_DEFAULT)
+
+    def get_rate_limit(self, account=None):
+        """
+        RETURN:
+            Calls allowed per minute for the account.
+        """
+        if self.rate_limit:
+            return self.rate_limit
+        credit = (account.credit if account else None) or 0
+        for min_credit, limit in self.RATE_LIMIT_TIERS:
+            if credit >= min_credit:
+                return limit
+
+    def get_pool_rate_limit(self):
+        """
+        RETURN:
+            Calls allowed per minute with all the accounts in the pool.
+        """
+        return sum(self.get_rate_limit(x) for x in self.pool)
+
+    def get_rate_bucket(self, token, account=None):
+        """
+        RETURN:
+            (key, rate, capacity) of the token bucket for the API and the token,
+            the calls within any `RATE_PERIOD` never exceed the rate limit.
+        """
+        key = '%s:%s' % (self.code, hashlib.sha1(token.encode()).hexdigest()[:16])
+        burst = self.RATE_BURST
+        rate = max(self.get_rate_limit(account) - burst, 1) / self.RATE_PERIOD
+        return key, rate, burst
 
     @classmethod
     def geterror(cls, exception):
@@ -147,17 +235,44 @@ class Api(models.Model):
             return 599, 'Unknown'
 
     def call(self, *args, **kwargs):
-        if not self.caller._DataApi__token:
+        if not self.pool:
             raise Exception('Set a token first with Api.set_token(self, [token]).')
         else:
-            func = getattr(self.caller, self.code)
-            while 1:
-                try:
-                    self.timer.count()
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    code, name = self.geterror(e)
-                    if code == 429:
-                        self.timer.hang()
-                    else:
-                        raise(e)
+            if cache and self.use_cache:
+                # responses of a stand-in API are cached apart from the real ones
+                key = cache.make_key(self.code, *args, api_url=settings.TUSHARE_API_URL, **kwargs)
+                df = cache.get(key)
+                if df is not None:
+                    return df
+                df = self.call_remote(*args, **kwargs)
+                cache.set(key, df, self.get_cache_ttl(**kwargs))
+                return df
+            return self.call_remote(*args, **kwargs)
+
+    def call_remote(self, *args, **kwargs):
+        while 1:
+            account = self.get_account()
+            bucket = self.get_rate_bucket(account.token, account)
+            label = self.get_account_label(account)
+            try:
+                waited = limiter.acquire(*bucket)
+                with self.lock:
+                    self.usage[label]['waited'] += waited
+                    self.usage[label]['calls'] += 1
+                return getattr(self.get_caller(account), self.code)(*args, **kwargs)
+            except Exception as e:
+                code, name = self.geterror(e)
+                if code == 429:
+                    # The limit is shared with the callers out of the limiter, or set too high.
+                    print('%s: %s: WARNING: API has been throttling by server for account %s, '
+                          'suspending it %s seconds.' % (
+                        datetime.now(), self.code, self.get_account_label(account), self.RATE_PERIOD))
+                    limiter.drain(*bucket, seconds=self.RATE_PERIOD)
+                elif code == 401 and len(self.pool) > 1:
+                    print('%s: %s: WARNING: token of account %s is unauthorized, removed from the pool.' % (
+                        datetime.now(), self.code, self.get_account_label(account)))
+                    with self.lock:
+                        if account in self.pool:
+                            self.pool.remove(account)
+                else:
+                    raise(e)
@@ -0,0 +1,218 @@
+"""
+Local stand-in of the Tushare.pro HTTP API.
+
+The tushare client posts `{"api_name", "token", "params", "fields"}` as JSON,
+and reads `{"code", "msg", "data": {"fields", "items"}}` back. The backends
+here answer the same protocol:
+    * Synthesizer:  Deterministic data for N stocks x M trade dates.
+    * Recorder:     Proxy to the real API, and save the responses.
+    * Player:       Replay the saved responses, fall back to another backend if missing.
+
+Point `settings.TUSHARE_API_URL` to the server to use it.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+THROTTLE_MSG = '抱歉，您每分钟最多访问该接口%s次，权限的具体详情访问：https://tushare.pro/document/1?doc_id=108。'
+
+
+class ApiError(Exception):
+
+    def __init__(self, msg, code=-1):
+        super(ApiError, self).__init__(msg)
+        self.code = code
+
+
+def request_digest(request):
+    """
+    RETURN:
+        The digest of the request without the token.
+    """
+    content = json.dumps([request.get('api_name'), request.get('params') or {}, request.get('fields') or ''],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class Synthesizer:
+    """
+    Deterministic data of `stocks` stocks on `dates` trade dates (weekdays) from `start_date`.
+    The same arguments always generate the same data.
+    """
+
+    def __init__(self, stocks=100, dates=20, start_date='20200101', seed=0):
+        self.seed = seed
+        self.stocks = []
+        for i in range(stocks):
+            if i % 2:
+                symbol, exchange, suffix = '%06d' % (i // 2 + 1), 'SZSE', 'SZ'
+            else:
+                symbol, exchange, suffix = '%06d' % (600000 + i // 2), 'SSE', 'SH'
+            self.stocks.append({
+                'symbol': symbol, 'ts_code': '%s.%s' % (symbol, suffix), 'name': 'STOCK%s' % symbol,
+                'exchange': exchange, 'market': '主板', 'list_status': 'L',
+                'list_date': start_date, 'delist_date': None,
+            })
+        self.ts_codes = [x['ts_code'] for x in self.stocks]
+        self.ts_code_set = set(self.ts_codes)
+
+        self.dates = []
+        d = datetime.strptime(start_date, '%Y%m%d')
+        while len(self.dates) < dates:
+            if d.weekday() < 5:
+                self.dates.append(d.strftime('%Y%m%d'))
+            d += timedelta(days=1)
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+
+    def price(self, ts_code, i):
+        """
+        RETURN:
+            The close price of the stock on the i-th date.
+        """
+        rnd = random.Random('%s:%s:%s' % (self.seed, ts_code, i))
+        base = 5 + int(hashlib.md5(ts_code.encode()).hexdigest()[:4], 16) % 50
+        return round(base * (1 + rnd.uniform(-0.1, 0.1)), 2)
+
+    def bar(self, ts_code, trade_date):
+        i = self.date_index[trade_date]
+        rnd = random.Random('%s:%s:%s:bar' % (self.seed, ts_code, trade_date))
+        close, pre_close = self.price(ts_code, i), self.price(ts_code, i - 1)
+        open_ = round(pre_close * (1 + rnd.uniform(-0.02, 0.02)), 2)
+        high = round(max(open_, close) * (1 + rnd.uniform(0, 0.02)), 2)
+        low = round(min(open_, close) * (1 - rnd.uniform(0, 0.02)), 2)
+        vol = round(rnd.uniform(1e3, 1e6), 2)
+        return {
+            'ts_code': ts_code, 'trade_date': trade_date, 'open': open_, 'high': high, 'low': low,
+            'close': close, 'pre_close': pre_close, 'change': round(close - pre_close, 2),
+            'pct_chg': round((close - pre_close) / pre_close * 100, 4), 'vol': vol,
+            'amount': round(vol * close / 10, 4),
+        }
+
+    def stock_basic(self, params):
+        exchange = params.get('exchange')
+        status = params.get('list_status') or 'L'
+        return [x for x in self.stocks if (not exchange or x['exchange'] == exchange) and x['list_status'] == status]
+
+    def trade_cal(self, params):
+        start, end = params.get('start_date') or '', params.get('end_date') or '99999999'
+        return [{'exchange': params.get('exchange') or 'SSE', 'cal_date': d, 'is_open': 1}
+                for d in self.dates if start <= d <= end]
+
+    def daily(self, params):
+        codes = params['ts_code'].split(',') if params.get('ts_code') else self.ts_codes
+        if params.get('trade_date'):
+            dates = [params['trade_date']]
+        else:
+            start, end = params.get('start_date') or '', params.get('end_date') or '99999999'
+            dates = [d for d in self.dates if start <= d <= end]
+        codes = [x for x in codes if x in self.ts_code_set]
+        return [self.bar(c, d) for d in dates if d in self.date_index for c in codes]
+
+    def __call__(self, request):
+        func = getattr(self, request.get('api_name') or '', None)
+        if func is None:
+            raise ApiError('请指定正确的接口名')
+        rows = func(request.get('params') or {})
+        fields = [x for x in (request.get('fields') or '').split(',') if x] or (list(rows[0].keys()) if rows else [])
+        return {'fields': fields, 'items': [[row.get(f) for f in fields] for row in rows]}
+
+
+class Recorder:
+    """
+    Proxy the requests to the `upstream` API, and save the responses under `path`.
+    """
+
+    def __init__(self, path, upstream='http://api.waditu.com'):
+        self.path = path
+        self.upstream = upstream
+
+    def __call__(self, request):
+        req = urllib.request.Request(self.upstream, data=json.dumps(request).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=60) as res:
+            result = json.loads(res.read().decode())
+        if result.get('code') != 0:
+            raise ApiError(result.get('msg'), result.get('code'))
+
+        file = os.path.join(self.path, request.get('api_name') or '', request_digest(request) + '.json')
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, 'w') as f:
+            json.dump({k: v for k, v in request.items() if k != 'token'}, f, ensure_ascii=False)
+            f.write('\n')
+            json.dump(result['data'], f, ensure_ascii=False)
+        return result['data']
+
+
+class Player:
+    """
+    Replay the responses saved by the Recorder, use the `fallback` backend if not found.
+    """
+
+    def __init__(self, path, fallback=None):
+        self.path = path
+        self.fallback = fallback
+
+    def __call__(self, request):
+        file = os.path.join(self.path, request.get('api_name') or '', request_digest(request) + '.json')
+        if os.path.exists(file):
+            with open(file) as f:
+                f.readline()
+                return json.loads(f.readline())
+        if self.fallback:
+            return self.fallback(request)
+        raise ApiError('No recorded response for %s.' % request)
+
+
+class Server(ThreadingHTTPServer):
+    """
+    Serve the `backend`, with optional latency and throttling errors injected.
+    PARAMS:
+        * backend:      Callable taking the request dict, returning the data dict.
+        * latency:      Seconds to delay each response.
+        * error_rate:   Fraction of requests answered with the throttling error.
+        * seed:         Seed of the injected errors.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, backend, latency=0, error_rate=0, seed=0):
+        super(Server, self).__init__(address, Handler)
+        self.backend = backend
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.counter = 0
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        server.counter += 1
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode())
+            if server.latency:
+                time.sleep(server.latency)
+            if server.error_rate and server.random.random() < server.error_rate:
+                raise ApiError(THROTTLE_MSG % 500, 40203)
+            result = {'code': 0, 'msg': '', 'data': server.backend(request)}
+        except ApiError as e:
+            result = {'code': e.code, 'msg': str(e), 'data': None}
+        body = json.dumps(result, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
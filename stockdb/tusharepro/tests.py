@@ -1,3 +1,37 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from tusharepro.models import Account, Api
+
 
 # Create your tests here.
+
+class ApiCallTest(SimpleTestCase):
+
+    def setUp(self):
+        self.api = Api(code='daily', name='daily', rate_limit=100)
+        self.api.pool = [Account(username='a', token='a' * 32), Account(username='b', token='b' * 32)]
+        self.caller = mock.Mock()
+        self.api.get_caller = mock.Mock(return_value=self.caller)
+        patcher = mock.patch('tusharepro.models.limiter')
+        self.limiter = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter.acquire.return_value = 0.0
+
+    def test_drain_on_429(self):
+        self.limiter.peek_many.return_value = [1.0, 2.0]
+        self.caller.daily.side_effect = [Exception('抱歉，您每分钟最多访问该接口100次'), 'data']
+
+        self.assertEqual(self.api.call_remote(trade_date='19991231'), 'data')
+        account = self.api.pool[1]
+        self.limiter.drain.assert_called_once_with(
+            *self.api.get_rate_bucket(account.token, account), seconds=Api.RATE_PERIOD)
+        self.assertEqual(self.api.usage['b']['calls'], 2)
+
+    def test_unauthorized_removed(self):
+        self.limiter.peek_many.side_effect = lambda buckets: [1.0] * len(buckets)
+        self.caller.daily.side_effect = [Exception('您的TOKEN无效'), 'data']
+
+        self.assertEqual(self.api.call_remote(trade_date='19991231'), 'data')
+        self.assertEqual([x.username for x in self.api.pool], ['b'])
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import pandas
+
+
+class DataFrameCache:
+    """
+    Content-addressed DataFrame cache on local disk.
+
+    The DataFrames are stored as Parquet files named by the digest of the key,
+    the entries are indexed in a SQLite file with their size, expiry and last
+    access time. The least recently used entries are evicted once the total
+    size exceeds `max_size`. The cache is shared by the threads and processes
+    using the same path.
+    """
+
+    def __init__(self, path, max_size=None):
+        """
+        PARAMS:
+            * path:     The directory of the cache.
+            * max_size: The max total size of the cached files, in bytes.
+                        If None, unlimited.
+        """
+        self.path = str(path)
+        self.max_size = max_size
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def make_key(cls, *args, **kwargs):
+        """
+        RETURN:
+            The digest of the arguments, the kwargs with None value are ignored.
+        """
+        kwargs = {k: str(v) for k, v in kwargs.items() if v is not None}
+        content = json.dumps([[str(x) for x in args], kwargs], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def connect(self):
+        # SQLite connections can't be shared by threads or forked processes.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.path, 'index.sqlite3'), timeout=60, isolation_level=None)
+            conn.execute('CREATE TABLE IF NOT EXISTS entry ('
+                         'key TEXT PRIMARY KEY, size INTEGER NOT NULL, expires REAL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entry_accessed ON entry (accessed)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entry_expires ON entry (expires)')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get_file(self, key):
+        return os.path.join(self.path, key[:2], key + '.parquet')
+
+    def get(self, key):
+        """
+        RETURN:
+            The cached DataFrame, or None if missing or expired.
+        """
+        conn = self.connect()
+        now = time.time()
+        row = conn.execute('SELECT expires FROM entry WHERE key = ?', (key,)).fetchone()
+        if row is not None and (row[0] is None or row[0] > now):
+            try:
+                df = pandas.read_parquet(self.get_file(key))
+            except (OSError, ValueError):
+                df = None
+            if df is not None:
+                conn.execute('UPDATE entry SET accessed = ? WHERE key = ?', (now, key))
+                self.hits += 1
+                return df
+        if row is not None:
+            self.delete(key)
+        self.misses += 1
+        return None
+
+    def set(self, key, df, ttl=None):
+        """
+        PARAMS:
+            * ttl:  Seconds to keep the DataFrame.
+                    If None, never expire.
+        """
+        if len(df.columns) == 0:
+            return
+        file = self.get_file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = '%s.%s.%s.tmp' % (file, os.getpid(), threading.get_ident())
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, file)
+
+        now = time.time()
+        self.connect().execute('INSERT OR REPLACE INTO entry (key, size, expires, accessed) VALUES (?, ?, ?, ?)',
+                               (key, os.path.getsize(file), now + ttl if ttl is not None else None, now))
+        self.evict()
+
+    def delete(self, key):
+        self.connect().execute('DELETE FROM entry WHERE key = ?', (key,))
+        try:
+            os.remove(self.get_file(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """
+        Remove the expired entries, and the least recently used entries above `max_size`.
+        """
+        conn = self.connect()
+        for (key,) in conn.execute('SELECT key FROM entry WHERE expires <= ?', (time.time(),)).fetchall():
+            self.delete(key)
+        if not self.max_size:
+            return
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entry').fetchone()[0]
+        if total <= self.max_size:
+            return
+        for key, size in conn.execute('SELECT key, size FROM entry ORDER BY accessed').fetchall():
+            self.delete(key)
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def stats(self):
+        """
+        RETURN:
+            {'hits': {hits}, 'misses': {misses}, 'entries': {entries}, 'size': {bytes}}
+        """
+        entries, size = self.connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entry').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size': size}
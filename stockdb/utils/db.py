@@ -0,0 +1,96 @@
+from django.db import connections, transaction, router
+from django.utils import timezone
+
+from utils.functional import chunks
+
+
+def bulk_upsert(model, fields, rows, unique_fields, update_fields=None, batch_size=5000, using=None):
+    """
+    Insert the rows in batches, the rows conflicting with existing ones on the unique
+    key are updated instead, each batch takes one round trip:
+        * MySQL:            INSERT ... ON DUPLICATE KEY UPDATE
+        * SQLite, Postgres: INSERT ... ON CONFLICT (...) DO UPDATE
+
+    The `auto_now_add` and `auto_now` fields of the model are set to now, the
+    `auto_now_add` fields are not updated on conflicts. The values are passed to the
+    DB driver as they are, so they must be Python native and not NaN.
+
+    PARAMS:
+        * model:            The model class.
+        * fields:           The attnames of the values in the rows, example: ['stock_id', 'date', 'close'].
+        * rows:             Iterable of tuples of the values, in the order of `fields`.
+        * unique_fields:    The attnames of the unique key, example: ['stock_id', 'period_id', 'date'].
+        * update_fields:    The attnames to update on conflicts.
+                            If None, all the `fields` except `unique_fields`.
+                            If empty, the conflicting rows are skipped.
+        * batch_size:       The max rows in one statement.
+    RETURN:
+        The number of rows written.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    opts = model._meta
+    qn = connection.ops.quote_name
+
+    fields = list(fields)
+    if update_fields is None:
+        update_fields = [x for x in fields if x not in unique_fields]
+
+    # auto timestamps, prepared once for all the rows
+    now = timezone.now()
+    extra = {}
+    for f in opts.concrete_fields:
+        if f.attname not in fields and (getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)):
+            extra[f.attname] = f.get_db_prep_save(now, connection)
+            if getattr(f, 'auto_now', False) and update_fields:
+                update_fields = list(update_fields) + [f.attname]
+
+    columns = [opts.get_field(x).column for x in fields + list(extra.keys())]
+    column_sql = ', '.join(qn(x) for x in columns)
+    row_sql = '(%s)' % ', '.join(['%s'] * len(columns))
+    update_columns = [opts.get_field(x).column for x in update_fields]
+    unique_columns = [opts.get_field(x).column for x in unique_fields]
+
+    conflict = get_conflict_sql(connection.vendor, qn, opts.pk.column, unique_columns, update_columns)
+
+    rows = list(rows)
+    batch_size = max(1, min(batch_size, connection.ops.bulk_batch_size(columns, rows) or batch_size))
+    extra_values = tuple(extra.values())
+
+    written = 0
+    with transaction.atomic(using=using, savepoint=False), connection.cursor() as cursor:
+        for batch in chunks(rows, batch_size):
+            sql = 'INSERT INTO %s (%s) VALUES %s %s' % (
+                qn(opts.db_table), column_sql, ', '.join([row_sql] * len(batch)), conflict)
+            cursor.execute(sql, [v for row in batch for v in tuple(row) + extra_values])
+            written += len(batch)
+    return written
+
+
+def get_conflict_sql(vendor, qn, pk_column, unique_columns, update_columns):
+    """
+    RETURN:
+        The clause of `bulk_upsert()` on the conflicting rows, example:
+        'ON DUPLICATE KEY UPDATE `close` = VALUES(`close`)'.
+    """
+    if vendor == 'mysql':
+        # a no-op update skips the conflicting rows, unlike INSERT IGNORE, other errors are still raised
+        return 'ON DUPLICATE KEY UPDATE %s' % (', '.join(
+            '%s = VALUES(%s)' % (qn(x), qn(x)) for x in update_columns) if update_columns else
+            '%s = %s' % (qn(pk_column), qn(pk_column)))
+    return 'ON CONFLICT (%s) %s' % (', '.join(qn(x) for x in unique_columns), 'DO UPDATE SET %s' % ', '.join(
+        '%s = excluded.%s' % (qn(x), qn(x)) for x in update_columns) if update_columns else 'DO NOTHING')
+
+
+def frame_to_rows(df, fields):
+    """
+    RETURN:
+        Tuples of Python native values from the columns of the DataFrame, NaN as None.
+    """
+    columns = []
+    for f in fields:
+        values = df[f].tolist()
+        if df[f].isna().any():
+            values = [None if x != x else x for x in values]
+        columns.append(values)
+    return zip(*columns)
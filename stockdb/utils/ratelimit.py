@@ -0,0 +1,109 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter.
+
+    The buckets are kept in a SQLite file, so the limits are shared by all the
+    threads and processes using the same file. Each bucket is updated in a
+    `BEGIN IMMEDIATE` transaction, callers reserve a token and sleep only the
+    time until the token is refilled.
+
+    A bucket is decided by:
+        * key:      Any string, example: '{api_code}:{account}'.
+        * rate:     The tokens refilled per second.
+        * capacity: The max tokens kept in the bucket, which is the max burst.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+
+    def connect(self):
+        # SQLite connections can't be shared by threads or forked processes.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket ('
+                         'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def update(self, key, rate, capacity, func):
+        """
+        Refill the bucket and set its tokens to `func(tokens)` in one transaction.
+        RETURN:
+            The tokens left in the bucket, negative if reserved in advance.
+        """
+        conn = self.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            tokens = func(tokens)
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return tokens
+
+    def peek(self, key, rate, capacity):
+        """
+        RETURN:
+            The tokens available in the bucket now.
+        """
+        return self.peek_many([(key, rate, capacity)])[0]
+
+    def peek_many(self, buckets):
+        """
+        Read the buckets in one read-only query, without the write lock of `update()`.
+        PARAMS:
+            * buckets:  [(key, rate, capacity), ...]
+        RETURN:
+            The tokens available in the buckets now, in the order of `buckets`.
+        """
+        keys = [x[0] for x in buckets]
+        rows = self.connect().execute('SELECT key, tokens, updated FROM bucket WHERE key IN (%s)' % (
+            ', '.join(['?'] * len(keys))), keys).fetchall()
+        rows = {key: (tokens, updated) for key, tokens, updated in rows}
+        now = time.time()
+        results = []
+        for key, rate, capacity in buckets:
+            row = rows.get(key)
+            results.append(capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate))
+        return results
+
+    def reserve(self, key, rate, capacity, tokens=1):
+        """
+        Take the tokens from the bucket, the tokens are borrowed if not enough.
+        RETURN:
+            The seconds to wait before the tokens are really available.
+        """
+        left = self.update(key, rate, capacity, lambda x: x - tokens)
+        return max(0.0, -left / rate) if rate > 0 else 0.0
+
+    def acquire(self, key, rate, capacity, tokens=1):
+        """
+        Take the tokens from the bucket, sleep until they are available.
+        RETURN:
+            The seconds waited.
+        """
+        wait = self.reserve(key, rate, capacity, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def drain(self, key, rate, capacity, seconds):
+        """
+        Empty the bucket and borrow the tokens of the next `seconds`,
+        used when the limit is found to be exceeded anyway.
+        """
+        self.update(key, rate, capacity, lambda x: min(x, 0) - rate * seconds)
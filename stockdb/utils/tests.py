@@ -0,0 +1,131 @@
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import pandas
+from django.test import SimpleTestCase, TestCase
+
+from common.models import Currency
+from utils.cache import DataFrameCache
+from utils.db import bulk_upsert, get_conflict_sql
+from utils.ratelimit import RateLimiter
+
+
+# Create your tests here.
+
+class BulkUpsertTest(TestCase):
+    fields = ['code', 'name', 'symbol']
+
+    def test_insert(self):
+        written = bulk_upsert(Currency, self.fields, [('CNY', 'Yuan', '¥'), ('USD', 'Dollar', '$')],
+                              unique_fields=['code'])
+        self.assertEqual(written, 2)
+        self.assertEqual(dict(Currency.objects.values_list('code', 'name')), {'CNY': 'Yuan', 'USD': 'Dollar'})
+        self.assertFalse(Currency.objects.filter(dt_created__isnull=True).exists())
+
+    def test_upsert_update_fields(self):
+        bulk_upsert(Currency, self.fields, [('CNY', 'Yuan', '¥')], unique_fields=['code'])
+        created = Currency.objects.get(code='CNY').dt_created
+        bulk_upsert(Currency, self.fields, [('CNY', 'Renminbi', 'R'), ('USD', 'Dollar', '$')],
+                    unique_fields=['code'], update_fields=['name'])
+        obj = Currency.objects.get(code='CNY')
+        self.assertEqual((obj.name, obj.symbol, obj.dt_created), ('Renminbi', '¥', created))
+        self.assertEqual(Currency.objects.count(), 2)
+
+    def test_upsert_skip(self):
+        bulk_upsert(Currency, self.fields, [('CNY', 'Yuan', '¥')], unique_fields=['code'])
+        bulk_upsert(Currency, self.fields, [('CNY', 'Renminbi', 'R')], unique_fields=['code'], update_fields=[])
+        self.assertEqual(Currency.objects.get(code='CNY').name, 'Yuan')
+        self.assertEqual(Currency.objects.count(), 1)
+
+    def test_conflict_sql(self):
+        qn = lambda x: '`%s`' % x
+        self.assertEqual(get_conflict_sql('mysql', qn, 'id', ['code'], ['name', 'dt_updated']),
+                         'ON DUPLICATE KEY UPDATE `name` = VALUES(`name`), `dt_updated` = VALUES(`dt_updated`)')
+        self.assertEqual(get_conflict_sql('mysql', qn, 'id', ['code'], []), 'ON DUPLICATE KEY UPDATE `id` = `id`')
+        self.assertEqual(get_conflict_sql('sqlite', qn, 'id', ['code'], ['name']),
+                         'ON CONFLICT (`code`) DO UPDATE SET `name` = excluded.`name`')
+        self.assertEqual(get_conflict_sql('sqlite', qn, 'id', ['code'], []), 'ON CONFLICT (`code`) DO NOTHING')
+
+
+class RateLimiterTest(SimpleTestCase):
+    bucket = ('api:account', 2.0, 3)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.limiter = RateLimiter(Path(tmp.name) / 'ratelimit.sqlite3')
+        patcher = mock.patch('utils.ratelimit.time')
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.time.time.return_value = 100.0
+
+    def test_refill(self):
+        self.assertEqual(self.limiter.peek(*self.bucket), 3)
+        self.assertEqual(self.limiter.reserve(*self.bucket, tokens=3), 0)
+        # borrowed, available after 1 / rate seconds
+        self.assertEqual(self.limiter.reserve(*self.bucket), 0.5)
+        self.assertEqual(self.limiter.peek(*self.bucket), -1)
+        self.time.time.return_value = 101.0
+        self.assertEqual(self.limiter.peek(*self.bucket), 1)
+        # never refilled above the capacity
+        self.time.time.return_value = 200.0
+        self.assertEqual(self.limiter.peek_many([self.bucket, ('api:other', 1.0, 5)]), [3, 5])
+
+    def test_acquire(self):
+        self.limiter.reserve(*self.bucket, tokens=3)
+        self.assertEqual(self.limiter.acquire(*self.bucket), 0.5)
+        self.time.sleep.assert_called_once_with(0.5)
+
+    def test_drain(self):
+        self.limiter.drain(*self.bucket, seconds=10)
+        # the tokens of the next 10 seconds are borrowed
+        self.assertEqual(self.limiter.peek(*self.bucket), -20)
+        self.assertEqual(self.limiter.reserve(*self.bucket), 10.5)
+
+
+class DataFrameCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = DataFrameCache(Path(tmp.name) / 'cache')
+        self.df = pandas.DataFrame({'ts_code': ['600000.SH', '000001.SZ'], 'close': [10.0, 11.5]})
+        patcher = mock.patch('utils.cache.time')
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.time.time.return_value = 100.0
+
+    def test_key(self):
+        self.assertEqual(DataFrameCache.make_key('daily', trade_date='19991231', ts_code=None),
+                         DataFrameCache.make_key('daily', trade_date='19991231'))
+        self.assertNotEqual(DataFrameCache.make_key('daily', trade_date='19991231'),
+                            DataFrameCache.make_key('daily', trade_date='19991230'))
+
+    def test_hit_and_miss(self):
+        key = DataFrameCache.make_key('daily', trade_date='19991231')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, self.df)
+        pandas.testing.assert_frame_equal(self.cache.get(key), self.df)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_expiry(self):
+        key = DataFrameCache.make_key('daily', trade_date='19991231')
+        self.cache.set(key, self.df, ttl=60)
+        self.time.time.return_value = 159.0
+        self.assertIsNotNone(self.cache.get(key))
+        self.time.time.return_value = 160.0
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_evict(self):
+        first, second = DataFrameCache.make_key('a'), DataFrameCache.make_key('b')
+        self.cache.set(first, self.df)
+        self.cache.max_size = self.cache.stats()['size']
+        self.time.time.return_value = 101.0
+        self.cache.set(second, self.df)
+        # the least recently used entries are evicted above max_size
+        self.assertIsNone(self.cache.get(first))
+        self.assertIsNotNone(self.cache.get(second))